@@ -8,7 +8,9 @@ from tqdm import tqdm
 from h3ds.dataset import H3DS
 from h3ds.mesh import Mesh
 from h3ds.log import logger
-from h3ds.utils import error_to_color, download_file_from_google_drive, create_parent_directory, create_directory, remove
+from h3ds.results import ResultsStore
+from h3ds.regions import RegionIndex
+from h3ds.utils import error_to_color, download_file_from_google_drive, create_parent_directory, create_directory, remove, md5
 
 
 def method_file_id(method, config_id=None):
@@ -76,6 +78,10 @@ def main(h3ds_path, h3ds_token, method, config_id, output_dir):
     h3ds_scenes = h3ds.scenes(tags={'sira++'})
     eval_dir = os.path.join(output_dir, 'evaluation', method)
 
+    # Results already computed in a previous run are stored and skipped
+    store = ResultsStore(os.path.join(output_dir, 'evaluation'),
+                         f'{method}_{config_id}')
+
     num_scenes = len(h3ds_scenes)
     for i, scene_id in enumerate(h3ds_scenes):
 
@@ -89,13 +95,28 @@ def main(h3ds_path, h3ds_token, method, config_id, output_dir):
                 f'Evaluating {method} reconstruction with {views_config_id} views from scene {scene_id}. ({i+1}/{num_scenes})'
             )
 
+            # Skip the evaluation if it is already stored
+            pred_file = os.path.join(method_dir,
+                                     f'{scene_id}_{views_config_id}.ply')
+            key_head, key_face = [
+                store.key(scene_id, views_config_id, r, md5(pred_file),
+                          h3ds.helper.version_config())
+                for r in [None, 'face_sphere']
+            ]
+            if key_head in store and key_face in store:
+                metrics_head[scene_id][views_config_id] = store.metrics(
+                    key_head)['chamfer_gt_pred']
+                metrics_face[scene_id][views_config_id] = store.metrics(
+                    key_face)['chamfer_gt_pred']
+                logger.info(' > Results found in the store - Skipping')
+                continue
+
             # Get scene in millimiters
             mesh_gt, images, masks, cameras = h3ds.load_scene(
                 scene_id, views_config_id)
 
             # Load predicted 3D reconstruction.
-            mesh_pred = Mesh().load(
-                os.path.join(method_dir, f'{scene_id}_{views_config_id}.ply'))
+            mesh_pred = Mesh().load(pred_file)
             landmarks_pred = None
 
             # Evaluate scene. The `landmarks_pred` are optional and, if provided, they will be used
@@ -104,6 +125,7 @@ def main(h3ds_path, h3ds_token, method, config_id, output_dir):
             chamfer_gt_pred, chamfer_pred_gt, mesh_gt, mesh_pred_aligned = \
                 h3ds.evaluate_scene(scene_id, mesh_pred, landmarks_pred)
 
+            store.append(key_head, chamfer_gt_pred, chamfer_pred_gt)
             metrics_head[scene_id][views_config_id] = np.mean(chamfer_gt_pred)
             logger.info(
                 f' > Chamfer distance full head (mm): {metrics_head[scene_id][views_config_id]}'
@@ -129,6 +151,7 @@ def main(h3ds_path, h3ds_token, method, config_id, output_dir):
 
             # Note that in both cases we only report the chamfer distane computed from the ground truth
             # to the prediction, since here we have control over the region where the metric is computed.
+            store.append(key_face, chamfer_gt_pred, chamfer_pred_gt)
             metrics_face[scene_id][views_config_id] = np.mean(chamfer_gt_pred)
             logger.info(
                 f' > Chamfer distance face (mm): {metrics_face[scene_id][views_config_id]}'
@@ -146,11 +169,9 @@ def main(h3ds_path, h3ds_token, method, config_id, output_dir):
             # Ideally one should use landmarks_pred but here we are using landmarks_true because the
             # landmarks_pred are not available.
             landmarks_true = h3ds.load_landmarks(scene_id)
-            mask_sphere = np.where(
-                np.linalg.norm(mesh_pred_aligned.vertices -
-                               mesh_gt.vertices[landmarks_true['nose_tip']],
-                               axis=-1) < 95)
-            mesh_pred_aligned = mesh_pred_aligned.cut(mask_sphere)
+            region_sphere = RegionIndex(mesh_pred_aligned.vertices).sphere(
+                mesh_gt.vertices[landmarks_true['nose_tip']], 95)
+            mesh_pred_aligned = mesh_pred_aligned.cut(region_sphere)
 
             mesh_pred_aligned.save(
                 os.path.join(eval_dir, 'face_sphere',
@@ -0,0 +1,5 @@
+import sys
+
+from h3ds.cli import main
+
+sys.exit(main())
@@ -7,6 +7,7 @@ class AffineTransform:
     def __init__(self, dim: int = 3, matrix: np.ndarray = np.eye(4)):
         self.dim = dim
         self.matrix = np.copy(matrix)
+        self._inverse = None
 
     def load(self, filename: str):
         with open(filename, 'r') as json_file:
@@ -32,16 +33,70 @@ class AffineTransform:
         with open(filename, 'w') as f:
             json.dump(data, f)
 
-    def transform(self, points: np.ndarray):
-        # Assuming ( n_points, dim)
-        n_points, dim = points.shape
-        assert dim == self.dim
-
-        # Project points
-        points_h = np.concatenate((points.T, np.ones((1, n_points))), axis=0)
-        return np.dot(self.matrix, points_h)[:self.dim, :].T
+    def transform(self, points: np.ndarray, out: np.ndarray = None):
+        # Assuming ( n_points, dim) or ( batch, n_points, dim)
+        assert points.shape[-1] == self.dim
+        return transform_points(self.matrix, points, out=out)
 
     def inverse(self):
-        t = AffineTransform(dim=self.dim)
-        t.matrix = np.linalg.inv(self.matrix)
-        return t
\ No newline at end of file
+        # The inverse is cached until the matrix changes
+        if self._inverse is None or not np.array_equal(self._inverse[0],
+                                                       self.matrix):
+            self._inverse = (np.copy(self.matrix), np.linalg.inv(self.matrix))
+
+        t = AffineTransform(dim=self.dim, matrix=self._inverse[1])
+        t._inverse = (t.matrix.copy(), self._inverse[0])
+        return t
+
+
+def transform_points(matrices: np.ndarray,
+                     points: np.ndarray,
+                     out: np.ndarray = None):
+    """
+    Applies one or many affine transforms to one or many sets of points as
+    R @ p + t, without building homogeneous coordinates. The floating point
+    type of the points is kept. Matrices and points are broadcasted, so that
+    (K, 4, 4) matrices and (N, 3) points give (K, N, 3) points, and (B, 4, 4)
+    matrices with (B, N, 3) points transform each batch element on its own.
+    Args:
+        matrices (np.ndarray): (..., dim+1, dim+1) affine matrices
+        points   (np.ndarray): (..., N, dim) points
+        out      (np.ndarray): Optional output buffer. It can be `points`
+    Returns:
+        np.ndarray: (..., N, dim) transformed points
+    """
+    dim = points.shape[-1]
+    dtype = np.result_type(points.dtype, np.float32)
+    matrices = np.asarray(matrices).astype(dtype, copy=False)
+    R = matrices[..., :dim, :dim]
+    t = matrices[..., np.newaxis, :dim, dim]
+
+    out = np.matmul(points, np.swapaxes(R, -1, -2), out=out)
+    out += t
+    return out
+
+
+def compose_transforms(*matrices: np.ndarray):
+    """
+    Composes a sequence of (possibly stacked) affine matrices, so that the
+    result applies the last one first, like matrices[0] @ ... @ matrices[-1].
+    Args:
+        matrices (np.ndarray): (..., dim+1, dim+1) affine matrices
+    Returns:
+        np.ndarray: (..., dim+1, dim+1) composed affine matrices
+    """
+    composed = matrices[0]
+    for m in matrices[1:]:
+        composed = np.matmul(composed, m)
+    return composed
+
+
+def invert_transforms(matrices: np.ndarray):
+    """
+    Inverts a stack of affine matrices at once.
+    Args:
+        matrices (np.ndarray): (..., dim+1, dim+1) affine matrices
+    Returns:
+        np.ndarray: (..., dim+1, dim+1) inverted affine matrices
+    """
+    return np.linalg.inv(matrices)
@@ -0,0 +1,263 @@
+import os
+import json
+import zlib
+import struct
+import threading
+
+from h3ds.profiling import profiler
+
+# Local file header of a zip member, see the PKWARE APPNOTE
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+LOCAL_HEADER_SIGNATURE = b'PK\003\004'
+
+# Fields of each member in the index
+OFFSET, COMPRESS_SIZE, FILE_SIZE, COMPRESS_TYPE, FLAG_BITS, CRC, DOS_TIME = range(
+    7)
+
+_CRC_TABLE = None
+
+
+def _crc_table():
+    global _CRC_TABLE
+    if _CRC_TABLE is None:
+        _CRC_TABLE = []
+        for i in range(256):
+            crc = i
+            for _ in range(8):
+                crc = (crc >> 1) ^ 0xEDB88320 if crc & 1 else crc >> 1
+            _CRC_TABLE.append(crc)
+    return _CRC_TABLE
+
+
+def zipcrypto_decrypt(data: bytes, password: bytes):
+    """
+    Decrypts a member encrypted with the traditional PKWARE encryption
+    (ZipCrypto). It is a byte-serial stream cipher, so the loop keeps all the
+    state in local variables.
+    Args:
+        data     (bytes): Encrypted data, including the 12 bytes header
+        password (bytes): Password
+    Returns:
+        bytes: Decrypted data, including the 12 bytes header
+    """
+    table = _crc_table()
+    key0, key1, key2 = 0x12345678, 0x23456789, 0x34567890
+    for c in password:
+        key0 = (key0 >> 8) ^ table[(key0 ^ c) & 0xFF]
+        key1 = ((key1 + (key0 & 0xFF)) * 134775813 + 1) & 0xFFFFFFFF
+        key2 = (key2 >> 8) ^ table[(key2 ^ (key1 >> 24)) & 0xFF]
+
+    result = bytearray(len(data))
+    for i, c in enumerate(data):
+        k = key2 | 2
+        c ^= ((k * (k ^ 1)) >> 8) & 0xFF
+        result[i] = c
+        key0 = (key0 >> 8) ^ table[(key0 ^ c) & 0xFF]
+        key1 = ((key1 + (key0 & 0xFF)) * 134775813 + 1) & 0xFFFFFFFF
+        key2 = (key2 >> 8) ^ table[(key2 ^ (key1 >> 24)) & 0xFF]
+    return bytes(result)
+
+
+def read_member(archive_path: str, member: list, password: bytes = None):
+    """
+    Reads a single member of a zip file from its offset, without parsing the
+    central directory.
+    Args:
+        archive_path (str): Path of the zip file
+        member      (list): Member fields of the index
+        password   (bytes): Password of encrypted members
+    Returns:
+        bytes: Decompressed data
+    """
+    with open(archive_path, 'rb') as f:
+        f.seek(member[OFFSET])
+        header = LOCAL_HEADER.unpack(f.read(LOCAL_HEADER.size))
+        if header[0] != LOCAL_HEADER_SIGNATURE:
+            raise ValueError(f'Bad zip member header in {archive_path}')
+        f.seek(header[-2] + header[-1], os.SEEK_CUR)
+        data = f.read(member[COMPRESS_SIZE])
+
+    if member[FLAG_BITS] & 0x1:
+        if password is None:
+            raise RuntimeError(
+                f'{archive_path} is encrypted, a password is required')
+        with profiler.stage('archive.decrypt', len(data)):
+            data = zipcrypto_decrypt(data, password)
+        # The last byte of the header checks the password
+        check = member[DOS_TIME] >> 8 if member[
+            FLAG_BITS] & 0x8 else member[CRC] >> 24
+        if data[11] != check & 0xFF:
+            raise RuntimeError(f'Bad password for {archive_path}')
+        data = data[12:]
+
+    if member[COMPRESS_TYPE] == 8:
+        data = zlib.decompress(data, -15)
+    elif member[COMPRESS_TYPE] != 0:
+        raise NotImplementedError(
+            f'Compression method {member[COMPRESS_TYPE]} is not supported')
+
+    if zlib.crc32(data) != member[CRC]:
+        raise ValueError(f'Bad CRC of a member of {archive_path}')
+    return data
+
+
+def extract_member(archive_path: str, member: list, password: bytes,
+                   destination: str):
+    """
+    Reads a member of a zip file and writes it atomically to a destination.
+    """
+    data = read_member(archive_path, member, password)
+    # Several processes may create the same directory
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    tmp_path = f'{destination}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, destination)
+    return destination
+
+
+class ZipArchive:
+
+    def __init__(self,
+                 path: str,
+                 root: str,
+                 password: str = None,
+                 max_workers: int = 4):
+        """
+        Random access to the members of a (password protected) zip file. The
+        offsets of the members are indexed once and stored next to the zip, so
+        later instances do not parse the central directory again. Members are
+        decrypted on demand, in parallel in a pool of processes since the
+        decryption is pure Python, and written to their path under `root`,
+        which acts as a cache: each member is decrypted at most once.
+        Args:
+            path        (str): Path of the zip file
+            root        (str): Directory where the members are extracted
+            password    (str): Password of the zip file
+            max_workers (int): Maximum processes decrypting members
+        """
+        self.path = path
+        self.root = root
+        self.password = password.encode('utf-8') if password else None
+        self.max_workers = max_workers
+        self.members = self._load_index()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def __contains__(self, path: str):
+        return self.member_name(path) in self.members
+
+    def __len__(self):
+        return len(self.members)
+
+    def index_file(self):
+        return f'{self.path}.index.json'
+
+    def member_name(self, path: str):
+        """
+        Name of the member of a path under `root`.
+        """
+        rel_path = os.path.relpath(os.path.abspath(path),
+                                   os.path.abspath(self.root))
+        return rel_path.replace(os.sep, '/')
+
+    def fetch(self, paths: list):
+        """
+        Makes sure a list of paths under `root` exist, extracting the missing
+        ones from the zip file. Paths that are not members are left as they are.
+        Args:
+            paths (list): Paths under `root`
+        Returns:
+            list: The same paths
+        """
+        missing = [
+            p for p in paths
+            if not os.path.exists(p) and self.member_name(p) in self.members
+        ]
+        jobs = [(self.path, self.members[self.member_name(p)], self.password, p)
+                for p in missing]
+
+        nbytes = sum(job[1][FILE_SIZE] for job in jobs)
+        with profiler.stage('archive.fetch', nbytes):
+            if len(jobs) > 1 and self.max_workers > 1:
+                list(self._get_executor().map(extract_member, *zip(*jobs)))
+            else:
+                for job in jobs:
+                    extract_member(*job)
+
+        return paths
+
+    def read(self, path: str):
+        """
+        Reads a member in memory, without extracting it.
+        Args:
+            path (str): Path under `root`
+        Returns:
+            bytes: The content of the member
+        """
+        name = self.member_name(path)
+        if name not in self.members:
+            raise FileNotFoundError(f'{name} is not in {self.path}')
+        return read_member(self.path, self.members[name], self.password)
+
+    def glob(self, directory: str, extension: str = ''):
+        """
+        Paths of the members inside a directory under `root`.
+        """
+        prefix = self.member_name(directory) + '/'
+        return sorted(
+            os.path.join(self.root, *name.split('/'))
+            for name in self.members
+            if name.startswith(prefix) and name.endswith(extension) and
+            '/' not in name[len(prefix):])
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                from concurrent.futures import ProcessPoolExecutor
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers)
+            return self._executor
+
+    def _load_index(self):
+        """
+        Internal method: Loads the index of the members, building it if it does
+        not exist or if the zip file changed.
+        Returns:
+            dict: {member name: member fields}
+        """
+        stat = os.stat(self.path)
+        key = [stat.st_size, stat.st_mtime_ns]
+        try:
+            with open(self.index_file()) as f:
+                index = json.load(f)
+            if index['key'] == key:
+                return index['members']
+        except (OSError, ValueError, KeyError):
+            pass
+
+        import zipfile
+        with profiler.stage('archive.index'):
+            with zipfile.ZipFile(self.path) as zip_ref:
+                members = {
+                    info.filename: [
+                        info.header_offset, info.compress_size, info.file_size,
+                        info.compress_type, info.flag_bits, info.CRC,
+                        (info.date_time[3] << 11) | (info.date_time[4] << 5) |
+                        (info.date_time[5] // 2)
+                    ] for info in zip_ref.infolist() if not info.is_dir()
+                }
+
+        tmp_path = f'{self.index_file()}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'key': key, 'members': members}, f)
+            os.replace(tmp_path, self.index_file())
+        except OSError:
+            pass
+        return members
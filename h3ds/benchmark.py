@@ -0,0 +1,489 @@
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+import toml
+import trimesh
+import numpy as np
+from PIL import Image
+
+from h3ds import __version__
+from h3ds.log import logger
+from h3ds.mesh import Mesh
+from h3ds.dataset import H3DS
+from h3ds.numeric import perform_icp, unidirectional_chamfer_distance
+from h3ds.visibility import visible_vertices
+from h3ds.utils import create_directory, create_parent_directory
+
+SCENE_ID = 'synthetic'
+LANDMARKS = [
+    'right_eye', 'left_eye', 'nose_tip', 'nose_base', 'right_lips', 'left_lips'
+]
+
+
+class SyntheticH3DS:
+
+    version = 0.0
+
+    def __init__(self,
+                 path: str,
+                 subdivisions: int = 6,
+                 views: int = 16,
+                 image_size: int = 512,
+                 seed: int = 0):
+        """
+        Writes a synthetic H3DS dataset with a single scene, so that the
+        loading and evaluation stages can be timed without any download.
+        The head is an ellipsoid in millimeters, and the cameras look at
+        it from a ring around the vertical axis.
+        Args:
+            path          (str): Directory where the dataset is written
+            subdivisions  (int): Icosphere subdivisions of the head mesh
+            views         (int): Number of images, masks and cameras
+            image_size    (int): Width and height of the images in pixels
+            seed          (int): Seed of the random generator
+        """
+        self.path = path
+        self.subdivisions = subdivisions
+        self.views = views
+        self.image_size = image_size
+        self.rng = np.random.default_rng(seed)
+        self.config_path = os.path.join(path, 'config.toml')
+
+        create_directory(path)
+        self._write_config()
+        self._write_mesh()
+        self._write_images()
+        self._write_cameras()
+
+        with open(os.path.join(path, 'version.txt'), 'w') as f:
+            f.write(str(self.version))
+
+    def h3ds(self):
+        return H3DS(path=self.path, config_path=self.config_path)
+
+    def _write_config(self):
+        views = list(range(self.views))
+        with open(self.config_path, 'w') as f:
+            toml.dump(
+                {
+                    'version': self.version,
+                    'file_id': '',
+                    'file_md5': '',
+                    'scenes': {
+                        SCENE_ID: {
+                            'tags': ['synthetic'],
+                            'views': self.views,
+                            'default_views_configs': {
+                                '3': views[::max(1, self.views // 3)][:3],
+                                str(self.views): views
+                            }
+                        }
+                    }
+                }, f)
+
+    def _write_mesh(self):
+        head = trimesh.creation.icosphere(subdivisions=self.subdivisions,
+                                          radius=1.0)
+        vertices = head.vertices * np.array([80., 100., 95.])
+        vertices += self.rng.normal(scale=0.1, size=vertices.shape)
+        self.mesh = Mesh()
+        self.mesh.vertices = vertices
+        self.mesh.faces = np.asarray(head.faces)
+        self.mesh.compute_normals()
+
+        scene_dir = os.path.join(self.path, SCENE_ID)
+        self.mesh.save(os.path.join(scene_dir, 'full_head.obj'))
+
+        # Frontal half of the head as face region, and landmarks on it
+        face = np.where(vertices[:, 2] > 0)[0]
+        nose_tip = int(np.argmax(vertices[:, 2]))
+        face_sphere = np.where(
+            np.linalg.norm(vertices - vertices[nose_tip], axis=-1) < 95)[0]
+        regions = {
+            'face': face,
+            'face_sphere': face_sphere,
+            'nose': face_sphere[:len(face_sphere) // 10]
+        }
+        for region_id, region in regions.items():
+            region_file = os.path.join(scene_dir, 'regions', f'{region_id}.txt')
+            create_parent_directory(region_file)
+            np.savetxt(region_file, region, fmt='%d')
+
+        landmarks = dict(zip(LANDMARKS, self.rng.choice(face, len(LANDMARKS))))
+        landmarks['nose_tip'] = nose_tip
+        with open(os.path.join(scene_dir, 'landmarks.txt'), 'w') as f:
+            for l, idx in landmarks.items():
+                f.write(f'{l} {idx}\n')
+
+    def _write_images(self):
+        scene_dir = os.path.join(self.path, SCENE_ID)
+        create_directory(os.path.join(scene_dir, 'image'))
+        create_directory(os.path.join(scene_dir, 'mask'))
+
+        s = self.image_size
+        yy, xx = np.mgrid[:s, :s]
+        mask = ((xx - s / 2)**2 / (0.35 * s)**2 + (yy - s / 2)**2 /
+                (0.45 * s)**2) < 1
+        for idx in range(self.views):
+            gradient = (np.stack([xx, yy, xx + yy], axis=-1) * 255 //
+                        (2 * s)).astype(np.uint8)
+            noise = self.rng.integers(0, 32, size=(s, s, 3), dtype=np.uint8)
+            img = gradient + noise
+            img[~mask] //= 4
+            Image.fromarray(img).save(
+                os.path.join(scene_dir, 'image', 'img_{0:04}.jpg'.format(idx)))
+            Image.fromarray((mask * 255).astype(np.uint8)).save(
+                os.path.join(scene_dir, 'mask', 'mask_{0:04}.png'.format(idx)))
+
+    def _write_cameras(self):
+        s = self.image_size
+        K = np.array([[2 * s, 0, s / 2], [0, 2 * s, s / 2], [0, 0, 1]])
+        scale = np.diag([150., 150., 150., 1.])
+
+        cameras = {}
+        for idx in range(self.views):
+            angle = 2 * np.pi * idx / self.views
+            # Camera center on a ring of radius 600mm looking at the origin
+            center = 600 * np.array([np.sin(angle), 0, np.cos(angle)])
+            z = -center / np.linalg.norm(center)
+            x = np.cross([0, -1, 0], z)
+            x /= np.linalg.norm(x)
+            y = np.cross(z, x)
+            R = np.stack([x, y, z])
+            Rt = np.concatenate([R, -R @ center[:, None]], axis=1)
+
+            world_mat = np.eye(4)
+            world_mat[:3, :4] = K @ Rt
+            cameras['world_mat_%d' % idx] = world_mat
+            cameras['scale_mat_%d' % idx] = scale
+
+        np.savez(os.path.join(self.path, SCENE_ID, 'cameras.npz'), **cameras)
+
+
+class Benchmark:
+
+    def __init__(self, h3ds: H3DS, scene_id: str, repeats: int = 3):
+        """
+        Times the loading and evaluation hot paths of H3DS on a scene, either of
+        a SyntheticH3DS dataset or of a local copy of H3DS. Each stage is run `repeats` times, reporting the
+        mean and minimum wall time, the throughput and the peak traced memory.
+        The meshes written by the stages go to a temporary directory, removed
+        by Benchmark.close.
+        Args:
+            h3ds    (H3DS): H3DS dataset instance
+            scene_id (str): Scene to run the stages on
+            repeats  (int): Number of timed runs of each stage
+        """
+        self.h3ds = h3ds
+        self.scene_id = scene_id
+        self.repeats = repeats
+        self.tmp_path = tempfile.mkdtemp(prefix='h3ds_bench_')
+        self.mesh_file = self.h3ds.helper.fetch(
+            [self.h3ds.helper.scene_mesh(scene_id)])[0]
+        self.tmp_file = os.path.join(self.tmp_path, 'mesh.obj')
+        self.mesh = Mesh().load(self.mesh_file)
+        self.ply_file = os.path.join(self.tmp_path, 'mesh.ply')
+        self.mesh.save(self.ply_file)
+        self.region = self.h3ds.load_region(scene_id, 'face')
+        self.mesh_pred = self.mesh.copy()
+        self.mesh_pred.vertices = self.mesh_pred.vertices + 0.5
+        self.cameras = self.h3ds.load_cameras(scene_id)
+        self.views = len(self.cameras)
+        self.sizes = []
+        for image_path in self.h3ds.helper.fetch(
+                self.h3ds.helper.scene_images(scene_id)):
+            with Image.open(image_path) as img:
+                self.sizes.append(img.size)
+        self.sizes = np.array(self.sizes)
+
+    def close(self):
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def stages(self):
+        """
+        Specifies the benchmarked stages as (name, function, items, unit),
+        where items is the amount of work of one run of the stage.
+        """
+        n_vertices = len(self.mesh.vertices)
+        file_mb = os.path.getsize(self.mesh_file) / 2**20
+        ply_mb = os.path.getsize(self.ply_file) / 2**20
+        return [
+            ('mesh_load_obj', lambda: Mesh().load(self.mesh_file), file_mb,
+             'MB/s'),
+            ('mesh_save_obj', lambda: self.mesh.save(self.tmp_file), file_mb,
+             'MB/s'),
+            ('mesh_load_ply', lambda: Mesh().load(self.ply_file), ply_mb,
+             'MB/s'),
+            ('mesh_save_ply', lambda: self.mesh.save(self.ply_file), ply_mb,
+             'MB/s'),
+            ('mesh_cut', lambda: self.mesh.cut(self.region), n_vertices,
+             'vertices/s'),
+            ('load_scene', lambda: self.h3ds.load_scene(self.scene_id),
+             self.views, 'views/s'),
+            ('load_images', lambda: self.h3ds.load_images(self.scene_id),
+             self.views, 'views/s'),
+            ('load_images_array',
+             lambda: self.h3ds.load_images(self.scene_id, as_array=True),
+             self.views, 'views/s'),
+            ('load_images_quarter',
+             lambda: self.h3ds.load_images(self.scene_id, scale=0.25),
+             self.views, 'views/s'),
+            ('load_cameras', lambda: self.h3ds.load_cameras(self.scene_id),
+             self.views, 'views/s'),
+            ('perform_icp', lambda: perform_icp(
+                self.mesh, self.mesh_pred, self.region, max_iterations=5),
+             len(self.region), 'vertices/s'),
+            ('perform_icp_point_to_plane',
+             lambda: perform_icp(self.mesh,
+                                 self.mesh_pred,
+                                 self.region,
+                                 method='point_to_plane',
+                                 max_iterations=5), len(self.region),
+             'vertices/s'),
+            ('visible_vertices', lambda: visible_vertices(
+                self.mesh.vertices, self.mesh.faces, self.cameras, self.sizes,
+                self.mesh.vertex_normals), len(self.cameras), 'views/s'),
+            ('unidirectional_chamfer_distance',
+             lambda: unidirectional_chamfer_distance(
+                 self.mesh.vertices, self.mesh_pred.vertices), n_vertices,
+             'vertices/s'),
+            ('unidirectional_chamfer_distance_voxel',
+             lambda: unidirectional_chamfer_distance(self.mesh.vertices,
+                                                     self.mesh_pred.vertices,
+                                                     max_distance=5.,
+                                                     index='voxel'), n_vertices,
+             'vertices/s'),
+        ]
+
+    def run(self, stages: list = None):
+        """
+        Runs the benchmark.
+        Args:
+            stages (list): Optional subset of stage names to run
+        Returns:
+            dict: Machine-readable results (see Benchmark.metadata)
+        """
+        results = {}
+        for name, fn, items, unit in self.stages():
+            if stages and name not in stages:
+                continue
+            results[name] = self._run_stage(fn, items, unit)
+            logger.info(
+                f'{name:>32}: {results[name]["time_mean"] * 1e3:9.2f} ms '
+                f'{results[name]["throughput"]:12.1f} {unit} '
+                f'{results[name]["peak_memory_mb"]:9.2f} MB')
+
+        return {'metadata': self.metadata(), 'results': results}
+
+    def metadata(self):
+        return {
+            'h3ds': __version__,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'vertices': len(self.mesh.vertices),
+            'faces': len(self.mesh.faces),
+            'scene_id': self.scene_id,
+            'views': self.views,
+            'image_size': self.sizes.max(axis=0).tolist(),
+            'repeats': self.repeats
+        }
+
+    def _run_stage(self, fn, items, unit):
+        """
+        Internal method: Times a stage and traces its peak memory. The memory
+        is traced in a separate run, as tracemalloc slows down allocations.
+        """
+        # Warm up caches and lazy imports
+        fn()
+
+        times = []
+        for _ in range(self.repeats):
+            gc.collect()
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+
+        gc.collect()
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return {
+            'time_mean': float(np.mean(times)),
+            'time_min': float(np.min(times)),
+            'time_std': float(np.std(times)),
+            'items': items,
+            'throughput': items / float(np.min(times)),
+            'unit': unit,
+            'peak_memory_mb': peak / 2**20
+        }
+
+
+def compare(baseline: dict, current: dict, tolerance: float = 0.1):
+    """
+    Compares two benchmark results, i.e. from two versions of h3ds.
+    Args:
+        baseline  (dict): Results of the reference run
+        current   (dict): Results of the new run
+        tolerance (float): Relative slowdown considered a regression
+    Returns:
+        dict: Per stage speedup and memory ratio, and a regression flag
+    """
+    comparison = {}
+    for name, new in current['results'].items():
+        if name not in baseline['results']:
+            continue
+        old = baseline['results'][name]
+        speedup = old['time_min'] / new['time_min']
+        comparison[name] = {
+            'speedup':
+                speedup,
+            'memory_ratio':
+                new['peak_memory_mb'] / max(old['peak_memory_mb'], 1e-9),
+            'regression':
+                speedup < 1. / (1. + tolerance)
+        }
+    return comparison
+
+
+def main(h3ds: H3DS = None,
+         scene_id: str = None,
+         output: str = None,
+         baseline: str = None,
+         subdivisions: int = 6,
+         views: int = 16,
+         image_size: int = 512,
+         repeats: int = 3,
+         stages: list = None,
+         tolerance: float = 0.1):
+    """
+    Benchmarks a scene and compares the results against a baseline run. By
+    default, the scene is generated by SyntheticH3DS in a temporary directory,
+    so nothing has to be downloaded.
+    Args:
+        h3ds        (H3DS): Optional local dataset to benchmark instead
+        scene_id     (str): Scene of h3ds to run the stages on. Defaults to the
+                            first one
+        output       (str): Json file to store the results
+        baseline     (str): Json file with results to compare against
+        subdivisions (int): Icosphere subdivisions of the synthetic head
+        views        (int): Number of views of the synthetic scene
+        image_size   (int): Image size of the synthetic scene in pixels
+        repeats      (int): Number of timed runs of each stage
+        stages      (list): Optional subset of stage names to run
+        tolerance  (float): Relative slowdown considered a regression
+    Returns:
+        dict: The results (see Benchmark.run)
+        list: Stages with a regression
+    """
+    path = None
+    try:
+        if h3ds is None:
+            path = tempfile.mkdtemp(prefix='h3ds_bench_')
+            logger.info(f'Generating synthetic dataset at {path}')
+            h3ds = SyntheticH3DS(path,
+                                 subdivisions=subdivisions,
+                                 views=views,
+                                 image_size=image_size).h3ds()
+            scene_id = SCENE_ID
+        scene_id = scene_id or h3ds.scenes()[0]
+        logger.info(f'Benchmarking scene {scene_id} of {h3ds.path}')
+        with Benchmark(h3ds, scene_id, repeats=repeats) as benchmark:
+            results = benchmark.run(stages)
+    finally:
+        if path is not None:
+            shutil.rmtree(path)
+
+    if output:
+        create_parent_directory(os.path.abspath(output))
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        logger.info(f'Results written to {output}')
+
+    regressions = []
+    if baseline:
+        with open(baseline) as f:
+            comparison = compare(json.load(f), results, tolerance)
+        for name, c in comparison.items():
+            logger.info(f'{name:>32}: x{c["speedup"]:.2f} time '
+                        f'x{c["memory_ratio"]:.2f} memory')
+            if c['regression']:
+                regressions.append(name)
+        if regressions:
+            logger.warning(f'Regressions found in {regressions}')
+
+    return results, regressions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the H3DS loading and evaluation hot paths')
+    parser.add_argument(
+        '--h3ds-path',
+        help='Local H3DS dataset to benchmark instead of a synthetic one')
+    parser.add_argument('--config-path', help='Optional custom config file')
+    parser.add_argument(
+        '--scenes',
+        help='Scenes of the local dataset. The first one is run',
+        nargs='+')
+    parser.add_argument('--output', help='Json file to store the results')
+    parser.add_argument('--baseline',
+                        help='Json file with results to compare against')
+    parser.add_argument('--subdivisions',
+                        help='Icosphere subdivisions of the synthetic head',
+                        type=int,
+                        default=6)
+    parser.add_argument('--views', help='Number of views', type=int, default=16)
+    parser.add_argument('--image-size',
+                        help='Image size in pixels',
+                        type=int,
+                        default=512)
+    parser.add_argument('--repeats',
+                        help='Timed runs per stage',
+                        type=int,
+                        default=3)
+    parser.add_argument('--stages', help='Subset of stages to run', nargs='+')
+    parser.add_argument('--tolerance',
+                        help='Relative slowdown considered a regression',
+                        type=float,
+                        default=0.1)
+
+    args = parser.parse_args()
+    h3ds, scene_id = None, None
+    if args.h3ds_path is not None:
+        h3ds = H3DS(path=args.h3ds_path, config_path=args.config_path)
+        scenes = [
+            s for s in h3ds.scenes() if not args.scenes or s in args.scenes
+        ]
+        if not scenes:
+            parser.error(f'No scene of {args.h3ds_path} matches {args.scenes}')
+        scene_id = scenes[0]
+
+    _, regressions = main(h3ds,
+                          scene_id=scene_id,
+                          output=args.output,
+                          baseline=args.baseline,
+                          subdivisions=args.subdivisions,
+                          views=args.views,
+                          image_size=args.image_size,
+                          repeats=args.repeats,
+                          stages=args.stages,
+                          tolerance=args.tolerance)
+    sys.exit(1 if regressions else 0)
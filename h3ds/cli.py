@@ -0,0 +1,432 @@
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from h3ds.dataset import H3DS
+from h3ds.results import ResultsStore
+from h3ds.metrics import compute_metrics
+from h3ds.numeric import ICP_METHODS
+from h3ds.utils import md5
+
+FULL_HEAD = 'full_head'
+
+# H3DS instance of each worker process
+_h3ds = None
+
+
+def emit(event: str, stream=None, **fields):
+    """
+    Writes an event as a json line, to be ingested by schedulers.
+    """
+    stream = stream or sys.stdout
+    stream.write(
+        json.dumps({
+            'event': event,
+            'time': time.time(),
+            **fields
+        }) + '\n')
+    stream.flush()
+
+
+def create_h3ds(args):
+    return H3DS(path=args.h3ds_path,
+                config_path=args.config_path,
+                config_id=args.config_id,
+                archive=args.archive,
+                token=args.token)
+
+
+def select_scenes(h3ds: H3DS, args):
+    scenes = h3ds.scenes(tags=set(args.tags or []))
+    if args.scenes:
+        scenes = [s for s in scenes if s in args.scenes]
+    return scenes
+
+
+def select_views_configs(h3ds: H3DS, scene_id: str, args):
+    views_configs = h3ds.default_views_configs(scene_id)
+    if args.views_configs:
+        views_configs = [v for v in views_configs if v in args.views_configs]
+    return views_configs
+
+
+def _init_worker(h3ds_path, config_path, config_id, archive, token):
+    global _h3ds
+    _h3ds = H3DS(path=h3ds_path,
+                 config_path=config_path,
+                 config_id=config_id,
+                 archive=archive,
+                 token=token)
+
+
+def _evaluate_job(job: dict):
+    """
+    Evaluates a single (scene, views config, region) job in a worker process.
+    """
+    from h3ds.mesh import Mesh
+
+    start = time.perf_counter()
+    mesh_pred = Mesh().load(job['prediction'])
+    region_id = None if job['region'] == FULL_HEAD else job['region']
+    chamfer_gt_pred, chamfer_pred_gt, _, _ = _h3ds.evaluate_scene(
+        job['scene_id'],
+        mesh_pred,
+        None,
+        region_id,
+        icp_method=job['icp_method'],
+        views_config_id=job['views_config_id'] if job['visible'] else None)
+    metrics = compute_metrics(chamfer_gt_pred, chamfer_pred_gt)
+
+    # Per-vertex distances are only sent back if they are stored
+    if not job['keep_arrays']:
+        chamfer_gt_pred, chamfer_pred_gt = None, None
+
+    return (job, chamfer_gt_pred, chamfer_pred_gt, metrics,
+            time.perf_counter() - start)
+
+
+def evaluate(args):
+    h3ds = create_h3ds(args)
+    store = ResultsStore(args.output_dir,
+                         args.method) if args.output_dir else None
+
+    # Build the jobs and skip the ones already stored
+    jobs, metrics = [], []
+    for scene_id in select_scenes(h3ds, args):
+        for views_config_id in select_views_configs(h3ds, scene_id, args):
+            prediction = os.path.join(
+                args.predictions,
+                args.pattern.format(scene_id=scene_id,
+                                    views_config_id=views_config_id))
+            if not os.path.exists(prediction):
+                emit('job_missing',
+                     scene_id=scene_id,
+                     views_config_id=views_config_id,
+                     prediction=prediction)
+                continue
+
+            prediction_hash = md5(prediction) if store is not None else None
+            for region in args.regions:
+                job = {
+                    'scene_id': scene_id,
+                    'views_config_id': views_config_id,
+                    'region': region,
+                    'prediction': prediction,
+                    'icp_method': args.icp_method,
+                    'visible': args.visible,
+                    'keep_arrays': store is not None and not args.metrics_only
+                }
+                if store is not None:
+                    job['key'] = store.key(
+                        scene_id, views_config_id,
+                        None if region == FULL_HEAD else region,
+                        prediction_hash, h3ds.helper.version_config(),
+                        args.icp_method, args.visible)
+                    if job['key'] in store:
+                        metrics.append((region, store.metrics(job['key'])))
+                        emit('job_cached',
+                             **_job_fields(job),
+                             metrics=metrics[-1][1])
+                        continue
+                jobs.append(job)
+
+    emit('evaluation_start', jobs=len(jobs), cached=len(metrics))
+
+    def done(result):
+        job, chamfer_gt_pred, chamfer_pred_gt, job_metrics, elapsed = result
+        if store is not None:
+            store.append(job['key'], chamfer_gt_pred, chamfer_pred_gt,
+                         job_metrics)
+        metrics.append((job['region'], job_metrics))
+        emit('job_done',
+             **_job_fields(job),
+             metrics=job_metrics,
+             seconds=elapsed)
+
+    failed = 0
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers,
+                                 initializer=_init_worker,
+                                 initargs=(h3ds.path, h3ds.config_path,
+                                           args.config_id, args.archive,
+                                           args.token)) as executor:
+            futures = {executor.submit(_evaluate_job, j): j for j in jobs}
+            for future in as_completed(futures):
+                try:
+                    done(future.result())
+                except Exception as e:
+                    failed += 1
+                    emit('job_failed',
+                         **_job_fields(futures[future]),
+                         error=str(e))
+    else:
+        global _h3ds
+        _h3ds = h3ds
+        for job in jobs:
+            try:
+                done(_evaluate_job(job))
+            except Exception as e:
+                failed += 1
+                emit('job_failed', **_job_fields(job), error=str(e))
+
+    # Average chamfer distance gt->pred of each region
+    summary = {
+        region:
+            float(
+                np.mean(
+                    [m['chamfer_gt_pred'] for r, m in metrics if r == region]))
+        for region in args.regions
+        if any(r == region for r, _ in metrics)
+    }
+    emit('evaluation_done',
+         jobs=len(jobs),
+         failed=failed,
+         chamfer_gt_pred=summary)
+    return 1 if failed else 0
+
+
+def _job_fields(job: dict):
+    return {k: job[k] for k in ['scene_id', 'views_config_id', 'region']}
+
+
+def pack(args):
+    """
+    Precomputes the per-scene binary files: the region and landmark index
+    and the foreground bounding boxes.
+    """
+    h3ds = create_h3ds(args)
+    for scene_id in select_scenes(h3ds, args):
+        start = time.perf_counter()
+        index_file = h3ds.compile_index(scene_id, force=args.force)
+        if args.force and os.path.exists(h3ds.helper.scene_bboxes(scene_id)):
+            os.remove(h3ds.helper.scene_bboxes(scene_id))
+        h3ds.load_bboxes(scene_id)
+        emit('scene_packed',
+             scene_id=scene_id,
+             index=index_file,
+             bboxes=h3ds.helper.scene_bboxes(scene_id),
+             seconds=time.perf_counter() - start)
+    return 0
+
+
+def verify(args):
+    """
+    Checks that the files of each scene exist, on disk or in the archive, and,
+    with --deep, that they load.
+    """
+    h3ds = create_h3ds(args)
+    version_ok = h3ds.helper.version_config() == h3ds.helper.version_dataset()
+    emit('version',
+         config=h3ds.helper.version_config(),
+         dataset=h3ds.helper.version_dataset(),
+         ok=version_ok)
+
+    failed = 0 if version_ok else 1
+    for scene_id in select_scenes(h3ds, args):
+        missing = [
+            f for f in h3ds.helper.scene_files(scene_id)
+            if not os.path.exists(f) and
+            (h3ds.archive is None or f not in h3ds.archive)
+        ]
+        error = None
+        if args.deep and not missing:
+            try:
+                h3ds.load_scene(scene_id)
+                h3ds.load_landmarks(scene_id)
+                for region_id in h3ds.regions():
+                    h3ds.load_region(scene_id, region_id)
+            except Exception as e:
+                error = str(e)
+        ok = not missing and error is None
+        failed += 0 if ok else 1
+        emit('scene_verified',
+             scene_id=scene_id,
+             ok=ok,
+             missing=missing,
+             error=error)
+
+    return 1 if failed else 0
+
+
+def shards(args):
+    """
+    Exports the (scene, view) samples into tar shards for sequential reads.
+    """
+    from h3ds.shards import export_shards
+
+    h3ds = create_h3ds(args)
+    start = time.perf_counter()
+    paths = export_shards(h3ds,
+                          args.output_dir,
+                          scenes=select_scenes(h3ds, args),
+                          normalized=args.normalized,
+                          shard_size=args.shard_size * 2**20)
+    emit('shards_exported', shards=paths, seconds=time.perf_counter() - start)
+    return 0
+
+
+def install(args):
+    """
+    Installs a release from its zip file, extracting only the new or changed files.
+    """
+    h3ds = H3DS(path=args.h3ds_path,
+                config_path=args.config_path,
+                config_id=args.config_id)
+    start = time.perf_counter()
+    diff = h3ds.install(args.zip, args.token, args.store)
+    emit('installed',
+         version=h3ds.helper.version_dataset(),
+         seconds=time.perf_counter() - start,
+         **{
+             k: len(v) for k, v in diff.items()
+         })
+    return 0 if h3ds.is_available() else 1
+
+
+def bench(args):
+    from h3ds import benchmark
+
+    # A synthetic scene is generated unless a local dataset is given
+    h3ds, scene_id = None, None
+    if args.h3ds_path is not None:
+        h3ds = create_h3ds(args)
+        scenes = select_scenes(h3ds, args)
+        if not scenes:
+            emit('bench_failed',
+                 error=f'No scene of {h3ds.path} matches the selection')
+            return 1
+        scene_id = scenes[0]
+
+    results, regressions = benchmark.main(h3ds,
+                                          scene_id=scene_id,
+                                          output=args.output,
+                                          baseline=args.baseline,
+                                          subdivisions=args.subdivisions,
+                                          views=args.views,
+                                          image_size=args.image_size,
+                                          repeats=args.repeats,
+                                          stages=args.stages)
+    for name, r in results['results'].items():
+        emit('stage', name=name, **r)
+    return 1 if regressions else 0
+
+
+def add_dataset_arguments(parser, required: bool = True):
+    parser.add_argument('--h3ds-path',
+                        help='H3DS dataset path',
+                        required=required)
+    parser.add_argument('--config-id',
+                        help='Config version. [config_v1, config_v2]',
+                        default='config_v2')
+    parser.add_argument('--config-path', help='Optional custom config file')
+    parser.add_argument('--archive',
+                        help='Zip of the dataset to extract files on demand')
+    parser.add_argument('--token',
+                        help='H3DS token to decrypt the archive',
+                        default=os.getenv('H3DS_TOKEN'))
+    parser.add_argument('--scenes', help='Subset of scenes', nargs='+')
+    parser.add_argument('--tags',
+                        help='Only scenes with all these tags',
+                        nargs='+')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='h3ds',
+                                     description='Tools for the H3DS dataset')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('evaluate',
+                              help='Evaluates a directory of predictions')
+    add_dataset_arguments(p)
+    p.add_argument('--predictions',
+                   help='Directory with the predicted meshes',
+                   required=True)
+    p.add_argument('--pattern',
+                   help='Name of the predicted meshes',
+                   default='{scene_id}_{views_config_id}.ply')
+    p.add_argument('--views-configs', help='Subset of views configs', nargs='+')
+    p.add_argument('--regions',
+                   help=f'Regions to evaluate. {FULL_HEAD} for the whole head',
+                   nargs='+',
+                   default=[FULL_HEAD, 'face_sphere'])
+    p.add_argument('--icp-method',
+                   help='ICP method of the fine alignment',
+                   choices=ICP_METHODS,
+                   default='point_to_point')
+    p.add_argument(
+        '--visible',
+        help='Evaluate only the surface seen by the views of each config',
+        action='store_true')
+    p.add_argument('--workers', help='Worker processes', type=int, default=1)
+    p.add_argument('--method', help='Name of the method', default='method')
+    p.add_argument('--output-dir',
+                   help='Directory to store the results and resume from them')
+    p.add_argument('--metrics-only',
+                   help='Store only the metrics, not the per-vertex distances',
+                   action='store_true')
+    p.set_defaults(func=evaluate)
+
+    p = subparsers.add_parser('pack', help='Precomputes the per-scene indexes')
+    add_dataset_arguments(p)
+    p.add_argument('--force',
+                   help='Recompute existing files',
+                   action='store_true')
+    p.set_defaults(func=pack)
+
+    p = subparsers.add_parser('verify', help='Verifies the local dataset')
+    add_dataset_arguments(p)
+    p.add_argument('--deep', help='Load every scene', action='store_true')
+    p.set_defaults(func=verify)
+
+    p = subparsers.add_parser('shards',
+                              help='Exports the views into tar shards')
+    add_dataset_arguments(p)
+    p.add_argument('--output-dir',
+                   help='Directory of the shards',
+                   required=True)
+    p.add_argument('--shard-size',
+                   help='Maximum size of a shard in MB',
+                   type=int,
+                   default=256)
+    p.add_argument('--normalized',
+                   help='Cameras normalized to a unit sphere',
+                   action='store_true')
+    p.set_defaults(func=shards)
+
+    p = subparsers.add_parser('install',
+                              help='Installs or updates the dataset from a zip')
+    add_dataset_arguments(p)
+    p.add_argument('--zip', help='Zip file of the release', required=True)
+    p.add_argument('--store', help='Content store shared by several versions')
+    p.set_defaults(func=install)
+
+    p = subparsers.add_parser(
+        'bench',
+        help='Benchmarks the hot paths on a synthetic scene, or on the first '
+        'selected scene of a local dataset')
+    add_dataset_arguments(p, required=False)
+    p.add_argument('--subdivisions', type=int, default=6)
+    p.add_argument('--views', type=int, default=16)
+    p.add_argument('--image-size', type=int, default=512)
+    p.add_argument('--output', help='Json file to store the results')
+    p.add_argument('--baseline',
+                   help='Json file with results to compare against')
+    p.add_argument('--repeats', type=int, default=3)
+    p.add_argument('--stages', nargs='+')
+    p.set_defaults(func=bench)
+
+    return parser
+
+
+def main(argv: list = None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
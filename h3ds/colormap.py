@@ -0,0 +1,92 @@
+import numpy as np
+
+LUT_SIZE = 1024
+
+
+def _hsv_to_rgb(hsv: np.ndarray):
+    """
+    Converts HSV colors in [0, 1] to RGB colors in [0, 1].
+    """
+    h, s, v = hsv[:, 0], hsv[:, 1], hsv[:, 2]
+    i = np.floor(h * 6.).astype(int) % 6
+    f = h * 6. - np.floor(h * 6.)
+    p, q, t = v * (1. - s), v * (1. - s * f), v * (1. - s * (1. - f))
+    rgb = np.choose(i[:, np.newaxis], [
+        np.stack([v, t, p], axis=-1),
+        np.stack([q, v, p], axis=-1),
+        np.stack([p, v, t], axis=-1),
+        np.stack([p, q, v], axis=-1),
+        np.stack([t, p, v], axis=-1),
+        np.stack([v, p, q], axis=-1)
+    ])
+    return rgb
+
+
+def error_lut(size: int = LUT_SIZE):
+    """
+    Lookup table of the error colormap, from green (no error) to yellow and
+    red (maximum error), i.e. an HSV hue going from 1/3 to 0.
+    Args:
+        size (int): Number of entries
+    Returns:
+        np.ndarray: (size, 3) RGB colors as uint8
+    """
+    hsv = np.ones((size, 3))
+    hsv[:, 0] = (1. - np.linspace(0., 1., size)) / 3.
+    return np.round(_hsv_to_rgb(hsv) * 255.).astype(np.uint8)
+
+
+_LUTS = {}
+
+
+def get_lut(size: int = LUT_SIZE):
+    """
+    Cached version of error_lut.
+    """
+    if size not in _LUTS:
+        _LUTS[size] = error_lut(size)
+    return _LUTS[size]
+
+
+def quantize(errors: np.ndarray,
+             clipping_error: float = None,
+             size: int = LUT_SIZE):
+    """
+    Maps errors to the indices of a lookup table. Errors are normalized by the
+    clipping error if provided, otherwise by their range.
+    Args:
+        errors      (np.ndarray): Array of errors
+        clipping_error   (float): Error mapped to the last entry
+        size               (int): Number of entries of the lookup table
+    Returns:
+        np.ndarray: Array of indices in [0, size - 1]
+    """
+    errors = np.asarray(errors)
+    if clipping_error is not None:
+        low, high = 0., float(clipping_error)
+    else:
+        low, high = float(errors.min()), float(errors.max())
+
+    scale = (size - 1) / (high - low) if high > low else 0.
+    indices = np.subtract(errors, low, dtype=np.float32)
+    indices *= np.float32(scale)
+    indices += np.float32(0.5)
+    np.clip(indices, 0, size - 1, out=indices)
+    return indices.astype(np.intp)
+
+
+def error_to_color(errors: np.ndarray,
+                   clipping_error: float = None,
+                   size: int = LUT_SIZE):
+    """
+    Colors errors as a heatmap with a single gather in a lookup table.
+    Args:
+        errors      (np.ndarray): Array of errors
+        clipping_error   (float): Errors above it are colored as the maximum
+        size               (int): Number of entries of the lookup table
+    Returns:
+        np.ndarray: (..., 3) RGB colors as uint8
+    """
+    return np.take(get_lut(size),
+                   quantize(errors, clipping_error, size),
+                   axis=0)
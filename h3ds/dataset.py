@@ -1,19 +1,24 @@
 import os
 import glob
-import zipfile
 import shutil
-from functools import reduce
+from functools import reduce, partial
+from concurrent.futures import ThreadPoolExecutor
 
 import toml
-from tqdm import tqdm
-from PIL import Image
 import numpy as np
 
 from h3ds.log import logger
+from h3ds.profiling import profiler
 from h3ds.mesh import Mesh
+from h3ds.pyramid import ImagePyramid
+from h3ds.regions import RegionIndex
+from h3ds.archive import ZipArchive
+from h3ds.shared import SharedSceneCache
+from h3ds.store import ContentStore, archive_manifest, damaged_files, diff_manifests, directory_manifest, load_manifest, save_manifest
 from h3ds.affine_transform import AffineTransform
-from h3ds.utils import download_file_from_google_drive, md5
-from h3ds.numeric import load_K_Rt, perform_alignment, perform_icp, transform_mesh, unidirectional_chamfer_distance
+from h3ds.utils import download_file_from_google_drive, md5, remove
+from h3ds.numeric import load_K_Rt, landmarks_transform, perform_icp, transform_mesh, unidirectional_chamfer_distance, vertex_normals
+from h3ds.visibility import visible_vertices
 
 
 class ConfigsHelper:
@@ -36,8 +41,9 @@ class ConfigsHelper:
 
 class H3DSHelper:
 
-    def __init__(self, path, config_path: str):
+    def __init__(self, path, config_path: str, archive=None):
         self.path = path
+        self.archive = archive
         self._config = toml.load(config_path)
 
     def version_config(self):
@@ -45,6 +51,7 @@ class H3DSHelper:
 
     def version_dataset(self):
         try:
+            self.fetch([self.version_file()])
             with open(self.version_file()) as f:
                 return str(f.readline().rstrip())
         except:
@@ -70,6 +77,19 @@ class H3DSHelper:
         return [self.version_file()] + \
             reduce(lambda x, y: x + y, [self.scene_files(s) for s in self.scenes()])
 
+    def fetch(self, paths: list):
+        """
+        Extracts the missing files from the dataset archive, if any (see
+        h3ds.archive.ZipArchive).
+        """
+        if self.archive is not None:
+            self.archive.fetch(paths)
+        return paths
+
+    def exists(self, path: str):
+        return os.path.exists(path) or (self.archive is not None and
+                                        path in self.archive)
+
     def default_views_configs(self, scene_id: str):
         return list(
             self._config['scenes'][scene_id]['default_views_configs'].keys())
@@ -80,6 +100,9 @@ class H3DSHelper:
     def version_file(self):
         return os.path.join(self.path, 'version.txt')
 
+    def manifest_file(self):
+        return os.path.join(self.path, 'manifest.json')
+
     def scene_tags(self, scene_id):
         return set(self._config['scenes'][scene_id].get('tags', []))
 
@@ -115,33 +138,95 @@ class H3DSHelper:
     def scene_region(self, scene_id: str, region_id: str):
         return os.path.join(self.path, scene_id, 'regions', f'{region_id}.txt')
 
+    def scene_region_files(self, scene_id: str):
+        files = set(glob.glob(self.scene_region(scene_id, '*')))
+        if self.archive is not None:
+            files.update(
+                self.archive.glob(os.path.join(self.path, scene_id, 'regions'),
+                                  '.txt'))
+        return sorted(files)
+
+    def scene_index(self, scene_id: str):
+        return os.path.join(self.path, scene_id, 'index.npz')
+
+    def scene_bboxes(self, scene_id: str):
+        return os.path.join(self.path, scene_id, 'bboxes.npz')
+
+    def scene_visibility(self, scene_id: str):
+        return os.path.join(self.path, scene_id, 'visibility.npz')
+
 
 class H3DS:
 
-    def __init__(self, path: str, config_path: str = None, config_id: str = 'config_v2'):
+    def __init__(self,
+                 path: str,
+                 config_path: str = None,
+                 config_id: str = 'config_v2',
+                 max_workers: int = 4,
+                 pyramid_max_bytes: int = 2**30,
+                 image_decoder: str = 'pil',
+                 archive: str = None,
+                 token: str = None,
+                 shared_cache: SharedSceneCache = None):
         """
         Class to manage the data available in the H3DS dataset.
         Args:
-            path        (str): Path to store the dataset locally.
-            config_path (str): Optional custom config file.
+            path                      (str): Path to store the dataset locally.
+            config_path               (str): Optional custom config file.
+            max_workers               (int): Maximum threads used by the async loaders.
+            pyramid_max_bytes         (int): Maximum size of the downsampled images cache.
+            image_decoder             (str): Decoder of the images loaded as arrays. 'pil' or 'cv2'
+            archive                   (str): Optional zip of the dataset. The files are extracted
+                                             to path on demand (see h3ds.archive.ZipArchive)
+            token                     (str): H3DS token, the password of the archive
+            shared_cache (SharedSceneCache): Optional cache of the scenes published by
+                                             another process, which are read from it
+                                             instead of the disk (see h3ds.shared)
         """
         self.path = os.path.expanduser(path)
-        self.config_path = config_path or ConfigsHelper.get_config_file(config_id)
-        self.helper = H3DSHelper(path=self.path, config_path=self.config_path)
+        self.config_path = config_path or ConfigsHelper.get_config_file(
+            config_id)
+        self.archive = ZipArchive(
+            archive, root=self.path, password=token,
+            max_workers=max_workers) if archive is not None else None
+        self.helper = H3DSHelper(path=self.path,
+                                 config_path=self.config_path,
+                                 archive=self.archive)
         self._config = self.helper._config
+        self.max_workers = max_workers
+        if image_decoder not in ['pil', 'cv2']:
+            raise ValueError(f'Image decoder {image_decoder}')
+        self.image_decoder = image_decoder
+        self.shared_cache = shared_cache
+        self._executor = None
+        self._inflight = {}
+        self._indices = {}
+        self._bboxes = {}
+        self._visibility = {}
+        self._region_indices = {}
+        self.pyramid = ImagePyramid(root=self.path,
+                                    path=os.path.join(self.path, 'cache',
+                                                      'pyramid'),
+                                    max_bytes=pyramid_max_bytes)
 
         if not self.is_available():
             logger.warning(
                 f'H3DS v{self.helper.version_config()} was not found at {self.path}. Change the path or call H3DS.download.'
             )
 
-    def download(self, token, force=False):
+    @profiler.timed('dataset.download')
+    def download(self, token, force=False, extract=True, store_path=None):
         """
         Downloads the dataset to the specified path in the __init__ method. The dataset
-        is download only if it is not available or if the flag force is True.
+        is download only if it is not available or if the flag force is True. If extract
+        is False, the zip file is kept at the path instead and the files are extracted
+        on demand, when they are loaded (see h3ds.archive.ZipArchive). Otherwise, only
+        the files that are new or changed are extracted (see H3DS.install).
         Args:
-            token  (str): H3DS token
-            force (bool): Flag to force the download
+            token      (str): H3DS token
+            force     (bool): Flag to force the download
+            extract   (bool): Flag to extract all the files
+            store_path (str): Optional content store shared by several versions
         Returns:
             None
         """
@@ -156,7 +241,8 @@ class H3DS:
             os.makedirs(tmp_dir)
 
         version = self._config['version']
-        tmp_zip = os.path.join(tmp_dir, f'h3ds_{version}.zip')
+        tmp_zip = os.path.join(tmp_dir if extract else self.path,
+                               f'h3ds_{version}.zip')
         logger.print(f'Downloading H3DS dataset to {tmp_zip}')
         download_file_from_google_drive(id=self._config['file_id'],
                                         destination=tmp_zip)
@@ -168,16 +254,108 @@ class H3DS:
         else:
             logger.critical('MD5 check - Failed')
 
+        if not extract:
+            logger.print(f'Files will be extracted on demand from {tmp_zip}')
+            self.archive = ZipArchive(tmp_zip,
+                                      root=self.path,
+                                      password=token,
+                                      max_workers=self.max_workers)
+            self.helper.archive = self.archive
+            shutil.rmtree(tmp_dir)
+            return
+
         # Unzip into self.path
         logger.print(f'Unzipping file to {self.path}')
-        with zipfile.ZipFile(tmp_zip, 'r') as zip_ref:
-            for member in tqdm(zip_ref.infolist(), desc='Extracting...'):
-                zip_ref.extract(member, self.path, pwd=token.encode('utf-8'))
+        self.install(tmp_zip, token, store_path)
 
         # Remove temporal zip
         logger.print(f'Removing temporary files')
         shutil.rmtree(tmp_dir)
 
+    @profiler.timed('dataset.install')
+    def install(self, archive_path: str, token: str = None, store_path=None):
+        """
+        Installs a release of the dataset from its zip file, extracting only the
+        files that are new or changed with respect to the installed ones. Files are
+        compared by their content key (CRC-32 and size), which the zip file provides
+        without decrypting it. With a content store, the files of every installed
+        version are hardlinks to the store, so the files already extracted for another
+        version are linked instead of extracted again. Installed files that were
+        deleted or truncated since, found by their size, are restored.
+        Args:
+            archive_path (str): Path of the zip file
+            token        (str): H3DS token
+            store_path   (str): Optional content store (see h3ds.store.ContentStore)
+        Returns:
+            dict: Names of the 'added', 'changed', 'removed' and 'unchanged' files
+        """
+        from tqdm import tqdm
+        archive = ZipArchive(archive_path,
+                             root=self.path,
+                             password=token,
+                             max_workers=self.max_workers)
+        target = archive_manifest(archive)
+
+        # Installs without a manifest are hashed once
+        installed = load_manifest(self.helper.manifest_file())
+        if installed is None:
+            installed = directory_manifest(self.path, list(target.keys()))
+        diff = diff_manifests(installed, target)
+
+        # Files deleted or truncated since the last install are restored
+        damaged = damaged_files(self.path, target, diff['unchanged'])
+        diff['unchanged'] = [n for n in diff['unchanged'] if n not in damaged]
+        diff['changed'] = sorted(diff['changed'] + damaged)
+
+        # Derived files of the scenes that changed are stale. Files already
+        # deleted from the installation are skipped
+        for name in diff['changed'] + diff['removed']:
+            remove(os.path.join(self.path, *name.split('/')))
+        for scene_id in {
+                n.split('/')[0] for n in diff['changed'] + diff['removed']
+        }:
+            for f in [
+                    self.helper.scene_index(scene_id),
+                    self.helper.scene_bboxes(scene_id),
+                    self.helper.scene_visibility(scene_id)
+            ] + glob.glob(os.path.join(self.pyramid.path, '*', scene_id)):
+                remove(f)
+            self._indices.pop(scene_id, None)
+            self._bboxes.pop(scene_id, None)
+            self._visibility.pop(scene_id, None)
+            self._region_indices.pop(scene_id, None)
+
+        # Link the files available in the store, extract the others by scene
+        store = ContentStore(store_path) if store_path is not None else None
+        pending = {}
+        for name in diff['added'] + diff['changed']:
+            if store is not None and target[name] in store:
+                store.link(target[name],
+                           os.path.join(self.path, *name.split('/')))
+            else:
+                pending.setdefault(name.split('/')[0], []).append(name)
+
+        for names in tqdm(pending.values(), desc='Extracting...'):
+            archive.fetch(
+                [os.path.join(self.path, *n.split('/')) for n in names])
+        archive.close()
+
+        # Files with the same content are linked to the same object
+        if store is not None:
+            for name in target.keys():
+                path = os.path.join(self.path, *name.split('/'))
+                if target[name] not in store:
+                    store.add(path, target[name])
+                elif not os.path.samefile(path, store.object_path(
+                        target[name])):
+                    store.link(target[name], path)
+
+        save_manifest(self.helper.manifest_file(),
+                      self.helper.version_dataset(), target)
+        logger.info(', '.join(f'{len(v)} {k}' for k, v in diff.items()) +
+                    ' files')
+        return diff
+
     def is_available(self):
         """
         Checks if a valid version of the dataset is available at the specified path
@@ -186,7 +364,7 @@ class H3DS:
             bool : True if available, otherwise false
         """
         return self.helper.version_config() == self.helper.version_dataset() and \
-            all([os.path.exists(f) for f in self.helper.files()])
+            all([self.helper.exists(f) for f in self.helper.files()])
 
     def scenes(self, tags: set = {}):
         """
@@ -221,10 +399,13 @@ class H3DS:
         """
         return self.helper.default_views_configs(scene_id)
 
+    @profiler.timed('dataset.load_scene')
     def load_scene(self,
                    scene_id: str,
                    views_config_id: str = None,
-                   normalized: bool = False):
+                   normalized: bool = False,
+                   crop: bool = False,
+                   as_array: bool = False):
         """
         Loads all the elements of a scene, which are the mesh, the images,
         the masks and the cameras.
@@ -232,92 +413,175 @@ class H3DS:
             scene_id        (str): Scene identifier
             views_config_id (str): Views configuration defining subset of views
             normalized     (bool): Scene normalized to fit inside a unit sphere
+            crop           (bool): Crop the views to the foreground bounding box
+            as_array       (bool): Images and masks as np.ndarray (see H3DS.load_images).
+                                   If the scene is in the shared cache, they are
+                                   read-only arrays backed by it, like the mesh
         Returns:
             Mesh: The 3D geometry of the scene as a mesh
             list: Array of the images
             list: Array of the masks
             list: Array of the cameras
         """
+        scene = self._shared_scene(scene_id, normalized)
+        if scene is not None and as_array and not crop and (
+                views_config_id is None or
+                views_config_id in scene['metadata']['views_configs']):
+            return self.shared_cache.load_scene(scene_id, views_config_id)
+
         mesh = self.load_mesh(scene_id, normalized)
-        images = self.load_images(scene_id, views_config_id)
-        masks = self.load_masks(scene_id, views_config_id)
-        cameras = self.load_cameras(scene_id, views_config_id, normalized)
+        images = self.load_images(scene_id,
+                                  views_config_id,
+                                  crop=crop,
+                                  as_array=as_array)
+        masks = self.load_masks(scene_id,
+                                views_config_id,
+                                crop=crop,
+                                as_array=as_array)
+        cameras = self.load_cameras(scene_id,
+                                    views_config_id,
+                                    normalized,
+                                    crop=crop)
 
         return mesh, images, masks, cameras
 
-    def load_mesh(self, scene_id: str, normalized: bool = False):
+    @profiler.timed('dataset.load_mesh')
+    def load_mesh(self,
+                  scene_id: str,
+                  normalized: bool = False,
+                  compact: bool = False,
+                  copy: bool = False):
         """
-        Loads the mesh for a given scene.
+        Loads the mesh for a given scene. If the scene is in the shared cache,
+        the vertices, normals and faces are read-only arrays backed by it,
+        unless a copy is requested.
         Args:
             scene_id    (str): Scene identifier
             normalized (bool): Scene normalized to fit inside a unit sphere
+            compact    (bool): Store the mesh as float32 / int32
+            copy       (bool): Copy the mesh from the shared cache, to modify it
         Returns:
             Mesh: The 3D geometry of the scene as a mesh
         """
-        mesh = Mesh().load(self.helper.scene_mesh(scene_id))
+        if self._shared_scene(scene_id, normalized) is not None:
+            mesh = self.shared_cache.load_mesh(scene_id)
+            if compact:
+                return mesh.compact()
+            return mesh.astype(mesh.dtype) if copy else mesh
+
+        mesh_file = self.helper.fetch([self.helper.scene_mesh(scene_id)])[0]
+        mesh = Mesh(compact=compact).load(mesh_file)
         if normalized:
             normalization_transform = self._load_normalization_transform(
                 scene_id)
-            mesh.vertices = normalization_transform.transform(mesh.vertices)
+            normalization_transform.transform(mesh.vertices, out=mesh.vertices)
 
         return mesh
 
-    def load_images(self, scene_id: str, views_config_id: str = None):
+    @profiler.timed('dataset.load_images')
+    def load_images(self,
+                    scene_id: str,
+                    views_config_id: str = None,
+                    scale: float = None,
+                    size: tuple = None,
+                    crop: bool = False,
+                    as_array: bool = False):
         """
-        Loads the RGB images for a given scene as PIL.Image.
+        Loads the RGB images for a given scene as PIL.Image. If a scale or a size
+        is provided, the images are downsampled (see H3DS.pyramid). With `as_array`,
+        every image is decoded once into a single VxHxWx3 uint8 array, using the
+        decoder chosen in the constructor.
         Args:
             scene_id        (str): Scene identifier
             views_config_id (str): Views configuration defining subset of views
+            scale         (float): Optional scale factor, i.e. 0.5, 0.25 or 0.125
+            size          (tuple): Optional (width, height). It has priority over scale
+            crop           (bool): Crop the images to the foreground bounding box.
+                                   As arrays, a list of views of the full array is returned
+            as_array       (bool): Return a np.ndarray instead of a list of PIL.Image
         Returns:
             list : Array of the images
         """
-        images = self._load_images(self.helper.scene_images(scene_id))
+        images_paths = self.helper.fetch(
+            self._filter_views(self.helper.scene_images(scene_id), scene_id,
+                               views_config_id))
+        if as_array:
+            images = self._load_images_array(images_paths, scale, size)
+        else:
+            images = self._load_images(images_paths, scale, size)
 
-        return self._filter_views(images, scene_id, views_config_id)
+        return self._crop_views(images, scene_id,
+                                views_config_id) if crop else images
 
-    def load_masks(self, scene_id: str, views_config_id: str = None):
+    @profiler.timed('dataset.load_masks')
+    def load_masks(self,
+                   scene_id: str,
+                   views_config_id: str = None,
+                   scale: float = None,
+                   size: tuple = None,
+                   crop: bool = False,
+                   as_array: bool = False):
         """
-        Loads the binary masks for a given scene as PIL.Image.
+        Loads the binary masks for a given scene as PIL.Image. If a scale or a size
+        is provided, the masks are downsampled with nearest neighbour interpolation.
+        With `as_array`, the masks are decoded into a single VxHxW uint8 array.
         Args:
             scene_id        (str): Scene identifier
             views_config_id (str): Views configuration defining subset of views
+            scale         (float): Optional scale factor, i.e. 0.5, 0.25 or 0.125
+            size          (tuple): Optional (width, height). It has priority over scale
+            crop           (bool): Crop the masks to the foreground bounding box
+            as_array       (bool): Return a np.ndarray instead of a list of PIL.Image
         Returns:
             list : Array of the masks
         """
-        masks = self._load_images(self.helper.scene_masks(scene_id))
+        masks_paths = self.helper.fetch(
+            self._filter_views(self.helper.scene_masks(scene_id), scene_id,
+                               views_config_id))
+        if as_array:
+            masks = self._load_images_array(masks_paths, scale, size, mask=True)
+        else:
+            masks = self._load_images(masks_paths, scale, size, mask=True)
 
-        return self._filter_views(masks, scene_id, views_config_id)
+        return self._crop_views(masks, scene_id,
+                                views_config_id) if crop else masks
 
+    @profiler.timed('dataset.load_cameras')
     def load_cameras(self,
                      scene_id: str,
                      views_config_id: str = None,
-                     normalized: bool = False):
+                     normalized: bool = False,
+                     crop: bool = False):
         """
         Loads the cameras for a given scene. Each cameras is defined as a tupple
         of two elements. The first one is a 3x3 np.ndarray matrix with the calibration
-        and the second is a 4x4 np.ndarray matrix with the camera pose.
+        and the second is a 4x4 np.ndarray matrix with the camera pose. If the
+        scene is in the shared cache, they are read-only arrays backed by it.
         Args:
             scene_id        (str): Scene identifier
             views_config_id (str): Views configuration defining subset of views
             normalized     (bool): Scene normalized to fit inside a unit sphere
+            crop           (bool): Calibration of the views cropped to the foreground
         Returns:
             list : Array of the cameras
         """
-        camera_dict = np.load(self.helper.scene_cameras(scene_id))
-        if normalized:
-            normalization_transform = self._load_normalization_transform(
-                scene_id)
+        scene = self._shared_scene(scene_id, normalized)
+        if scene is not None:
+            cameras = list(zip(scene['K'], scene['pose']))
+        else:
+            cameras = self._read_cameras(scene_id, normalized)
 
-        cameras = []
-        for idx in range(self._config['scenes'][scene_id]['views']):
-            P = camera_dict['world_mat_%d' % idx].astype(np.float32)
-            if normalized:
-                P = P @ np.linalg.inv(normalization_transform.matrix)
-            K, P = load_K_Rt(P[:3, :4])
-            cameras.append((K, P))
+        if crop:
+            # Shift the principal point to the origin of the crop
+            bboxes = self._load_bboxes(scene_id)['bboxes']
+            for idx, (K, P) in enumerate(cameras):
+                K = K.copy()
+                K[:2, 2] -= bboxes[idx, :2]
+                cameras[idx] = (K, P)
 
         return self._filter_views(cameras, scene_id, views_config_id)
 
+    @profiler.timed('dataset.load_landmarks')
     def load_landmarks(self, scene_id: str):
         """
         Loads the landmarks for a given scene as dictionary. Each landmark
@@ -327,32 +591,141 @@ class H3DS:
         Returns:
             dict: A dictionary with the annotated landmarks
         """
-        with open(self.helper.scene_landmarks(scene_id)) as f:
-            landmarks = {
-                l[0]: int(l[1])
-                for l in [l.rstrip().split() for l in f.readlines()]
-            }
+        index = self._load_index(scene_id)
+        if index is not None:
+            return dict(
+                zip(index['landmarks_names'].tolist(),
+                    index['landmarks_ids'].tolist()))
+
+        landmarks_file = self.helper.fetch(
+            [self.helper.scene_landmarks(scene_id)])[0]
+        with open(landmarks_file) as f:
+            tokens = f.read().split()
 
-        return landmarks
+        return dict(zip(tokens[0::2], map(int, tokens[1::2])))
 
-    def load_region(self, scene_id: str, region_id: str):
+    @profiler.timed('dataset.load_region')
+    def load_region(self, scene_id: str, region_id: str, mask: bool = False):
         """
         Loads a list of indices defining a region of the mesh. The available regions are:
         - 'face': Includes the frontal face, the ears and the neck.
         - 'face_sphere': Includes all the vertices inside sphere centered at the tip
                          of the nose with radius 95mm (standard for evaluation).
         - 'nose': Includes only the vertices belonging to the nose.
+        If the scene index is compiled (see H3DS.compile_index), the region is read
+        from it instead of parsing the text file.
         Args:
             scene_id  (str): Scene identifier
             region_id (str): Region identifier
+            mask     (bool): Return a boolean mask over the mesh vertices
         Returns:
             np.ndarray: An array containing either a list of indices or a mask
         """
-        with open(self.helper.scene_region(scene_id, region_id)) as f:
-            region = np.array([np.int(l.rstrip()) for l in f.readlines()])
+        index = self._load_index(scene_id)
+        if index is not None:
+            return index[f'{"mask" if mask else "region"}_{region_id}']
+
+        region_file = self.helper.fetch(
+            [self.helper.scene_region(scene_id, region_id)])[0]
+        region = np.fromfile(region_file, dtype=np.int32, sep=' ')
+        if mask:
+            n_vertices = len(self.load_mesh(scene_id).vertices)
+            return self._region_mask(region, n_vertices)
 
         return region
 
+    def region_index(self, scene_id: str):
+        """
+        Builds a spatial index over the ground truth mesh of a scene to select
+        regions on the fly, like spheres around the landmarks. The index is
+        cached, so it is built once per scene.
+        Args:
+            scene_id (str): Scene identifier
+        Returns:
+            RegionIndex: The region index (see h3ds.regions.RegionIndex)
+        """
+        if scene_id not in self._region_indices:
+            self._region_indices[scene_id] = RegionIndex(
+                self.load_mesh(scene_id).vertices,
+                self.load_landmarks(scene_id))
+
+        return self._region_indices[scene_id]
+
+    @profiler.timed('dataset.compile_index')
+    def compile_index(self, scene_id: str, force: bool = False):
+        """
+        Compiles all the regions and landmarks of a scene into a single binary
+        file, holding the regions as int32 arrays of indices and as boolean masks
+        over the mesh vertices. Once compiled, H3DS.load_region and
+        H3DS.load_landmarks read the scene index once and keep it in memory.
+        Args:
+            scene_id (str): Scene identifier
+            force   (bool): Flag to force the compilation if it already exists
+        Returns:
+            str: Path to the compiled index
+        """
+        index_file = self.helper.scene_index(scene_id)
+        if os.path.exists(index_file) and not force:
+            return index_file
+
+        # The regions and landmarks are read again from the text files
+        remove(index_file)
+        self._indices.pop(scene_id, None)
+        n_vertices = len(self.load_mesh(scene_id).vertices)
+        landmarks = self.load_landmarks(scene_id)
+        index = {
+            'landmarks_names': np.array(list(landmarks.keys())),
+            'landmarks_ids': np.array(list(landmarks.values()), dtype=np.int32)
+        }
+        for region_file in self.helper.scene_region_files(scene_id):
+            region_id = os.path.splitext(os.path.basename(region_file))[0]
+            region = self.load_region(scene_id, region_id)
+            index[f'region_{region_id}'] = region
+            index[f'mask_{region_id}'] = self._region_mask(region, n_vertices)
+
+        np.savez(index_file, **index)
+        return index_file
+
+    @profiler.timed('dataset.load_bboxes')
+    def load_bboxes(self, scene_id: str, views_config_id: str = None):
+        """
+        Loads the bounding boxes of the foreground of each view, as defined by
+        the masks. They are computed the first time and stored per scene.
+        Args:
+            scene_id        (str): Scene identifier
+            views_config_id (str): Views configuration defining subset of views
+        Returns:
+            np.ndarray: Vx4 array with the (x0, y0, x1, y1) pixel boxes, where
+                        x1 and y1 are exclusive
+        """
+        bboxes = self._load_bboxes(scene_id)['bboxes']
+
+        return np.array(
+            self._filter_views(list(bboxes), scene_id,
+                               views_config_id)).reshape(-1, 4)
+
+    @profiler.timed('dataset.load_visibility')
+    def load_visibility(self, scene_id: str, views_config_id: str = None):
+        """
+        Loads which vertices of the ground truth mesh are seen by the views, i.e.
+        the surface that a reconstruction from those views can recover. Each
+        vertex is depth tested against the mesh rendered from every camera (see
+        h3ds.visibility.visible_vertices). The masks of the views are computed the
+        first time they are needed and stored per scene.
+        Args:
+            scene_id        (str): Scene identifier
+            views_config_id (str): Views configuration defining subset of views
+        Returns:
+            np.ndarray: Boolean mask over the mesh vertices, true for the
+                        vertices visible from any of the views
+        """
+        views = self._filter_views(
+            list(range(self._config['scenes'][scene_id]['views'])), scene_id,
+            views_config_id)
+        masks = self._load_visibility(scene_id, views)
+
+        return np.any(masks[views], axis=0)
+
     def load_normalization_matrix(self, scene_id: str):
         """
         Loads the transformation that normalizes the scene from mm to a unit sphere.
@@ -363,11 +736,15 @@ class H3DS:
         """
         return self._load_normalization_transform(scene_id).matrix
 
+    @profiler.timed('dataset.evaluate_scene')
     def evaluate_scene(self,
                        scene_id: str,
                        mesh_pred: Mesh,
                        landmarks_pred: dict = None,
-                       region_id: str = None):
+                       region_id: str = None,
+                       region: np.ndarray = None,
+                       icp_method: str = 'point_to_point',
+                       views_config_id: str = None):
         """
         Evaluates a predicted mesh with respect the ground truth scene. If landmarks
         are provided, the predicted mesh is coarsely aligned towards the ground truth.
@@ -379,7 +756,19 @@ class H3DS:
         [right_eye, left_eye, nose_tip, nose_base, right_lips, left_lips]
 
         Finally, if a region identifier is provided, the scene is evaluated in that
-        specific region. By default it evaluates with the whole head.
+        specific region. By default it evaluates with the whole head. Instead of a
+        region identifier, the indices of any region of the ground truth mesh can be
+        provided, i.e. from a query to H3DS.region_index.
+
+        The fine alignment minimizes point to point distances by default. With the
+        'point_to_plane' method, the distances are measured along the normals of the
+        ground truth, and the 'symmetric' method uses the normals of both meshes.
+        They converge in fewer iterations (see h3ds.numeric.icp_point_to_plane).
+
+        If a views configuration is provided, the chamfer distances are restricted
+        to the surface of the ground truth seen by those views (see
+        H3DS.load_visibility), intersected with the region if any. The alignment
+        is not affected.
 
         See the README and the examples for more information
 
@@ -388,6 +777,9 @@ class H3DS:
             mesh_pred      (Mesh): Predicted mesh for that scene
             landmarks_pred (dict): Landkarks on the predicted mesh
             region_id       (str): Region identifier
+            region   (np.ndarray): Indices of a region of the ground truth mesh
+            icp_method      (str): 'point_to_point', 'point_to_plane' or 'symmetric'
+            views_config_id (str): Views configuration of the input views
         Returns:
             np.array: Nx3 array with the chamfer distance gt->pred for each groundtruth vertex
             np.array: Mx3 array with the chamfer distance pred->gt for eacu predicted vertex
@@ -396,18 +788,30 @@ class H3DS:
         """
         mesh_gt = self.load_mesh(scene_id)
         landmarks_gt = self.load_landmarks(scene_id)
-        region_gt = self.load_region(scene_id, region_id or 'face')
-
-        # Perform coarse alignment if landmarks provided
-        mesh_pred, t_coarse = perform_alignment(mesh_pred, mesh_gt,
-                                                landmarks_pred, landmarks_gt)
-
-        # Perform fine alignment using ICP
-        _, t_icp = perform_icp(mesh_gt, mesh_pred, region_gt)
+        region_gt = region if region is not None else self.load_region(
+            scene_id, region_id or 'face')
+
+        # Coarse alignment if landmarks provided. It is not applied to the
+        # mesh, but used as the initial transform of ICP
+        t_coarse = landmarks_transform(mesh_pred, mesh_gt, landmarks_pred,
+                                       landmarks_gt)
+
+        # Perform fine alignment using ICP, and transform the prediction once
+        _, t_icp = perform_icp(mesh_gt,
+                               mesh_pred,
+                               region_gt,
+                               method=icp_method,
+                               initial=np.linalg.inv(t_coarse))
         mesh_pred = transform_mesh(mesh_pred, np.linalg.inv(t_icp))
 
-        # Compute chamfers. Use the region if specified
-        if region_id:
+        # Compute chamfers. Use the region if specified, and only the visible
+        # vertices if a views configuration is specified
+        if views_config_id is not None:
+            visible = self.load_visibility(scene_id, views_config_id)
+            if region_id or region is not None:
+                visible &= self._region_mask(region_gt, len(visible))
+            mesh_gt = mesh_gt.cut(visible)
+        elif region_id or region is not None:
             mesh_gt = mesh_gt.cut(region_gt)
 
         chamfer_gt_pred = unidirectional_chamfer_distance(
@@ -417,6 +821,314 @@ class H3DS:
 
         return chamfer_gt_pred, chamfer_pred_gt, mesh_gt, mesh_pred
 
+    async def aload_scene(self,
+                          scene_id: str,
+                          views_config_id: str = None,
+                          normalized: bool = False):
+        """
+        Async version of H3DS.load_scene. The mesh, images, masks and cameras
+        are read concurrently in a bounded thread pool, without blocking the
+        event loop. Concurrent calls for the same data share a single read,
+        so the returned objects must be copied before being modified.
+        Args:
+            scene_id        (str): Scene identifier
+            views_config_id (str): Views configuration defining subset of views
+            normalized     (bool): Scene normalized to fit inside a unit sphere
+        Returns:
+            Mesh: The 3D geometry of the scene as a mesh
+            list: Array of the images
+            list: Array of the masks
+            list: Array of the cameras
+        """
+        import asyncio
+        return tuple(await asyncio.gather(
+            self.aload_mesh(scene_id, normalized),
+            self.aload_images(scene_id, views_config_id),
+            self.aload_masks(scene_id, views_config_id),
+            self.aload_cameras(scene_id, views_config_id, normalized)))
+
+    async def aload_mesh(self, scene_id: str, normalized: bool = False):
+        """
+        Async version of H3DS.load_mesh.
+        """
+        return await self._run_shared(('mesh', scene_id, normalized),
+                                      self.load_mesh, scene_id, normalized)
+
+    async def aload_images(self,
+                           scene_id: str,
+                           views_config_id: str = None,
+                           scale: float = None,
+                           size: tuple = None):
+        """
+        Async version of H3DS.load_images. Each image is decoded in its own job.
+        """
+        images_paths = self._filter_views(self.helper.scene_images(scene_id),
+                                          scene_id, views_config_id)
+        await self._run_shared(('fetch', tuple(images_paths)),
+                               self.helper.fetch, images_paths)
+        return await self._aload_images(images_paths, scale, size)
+
+    async def aload_masks(self,
+                          scene_id: str,
+                          views_config_id: str = None,
+                          scale: float = None,
+                          size: tuple = None):
+        """
+        Async version of H3DS.load_masks. Each mask is decoded in its own job.
+        """
+        masks_paths = self._filter_views(self.helper.scene_masks(scene_id),
+                                         scene_id, views_config_id)
+        await self._run_shared(('fetch', tuple(masks_paths)), self.helper.fetch,
+                               masks_paths)
+        return await self._aload_images(masks_paths, scale, size, mask=True)
+
+    async def aload_cameras(self,
+                            scene_id: str,
+                            views_config_id: str = None,
+                            normalized: bool = False):
+        """
+        Async version of H3DS.load_cameras.
+        """
+        return await self._run_shared(
+            ('cameras', scene_id, views_config_id, normalized),
+            self.load_cameras, scene_id, views_config_id, normalized)
+
+    async def _aload_images(self,
+                            images_paths: list,
+                            scale: float = None,
+                            size: tuple = None,
+                            mask: bool = False):
+        """
+        Internal method: Loads a list of images as PIL.Image concurrently
+        """
+        import asyncio
+        size = tuple(size) if size is not None else None
+        return list(await asyncio.gather(*[
+            self._run_shared(('image', p, scale, size,
+                              mask), self._load_image, p, scale, size, mask)
+            for p in images_paths
+        ]))
+
+    async def _run_shared(self, key: tuple, fn, *args):
+        """
+        Internal method: Runs fn(*args) in the thread pool. Calls with the same
+        key that arrive while it is running await the same result. If every
+        caller is cancelled, the job is cancelled as well, unless it already
+        started running.
+        Args:
+            key (tuple): Identifier of the job
+            fn (callable): Blocking function
+        Returns:
+            The result of fn(*args)
+        """
+        import asyncio
+        entry = self._inflight.get(key)
+        if entry is None:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix='h3ds')
+            future = asyncio.get_running_loop().run_in_executor(
+                self._executor, partial(fn, *args))
+            entry = self._inflight[key] = [future, 0]
+
+            def release(_):
+                if self._inflight.get(key) is entry:
+                    del self._inflight[key]
+
+            future.add_done_callback(release)
+
+        entry[1] += 1
+        try:
+            return await asyncio.shield(entry[0])
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not entry[0].done():
+                entry[0].cancel()
+
+    def _shared_scene(self, scene_id: str, normalized: bool):
+        """
+        Internal method: Arrays of a scene in the shared cache, if it was
+        published with the same normalization.
+        Args:
+            scene_id    (str): Scene identifier
+            normalized (bool): Scene normalized to fit inside a unit sphere
+        Returns:
+            dict : The shared arrays of the scene, or None if not published
+        """
+        if self.shared_cache is None or scene_id not in self.shared_cache:
+            return None
+        scene = self.shared_cache.attach(scene_id)
+        if scene['metadata']['normalized'] != normalized:
+            return None
+        return scene
+
+    def _load_index(self, scene_id: str):
+        """
+        Internal method: Loads the compiled index of a scene, if available.
+        Args:
+            scene_id (str): Scene identifier
+        Returns:
+            dict : The arrays of the index, or None if it is not compiled
+        """
+        if scene_id not in self._indices:
+            index_file = self.helper.scene_index(scene_id)
+            if not os.path.exists(index_file):
+                return None
+            with np.load(index_file) as data:
+                self._indices[scene_id] = dict(data)
+
+        return self._indices[scene_id]
+
+    @staticmethod
+    def _region_mask(region: np.ndarray, n_vertices: int):
+        """
+        Internal method: Converts a list of indices into a boolean mask
+        """
+        mask = np.zeros(n_vertices, dtype=bool)
+        mask[region] = True
+        return mask
+
+    def _load_bboxes(self, scene_id: str):
+        """
+        Internal method: Loads the foreground bounding boxes and the image sizes
+        of all the views of a scene, computing them from the masks if needed.
+        Args:
+            scene_id (str): Scene identifier
+        Returns:
+            dict : Vx4 'bboxes' and Vx2 'sizes' (width, height) arrays
+        """
+        if scene_id in self._bboxes:
+            return self._bboxes[scene_id]
+
+        bboxes_file = self.helper.scene_bboxes(scene_id)
+        if os.path.exists(bboxes_file):
+            with np.load(bboxes_file) as data:
+                self._bboxes[scene_id] = dict(data)
+            return self._bboxes[scene_id]
+
+        bboxes, sizes = [], []
+        for mask_path in self.helper.fetch(self.helper.scene_masks(scene_id)):
+            mask = np.array(self._load_image(mask_path))
+            mask = mask.reshape(mask.shape[0], mask.shape[1], -1).any(axis=-1)
+            rows, cols = np.flatnonzero(mask.any(axis=1)), np.flatnonzero(
+                mask.any(axis=0))
+            if rows.size:
+                bboxes.append([cols[0], rows[0], cols[-1] + 1, rows[-1] + 1])
+            else:
+                bboxes.append([0, 0, mask.shape[1], mask.shape[0]])
+            sizes.append([mask.shape[1], mask.shape[0]])
+
+        self._bboxes[scene_id] = {
+            'bboxes': np.array(bboxes, dtype=np.int32),
+            'sizes': np.array(sizes, dtype=np.int32)
+        }
+        np.savez(bboxes_file, **self._bboxes[scene_id])
+        return self._bboxes[scene_id]
+
+    def _load_visibility(self, scene_id: str, views: list):
+        """
+        Internal method: Loads the visibility masks of a scene, computing the
+        ones of the requested views that are missing.
+        Args:
+            scene_id (str): Scene identifier
+            views   (list): View identifiers
+        Returns:
+            np.ndarray : VxN boolean masks of all the views of the scene. Only
+                         the requested views are guaranteed to be computed
+        """
+        if scene_id not in self._visibility:
+            visibility_file = self.helper.scene_visibility(scene_id)
+            if os.path.exists(visibility_file):
+                with np.load(visibility_file) as data:
+                    n_vertices = int(data['n_vertices'])
+                    self._visibility[scene_id] = {
+                        'computed':
+                            data['computed'],
+                        'masks':
+                            np.unpackbits(data['masks'],
+                                          axis=1,
+                                          count=n_vertices).astype(bool)
+                    }
+            else:
+                n_views = self._config['scenes'][scene_id]['views']
+                n_vertices = len(self.load_mesh(scene_id).vertices)
+                self._visibility[scene_id] = {
+                    'computed': np.zeros(n_views, dtype=bool),
+                    'masks': np.zeros((n_views, n_vertices), dtype=bool)
+                }
+
+        visibility = self._visibility[scene_id]
+        missing = [v for v in views if not visibility['computed'][v]]
+        if missing:
+            mesh = self.load_mesh(scene_id)
+            cameras = self.load_cameras(scene_id)
+            sizes = self._load_bboxes(scene_id)['sizes']
+            visibility['masks'][missing] = visible_vertices(
+                mesh.vertices,
+                mesh.faces, [cameras[v] for v in missing],
+                sizes[missing],
+                normals=vertex_normals(mesh))
+            visibility['computed'][missing] = True
+            np.savez(self.helper.scene_visibility(scene_id),
+                     computed=visibility['computed'],
+                     masks=np.packbits(visibility['masks'], axis=1),
+                     n_vertices=visibility['masks'].shape[1])
+
+        return visibility['masks']
+
+    def _crop_views(self, images: list, scene_id: str, views_config_id: str):
+        """
+        Internal method: Crops images to the foreground bounding box of their
+        views. The boxes are rescaled if the images were downsampled.
+        Args:
+            images          (list): Images of the views as PIL.Image or np.ndarray
+            scene_id         (str): Scene identifier
+            views_config_id  (str): Views configuration defining subset of views
+        Returns:
+            list : Cropped images as PIL.Image, or views of the np.ndarray
+        """
+        bboxes = self._load_bboxes(scene_id)
+        bboxes_views = self._filter_views(list(bboxes['bboxes']), scene_id,
+                                          views_config_id)
+        sizes_views = self._filter_views(list(bboxes['sizes']), scene_id,
+                                         views_config_id)
+
+        cropped = []
+        for img, (x0, y0, x1, y1), (w, h) in zip(images, bboxes_views,
+                                                 sizes_views):
+            width, height = (img.shape[1], img.shape[0]) if isinstance(
+                img, np.ndarray) else img.size
+            sx, sy = width / w, height / h
+            box = (int(np.floor(x0 * sx)), int(np.floor(y0 * sy)),
+                   int(np.ceil(x1 * sx)), int(np.ceil(y1 * sy)))
+            if isinstance(img, np.ndarray):
+                cropped.append(img[box[1]:box[3], box[0]:box[2]])
+            else:
+                cropped.append(img.crop(box))
+        return cropped
+
+    def _read_cameras(self, scene_id: str, normalized: bool):
+        """
+        Internal method: Reads the cameras of all the views from cameras.npz.
+        """
+        cameras_file = self.helper.fetch([self.helper.scene_cameras(scene_id)
+                                         ])[0]
+        profiler.count('dataset.read_cameras', 1,
+                       profiler.file_size(cameras_file))
+        camera_dict = np.load(cameras_file)
+        if normalized:
+            normalization_inverse = self._load_normalization_transform(
+                scene_id).inverse()
+
+        cameras = []
+        for idx in range(self._config['scenes'][scene_id]['views']):
+            P = camera_dict['world_mat_%d' % idx].astype(np.float32)
+            if normalized:
+                P = P @ normalization_inverse.matrix
+            K, P = load_K_Rt(P[:3, :4])
+            cameras.append((K, P))
+        return cameras
+
     def _load_normalization_transform(self, scene_id: str):
         """
         Internal method: Loads the transformation that normalizes the scene
@@ -426,20 +1138,131 @@ class H3DS:
         Returns:
             AffineTransform : A 4x4 similarity transform
         """
-        camera_dict = np.load(self.helper.scene_cameras(scene_id))
+        camera_dict = np.load(
+            self.helper.fetch([self.helper.scene_cameras(scene_id)])[0])
         s = camera_dict['scale_mat_0'].astype(np.float32)
         t = AffineTransform(matrix=np.linalg.inv(s))
         return t
 
-    def _load_images(self, images_paths: list):
+    def _load_images(self,
+                     images_paths: list,
+                     scale: float = None,
+                     size: tuple = None,
+                     mask: bool = False):
         """
         Internal method: Loads a list of image as PIL.Image from their paths
         Args:
             images_paths (list): List of image paths
+            scale       (float): Optional scale factor
+            size        (tuple): Optional (width, height)
+            mask         (bool): Downsample with nearest neighbour interpolation
         Returns:
             list : List of images as PIL.Image
         """
-        return [Image.open(img).copy() for img in images_paths]
+        return [
+            self._load_image(img, scale, size, mask) for img in images_paths
+        ]
+
+    def _load_image(self,
+                    image_path: str,
+                    scale: float = None,
+                    size: tuple = None,
+                    mask: bool = False):
+        """
+        Internal method: Loads an image as PIL.Image from its path
+        Args:
+            image_path (str): Image path
+            scale    (float): Optional scale factor
+            size     (tuple): Optional (width, height)
+            mask      (bool): Downsample with nearest neighbour interpolation
+        Returns:
+            PIL.Image : The image
+        """
+        from PIL import Image
+        if scale is not None or size is not None:
+            resample = Image.NEAREST if mask else Image.LANCZOS
+            return self.pyramid.load(image_path, scale, size, resample)
+
+        with profiler.stage('dataset.decode_image',
+                            profiler.file_size(image_path)):
+            return Image.open(image_path).copy()
+
+    def _load_images_array(self,
+                           images_paths: list,
+                           scale: float = None,
+                           size: tuple = None,
+                           mask: bool = False):
+        """
+        Internal method: Decodes a list of images of the same size into a
+        preallocated array. Each image is written to its slice of the array,
+        without keeping any intermediate image alive.
+        Args:
+            images_paths (list): List of image paths
+            scale       (float): Optional scale factor
+            size        (tuple): Optional (width, height)
+            mask         (bool): Masks as VxHxW, downsampled with nearest neighbour
+        Returns:
+            np.ndarray : VxHxWx3 images or VxHxW masks as uint8
+        """
+        from PIL import Image
+        if len(images_paths) == 0:
+            return np.empty((0, 0, 0) if mask else (0, 0, 0, 3), dtype=np.uint8)
+
+        with Image.open(images_paths[0]) as img:
+            width, height = img.size
+        if scale is not None or size is not None:
+            width, height = self.pyramid.target_size((width, height), scale,
+                                                     size)
+        shape = (height, width) if mask else (height, width, 3)
+        array = np.empty((len(images_paths),) + shape, dtype=np.uint8)
+
+        for idx, image_path in enumerate(images_paths):
+            with profiler.stage('dataset.decode_image',
+                                profiler.file_size(image_path)):
+                if scale is not None or size is not None:
+                    img = self._load_image(image_path, scale, size, mask)
+                    self._copy_image(img, array[idx], image_path, mask)
+                elif self.image_decoder == 'cv2':
+                    self._decode_cv2(image_path, array[idx], mask)
+                else:
+                    with Image.open(image_path) as img:
+                        self._copy_image(img, array[idx], image_path, mask)
+
+        return array
+
+    @staticmethod
+    def _copy_image(img, out: np.ndarray, image_path: str, mask: bool):
+        """
+        Internal method: Writes a PIL.Image into an array. PIL decodes into its
+        own memory, so each image is copied once into the array (use the 'cv2'
+        decoder to decode straight into it).
+        """
+        mode = 'L' if mask else 'RGB'
+        if img.mode != mode:
+            img = img.convert(mode)
+        if img.size != (out.shape[1], out.shape[0]):
+            raise ValueError(
+                f'{image_path} has size {img.size} instead of {out.shape[1::-1]}'
+            )
+        out[...] = np.asarray(img)
+
+    @staticmethod
+    def _decode_cv2(image_path: str, out: np.ndarray, mask: bool):
+        """
+        Internal method: Decodes an image with OpenCV into an array. The EXIF
+        orientation is ignored, like PIL.Image.open does.
+        """
+        import cv2
+        flags = cv2.IMREAD_IGNORE_ORIENTATION | (cv2.IMREAD_GRAYSCALE
+                                                 if mask else cv2.IMREAD_COLOR)
+        img = cv2.imdecode(np.fromfile(image_path, dtype=np.uint8), flags)
+        if img is None or img.shape != out.shape:
+            raise ValueError(
+                f'{image_path} could not be decoded with shape {out.shape}')
+        if mask:
+            out[...] = img
+        else:
+            cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=out)
 
     def _get_views_config(self, scene_id: str, config_id: str):
         """
@@ -470,4 +1293,4 @@ class H3DS:
             return elements
 
         views_config = self._get_views_config(scene_id, views_config_id)
-        return [elements[idx] for idx in views_config]
\ No newline at end of file
+        return [elements[idx] for idx in views_config]
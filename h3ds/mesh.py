@@ -3,51 +3,123 @@ import sys
 import re
 import copy
 import numpy as np
-import scipy
-import trimesh
 
+from h3ds.profiling import profiler
 from h3ds.utils import get_file_extension, create_parent_directory
 
+PLY_TYPES = {
+    'char': 'i1',
+    'int8': 'i1',
+    'uchar': 'u1',
+    'uint8': 'u1',
+    'short': 'i2',
+    'int16': 'i2',
+    'ushort': 'u2',
+    'uint16': 'u2',
+    'int': 'i4',
+    'int32': 'i4',
+    'uint': 'u4',
+    'uint32': 'u4',
+    'float': 'f4',
+    'float32': 'f4',
+    'double': 'f8',
+    'float64': 'f8'
+}
+
 
 class Mesh:
 
-    def __init__(self, dimension=3, dtype=float):
+    __slots__ = ('dimension', 'dtype', 'index_dtype', 'vertices',
+                 'vertices_color', 'vertex_normals', 'faces',
+                 'texture_coordinates', 'texture_indices')
+
+    def __init__(self,
+                 dimension=3,
+                 dtype=float,
+                 index_dtype=int,
+                 compact=False):
+        """
+        Triangular mesh stored as numpy arrays.
+        Args:
+            dimension   (int): Dimension of the vertices
+            dtype      (type): Type of the vertices, normals, colors and uvs
+            index_dtype(type): Type of the faces and texture indices
+            compact    (bool): Store as float32 / int32, overriding the dtypes
+        """
         self.dimension = dimension
-        self.dtype = dtype
+        self.dtype = np.float32 if compact else dtype
+        self.index_dtype = np.int32 if compact else index_dtype
         self._clear()
 
+    @profiler.timed('mesh.load')
     def load(self,
              filename,
              elements=['vertices', 'vertex_normals', 'faces', 'uvs']):
         self._clear()
+        profiler.count('mesh.read', 1, profiler.file_size(filename))
 
-        if get_file_extension(filename) == '.obj':
+        extension = get_file_extension(filename)
+        if extension == '.obj':
             self._load_obj(filename, elements)
+        elif extension == '.ply' and self._load_ply(filename, elements):
+            pass
         else:
+            import trimesh
             trim = trimesh.load(filename, process=False, maintain_order=True)
-            self.vertices = trim.vertices
-            self.faces = trim.faces
+            self.vertices = np.asarray(trim.vertices, dtype=self.dtype)
+            self.faces = np.asarray(trim.faces, dtype=self.index_dtype)
 
         return self
 
+    @profiler.timed('mesh.save')
     def save(self, filename):
         create_parent_directory(filename)
-        if get_file_extension(filename) == '.obj':
+        extension = get_file_extension(filename)
+        if extension == '.obj':
             self._save_obj(filename)
+        elif extension == '.ply':
+            self._save_ply(filename)
         else:
+            import trimesh
             trimesh.Trimesh(vertices=self.vertices,
                             faces=self.faces).export(filename)
 
     def copy(self):
         return copy.deepcopy(self)
 
+    def astype(self, dtype, index_dtype=None):
+        """
+        Returns a copy of the mesh with its arrays converted to the given types.
+        Args:
+            dtype       (type): Type of the vertices, normals, colors and uvs
+            index_dtype (type): Type of the faces and texture indices
+        Returns:
+            Mesh: The converted mesh
+        """
+        other = Mesh(self.dimension, dtype, index_dtype or self.index_dtype)
+        other.vertices = self.vertices.astype(other.dtype)
+        other.vertices_color = self.vertices_color.astype(other.dtype)
+        other.vertex_normals = self.vertex_normals.astype(other.dtype)
+        other.faces = self.faces.astype(other.index_dtype)
+        other.texture_coordinates = self.texture_coordinates.astype(other.dtype)
+        other.texture_indices = self.texture_indices.astype(other.index_dtype)
+        return other
+
+    def compact(self):
+        """
+        Returns a copy of the mesh stored as float32 / int32.
+        """
+        return self.astype(np.float32, np.int32)
+
+    @profiler.timed('mesh.compute_normals')
     def compute_normals(self):
+        from scipy import sparse
 
         # Sparse matrix that maps vertices to faces (and other way around)
         col_idx = np.repeat(np.arange(len(self.faces)), self.dimension)
         row_idx = self.faces.reshape(-1)
         data = np.ones(len(col_idx), dtype=bool)
-        vert2face = scipy.sparse.coo_matrix(
+        vert2face = sparse.coo_matrix(
             (data, (row_idx, col_idx)),
             shape=(len(self.vertices), len(self.faces)),
             dtype=data.dtype)
@@ -63,12 +135,21 @@ class Mesh:
         vertex_normals = vertex_normals / np.linalg.norm(vertex_normals,
                                                          axis=1)[:, np.newaxis]
 
-        self.vertex_normals = vertex_normals
+        self.vertex_normals = vertex_normals.astype(self.dtype, copy=False)
 
+    @profiler.timed('mesh.cut')
     def cut(self, indices):
 
+        # Boolean masks are converted to indices
+        if np.asarray(indices).dtype == bool:
+            vertices_mask = np.asarray(indices)
+            indices = np.flatnonzero(vertices_mask)
+        else:
+            vertices_mask = np.zeros(len(self.vertices), dtype=bool)
+            vertices_mask[indices] = True
+
         # Cut vertices
-        other = Mesh(self.dimension, self.dtype)
+        other = Mesh(self.dimension, self.dtype, self.index_dtype)
         other.vertices = self.vertices[indices].copy()
         if self.vertex_normals.any():
             other.vertex_normals = self.vertex_normals[indices].copy()
@@ -76,9 +157,10 @@ class Mesh:
             other.vertices_color = self.vertices_color[indices].copy()
 
         # Cut faces
-        faces_mask = np.all(np.isin(self.faces, indices), axis=1)
-        vertices_map = {new_i: i for (i, new_i) in enumerate(np.ravel(indices))}
-        other.faces = np.vectorize(vertices_map.get)(self.faces[faces_mask])
+        faces_mask = np.all(vertices_mask[self.faces], axis=1)
+        vertices_map = np.zeros(len(self.vertices), dtype=self.index_dtype)
+        vertices_map[np.ravel(indices)] = np.arange(np.size(indices))
+        other.faces = vertices_map[self.faces[faces_mask]]
 
         # Cut texture coords
         if self.texture_indices.any():
@@ -94,10 +176,11 @@ class Mesh:
                                          dtype=self.dtype)
         self.vertex_normals = np.ndarray(shape=(0, self.dimension),
                                          dtype=self.dtype)
-        self.faces = np.ndarray(shape=(0, 3), dtype=int)
+        self.faces = np.ndarray(shape=(0, 3), dtype=self.index_dtype)
         self.texture_coordinates = np.ndarray(shape=(0, 2), dtype=self.dtype)
-        self.texture_indices = np.ndarray(shape=(0, 3), dtype=int)
+        self.texture_indices = np.ndarray(shape=(0, 3), dtype=self.index_dtype)
 
+    @profiler.timed('mesh.load_obj')
     def _load_obj(self, filename, elements):
         assert get_file_extension(filename) == '.obj'
 
@@ -112,9 +195,10 @@ class Mesh:
             vertices_color = np.empty((v_count, 3), dtype=self.dtype)
             vertex_normals = np.empty((v_count, self.dimension),
                                       dtype=self.dtype)
-            faces = np.empty((f_count, 3), dtype=int)
+            faces = np.empty((f_count, 3), dtype=self.index_dtype)
             texture_coordinates = np.empty((vt_count, 2), dtype=self.dtype)
-            texture_indices = np.empty((f_count, self.dimension), dtype=int)
+            texture_indices = np.empty((f_count, self.dimension),
+                                       dtype=self.index_dtype)
 
             v_idx, vn_idx, vt_idx, f_idx = 0, 0, 0, 0
             vcol_flag, ti_flag = False, False
@@ -185,6 +269,7 @@ class Mesh:
             if ti_flag:
                 self.texture_indices = texture_indices
 
+    @profiler.timed('mesh.save_obj')
     def _save_obj(self, filename):
 
         assert self.vertices.size != 0
@@ -224,3 +309,175 @@ class Mesh:
                     f.write( 'f ' + str( self.faces[ f_id, 0 ] + 1 ) + '/' + str( self.texture_indices[ f_id, 0 ] + 1 ) + \
                              ' ' + str( self.faces[ f_id, 1 ] + 1 ) + '/' + str( self.texture_indices[ f_id, 1 ] + 1 ) + \
                              ' ' + str( self.faces[ f_id, 2 ] + 1 ) + '/' + str( self.texture_indices[ f_id, 2 ] + 1 ) + '\n' )
+
+    @profiler.timed('mesh.load_ply')
+    def _load_ply(self, filename, elements):
+        """
+        Internal method: Loads a binary PLY file. The vertex and face blocks are
+        read at once and mapped as numpy arrays, without parsing each element.
+        Vertex colors are loaded in [0, 1].
+        Returns:
+            bool: False if the file is not supported (ascii files or faces that
+                  are not triangles), and nothing was loaded
+        """
+        with open(filename, 'rb') as f:
+            header = self._read_ply_header(f)
+            if header is None:
+                return False
+            byte_order, ply_elements = header
+
+            # Only the faces can have a list property, read as triangles
+            blocks, faces_name = {}, None
+            for name, count, properties in ply_elements:
+                lists = [p for p, t in properties if isinstance(t, tuple)]
+                if lists and (name != 'face' or len(lists) > 1):
+                    return False
+                if lists:
+                    faces_name = lists[0]
+                blocks[name] = np.fromfile(f,
+                                           dtype=self._ply_dtype(
+                                               properties, byte_order),
+                                           count=count)
+
+        if faces_name is not None and len(blocks['face']):
+            face_block = blocks['face']
+            if np.any(face_block[f'{faces_name}_count'] != 3):
+                return False
+            if 'faces' in elements:
+                self.faces = face_block[faces_name].astype(self.index_dtype)
+
+        vertex_block = blocks.get('vertex')
+        if vertex_block is None:
+            return True
+        names = vertex_block.dtype.names
+
+        def fields(keys, scale=None):
+            if not all(k in names for k in keys):
+                return None
+            # Contiguous fields of the same type are viewed without copies
+            if vertex_block.dtype.names == tuple(keys) and \
+                    len(set(vertex_block.dtype[k] for k in keys)) == 1:
+                array = vertex_block.view(vertex_block.dtype[keys[0]]).reshape(
+                    -1, len(keys))
+            else:
+                array = np.stack([vertex_block[k] for k in keys], axis=-1)
+            array = array.astype(self.dtype, copy=False)
+            return array / self.dtype(scale) if scale else array
+
+        if 'vertices' in elements:
+            self.vertices = fields(['x', 'y', 'z'])
+            colors = fields(['red', 'green', 'blue'],
+                            scale=255. if vertex_block.dtype['red'] == np.uint8
+                            else None) if 'red' in names else None
+            if colors is not None:
+                self.vertices_color = colors
+        if 'vertex_normals' in elements:
+            normals = fields(['nx', 'ny', 'nz'])
+            if normals is not None:
+                self.vertex_normals = normals
+
+        return True
+
+    @staticmethod
+    def _read_ply_header(f):
+        """
+        Internal method: Parses the header of a PLY file.
+        Returns:
+            tuple: Byte order ('<' or '>') and list of elements as
+                   (name, count, [(property, type) or (property, (count_type, item_type))]).
+                   None if the file is not binary
+        """
+        if f.readline().strip() != b'ply':
+            raise ValueError(f'{f.name} is not a PLY file')
+
+        byte_order, ply_elements = None, []
+        for line in iter(f.readline, b''):
+            data = line.decode('ascii').split()
+            if not data or data[0] in ['comment', 'obj_info']:
+                continue
+            if data[0] == 'end_header':
+                break
+            if data[0] == 'format':
+                byte_order = {
+                    'binary_little_endian': '<',
+                    'binary_big_endian': '>'
+                }.get(data[1])
+            elif data[0] == 'element':
+                ply_elements.append((data[1], int(data[2]), []))
+            elif data[0] == 'property' and data[1] == 'list':
+                ply_elements[-1][2].append((data[4], (data[2], data[3])))
+            elif data[0] == 'property':
+                ply_elements[-1][2].append((data[2], data[1]))
+
+        if byte_order is None:
+            return None
+        return byte_order, ply_elements
+
+    @staticmethod
+    def _ply_dtype(properties, byte_order):
+        """
+        Internal method: Structured type of an element. List properties are
+        read as triangles, with a '<name>_count' field for their length.
+        """
+        dtype = []
+        for name, ply_type in properties:
+            if isinstance(ply_type, tuple):
+                dtype.append(
+                    (f'{name}_count', byte_order + PLY_TYPES[ply_type[0]]))
+                dtype.append((name, byte_order + PLY_TYPES[ply_type[1]], (3,)))
+            else:
+                dtype.append((name, byte_order + PLY_TYPES[ply_type]))
+        return np.dtype(dtype)
+
+    @profiler.timed('mesh.save_ply')
+    def _save_ply(self, filename):
+        """
+        Internal method: Saves the mesh as a binary little endian PLY file.
+        Vertices and normals are stored as float for float32 meshes (see
+        Mesh.compact), otherwise as double. Colors are stored as uchar.
+        """
+        assert self.vertices.size != 0
+
+        real = 'f4' if np.dtype(self.dtype) == np.float32 else 'f8'
+        vertex_dtype = [('x', '<' + real), ('y', '<' + real), ('z', '<' + real)]
+        has_normals = len(self.vertex_normals) == len(self.vertices)
+        has_colors = len(self.vertices_color) == len(self.vertices)
+        if has_normals:
+            vertex_dtype += [('nx', '<' + real), ('ny', '<' + real),
+                             ('nz', '<' + real)]
+        if has_colors:
+            vertex_dtype += [('red', 'u1'), ('green', 'u1'), ('blue', 'u1')]
+
+        vertex_block = np.empty(len(self.vertices), dtype=vertex_dtype)
+        for i, k in enumerate(['x', 'y', 'z']):
+            vertex_block[k] = self.vertices[:, i]
+            if has_normals:
+                vertex_block['n' + k] = self.vertex_normals[:, i]
+        if has_colors:
+            colors = np.clip(np.round(self.vertices_color * 255.), 0, 255)
+            for i, k in enumerate(['red', 'green', 'blue']):
+                vertex_block[k] = colors[:, i]
+
+        face_block = np.empty(len(self.faces),
+                              dtype=[('count', 'u1'), ('indices', '<i4', (3,))])
+        face_block['count'] = 3
+        face_block['indices'] = self.faces
+
+        type_names = {'<f4': 'float', '<f8': 'double', '|u1': 'uchar'}
+        header = [
+            'ply', 'format binary_little_endian 1.0',
+            f'element vertex {len(vertex_block)}'
+        ]
+        header += [
+            f'property {type_names[vertex_block.dtype[k].str]} {k}'
+            for k in vertex_block.dtype.names
+        ]
+        header += [
+            f'element face {len(face_block)}',
+            'property list uchar int vertex_indices', 'end_header'
+        ]
+
+        with open(filename, 'wb') as f:
+            f.write(('\n'.join(header) + '\n').encode('ascii'))
+            vertex_block.tofile(f)
+            face_block.tofile(f)
@@ -0,0 +1,117 @@
+import numpy as np
+
+# Distances in millimeters
+THRESHOLDS = (1., 2.5, 5.)
+PERCENTILES = (50, 75, 90, 95, 99)
+
+
+def distance_statistics(distances: np.ndarray,
+                        thresholds: tuple = THRESHOLDS,
+                        percentiles: tuple = PERCENTILES):
+    """
+    Computes the statistics of an array of distances from a single sort: the
+    percentiles are read from the sorted array and the ratio of distances
+    below each threshold is found with a binary search.
+    Args:
+        distances (np.ndarray): Array of distances
+        thresholds     (tuple): Distance thresholds
+        percentiles    (tuple): Percentiles in [0, 100]
+    Returns:
+        dict: 'mean', 'median', 'rms', 'max', 'percentiles' {p: distance} and
+              'ratio' {threshold: ratio of distances below it}
+    """
+    d = np.sort(np.asarray(distances).ravel())
+    n = len(d)
+    if n == 0:
+        raise ValueError('No distances to compute the statistics from')
+
+    # Linear interpolation between closest ranks, like np.percentile. The
+    # median is computed along with the percentiles
+    q = np.array(tuple(percentiles) + (50,), dtype=np.float64)
+    ranks = q / 100. * (n - 1)
+    low = np.floor(ranks).astype(int)
+    high = np.minimum(low + 1, n - 1)
+    values = d[low] + (d[high] - d[low]) * (ranks - low)
+
+    below = np.searchsorted(d, thresholds, side='left') / n
+    d64 = d.astype(np.float64, copy=False)
+
+    return {
+        'mean': float(np.mean(d64)),
+        'median': float(values[-1]),
+        'rms': float(np.sqrt(np.dot(d64, d64) / n)),
+        'max': float(d[-1]),
+        'percentiles': {
+            str(p): float(v) for p, v in zip(percentiles, values)
+        },
+        'ratio': {
+            str(t): float(r) for t, r in zip(thresholds, below)
+        }
+    }
+
+
+def compute_metrics(chamfer_gt_pred: np.ndarray,
+                    chamfer_pred_gt: np.ndarray,
+                    thresholds: tuple = THRESHOLDS,
+                    percentiles: tuple = PERCENTILES):
+    """
+    Computes all the metrics of an evaluation from the two outputs of
+    H3DS.evaluate_scene. The completeness measures how well the ground truth
+    is covered by the prediction (gt->pred) and the accuracy how close the
+    prediction is to the ground truth (pred->gt). The F-score at a threshold
+    is the harmonic mean of the ratios of both distances below it.
+    Args:
+        chamfer_gt_pred (np.ndarray): Chamfer distance gt->pred
+        chamfer_pred_gt (np.ndarray): Chamfer distance pred->gt
+        thresholds           (tuple): Thresholds of the F-score
+        percentiles          (tuple): Percentiles in [0, 100]
+    Returns:
+        dict: Compact record, json serializable, with the mean chamfer
+              distances 'chamfer_gt_pred' and 'chamfer_pred_gt', the
+              'completeness' and 'accuracy' statistics (see distance_statistics)
+              and the 'fscore' {threshold: F-score}
+    """
+    completeness = distance_statistics(chamfer_gt_pred, thresholds, percentiles)
+    accuracy = distance_statistics(chamfer_pred_gt, thresholds, percentiles)
+
+    fscore = {}
+    for t in completeness['ratio'].keys():
+        recall, precision = completeness['ratio'][t], accuracy['ratio'][t]
+        fscore[t] = 2. * precision * recall / (precision + recall) \
+            if precision + recall > 0 else 0.
+
+    return {
+        'chamfer_gt_pred': completeness['mean'],
+        'chamfer_pred_gt': accuracy['mean'],
+        'completeness': completeness,
+        'accuracy': accuracy,
+        'fscore': fscore
+    }
+
+
+def evaluate_scene_metrics(h3ds,
+                           scene_id: str,
+                           mesh_pred,
+                           landmarks_pred: dict = None,
+                           region_id: str = None,
+                           thresholds: tuple = THRESHOLDS,
+                           percentiles: tuple = PERCENTILES):
+    """
+    Evaluates a predicted mesh like H3DS.evaluate_scene, but only keeps the
+    metrics record, so the per-vertex distances and the meshes are released
+    as soon as the metrics are computed.
+    Args:
+        h3ds            (H3DS): H3DS dataset instance
+        scene_id         (str): Scene identifier
+        mesh_pred       (Mesh): Predicted mesh for that scene
+        landmarks_pred  (dict): Landmarks on the predicted mesh
+        region_id        (str): Region identifier
+        thresholds     (tuple): Thresholds of the F-score
+        percentiles    (tuple): Percentiles in [0, 100]
+    Returns:
+        dict: Metrics record (see compute_metrics)
+    """
+    chamfer_gt_pred, chamfer_pred_gt, _, _ = h3ds.evaluate_scene(
+        scene_id, mesh_pred, landmarks_pred, region_id)
+    return compute_metrics(chamfer_gt_pred, chamfer_pred_gt, thresholds,
+                           percentiles)
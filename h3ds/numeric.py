@@ -1,16 +1,17 @@
 import copy
+import time
 
-import cv2
 import numpy as np
-import trimesh
-from scipy.spatial import cKDTree
 
 from h3ds.log import logger
+from h3ds.profiling import profiler
 from h3ds.mesh import Mesh
-from h3ds.affine_transform import AffineTransform
+from h3ds.affine_transform import AffineTransform, transform_points
 
 
+@profiler.timed('numeric.load_K_Rt')
 def load_K_Rt(P: np.ndarray):
+    import cv2
 
     dec = cv2.decomposeProjectionMatrix(P)
     K = dec[0]
@@ -26,54 +27,689 @@ def load_K_Rt(P: np.ndarray):
     return intrinsics, pose
 
 
+@profiler.timed('numeric.perform_alignment')
 def perform_alignment(mesh_source: Mesh,
                       mesh_target: Mesh,
                       landmarks_source: dict = None,
                       landmarks_target: dict = None) -> tuple:
 
+    transform = landmarks_transform(mesh_source, mesh_target, landmarks_source,
+                                    landmarks_target)
+    if landmarks_source is None or landmarks_target is None:
+        return mesh_source, transform
+
+    return transform_mesh(mesh_source, transform), transform
+
+
+def landmarks_transform(mesh_source: Mesh,
+                        mesh_target: Mesh,
+                        landmarks_source: dict = None,
+                        landmarks_target: dict = None) -> np.ndarray:
+    """
+    Computes the similarity transform that aligns the landmarks of the source
+    mesh to the landmarks of the target mesh, without transforming the mesh.
+    The identity is returned if any of the landmarks is missing.
+    """
     if landmarks_source is None or landmarks_target is None:
         logger.warning(
             'Alignment skipped: Landmarks source and/or target were not provided.'
         )
-        return mesh_source, np.eye(4)
+        return np.eye(4)
 
     l_ids = landmarks_target.keys()
     points_s = mesh_source.vertices[[landmarks_source[l] for l in l_ids]]
     points_t = mesh_target.vertices[[landmarks_target[l] for l in l_ids]]
 
-    transform, _, _ = trimesh.registration.procrustes(points_s,
-                                                      points_t,
-                                                      reflection=False)
+    return procrustes(points_s, points_t)
 
-    return transform_mesh(mesh_source, transform), transform
+
+@profiler.timed('numeric.perform_batch_alignment')
+def perform_batch_alignment(meshes_source: list,
+                            mesh_target: Mesh,
+                            landmarks_source: list,
+                            landmarks_target: dict,
+                            weights: dict = None,
+                            scale: bool = True) -> tuple:
+    """
+    Aligns many source meshes, i.e. the predictions of several checkpoints, to
+    the same target mesh with a single batched Procrustes. The meshes are
+    transformed lazily, one at a time, when the returned generator is consumed.
+    Args:
+        meshes_source    (list): List of B source meshes
+        mesh_target      (Mesh): Target mesh
+        landmarks_source (list): List of B {landmark_id: vertex_id} dictionaries
+        landmarks_target (dict): {landmark_id: vertex_id} dictionary
+        weights          (dict): Optional {landmark_id: weight} dictionary
+        scale            (bool): Estimate a similarity instead of a rigid transform
+    Returns:
+        generator : The B aligned meshes
+        np.ndarray: (B, 4, 4) transforms
+    """
+    l_ids = list(landmarks_target.keys())
+    points_s = np.stack([
+        m.vertices[[l[i]
+                    for i in l_ids]]
+        for m, l in zip(meshes_source, landmarks_source)
+    ])
+    points_t = mesh_target.vertices[[landmarks_target[i] for i in l_ids]]
+    if weights is not None:
+        weights = np.array([weights.get(i, 1.) for i in l_ids])
+
+    transforms = procrustes(points_s, points_t, weights=weights, scale=scale)
+    meshes = (transform_mesh(m, t) for m, t in zip(meshes_source, transforms))
+
+    return meshes, transforms
 
 
+def procrustes(source: np.ndarray,
+               target: np.ndarray,
+               weights: np.ndarray = None,
+               scale: bool = True) -> np.ndarray:
+    """
+    Batched least-squares similarity transform between corresponding points
+    (Umeyama, 1991). Reflections are never returned.
+    Args:
+        source  (np.ndarray): (L, 3) or (B, L, 3) source points
+        target  (np.ndarray): (L, 3) or (B, L, 3) target points
+        weights (np.ndarray): Optional (L,) non-negative weight of each point
+        scale         (bool): Estimate the scale, otherwise the transform is rigid
+    Returns:
+        np.ndarray: (4, 4) or (B, 4, 4) transforms mapping source to target
+    """
+    source = np.asarray(source, dtype=np.float64)
+    target = np.asarray(target, dtype=np.float64)
+    if weights is None:
+        weights = np.ones(source.shape[-2])
+    weights = np.asarray(weights, dtype=np.float64) / np.sum(weights)
+
+    mu_s = np.einsum('l,...li->...i', weights, source)
+    mu_t = np.einsum('l,...li->...i', weights, target)
+    centered_s = source - mu_s[..., np.newaxis, :]
+    centered_t = target - mu_t[..., np.newaxis, :]
+
+    # Weighted cross-covariance and its SVD, with the sign correction that
+    # turns a reflection into the closest rotation
+    covariance = np.einsum('l,...li,...lj->...ij', weights, centered_t,
+                           centered_s)
+    U, S, Vt = np.linalg.svd(covariance)
+    d = np.sign(np.linalg.det(U) * np.linalg.det(Vt))
+    d = np.where(d == 0, 1., d)
+    U[..., :, -1] *= d[..., np.newaxis]
+    S[..., -1] *= d
+    R = U @ Vt
+
+    c = np.ones(d.shape)
+    if scale:
+        variance = np.einsum('l,...li,...li->...', weights, centered_s,
+                             centered_s)
+        c = np.sum(S, axis=-1) / variance
+
+    transforms = np.zeros(R.shape[:-2] + (4, 4))
+    transforms[..., :3, :3] = c[..., np.newaxis, np.newaxis] * R
+    transforms[..., :3, 3] = mu_t - np.einsum('...ij,...j->...i',
+                                              transforms[..., :3, :3], mu_s)
+    transforms[..., 3, 3] = 1.
+    return transforms
+
+
+ICP_METHODS = ['point_to_point', 'point_to_plane', 'symmetric']
+
+
+@profiler.timed('numeric.perform_icp')
 def perform_icp(mesh_source: Mesh,
                 mesh_target: Mesh,
                 mask_source: np.ndarray = None,
                 mask_target: np.ndarray = None,
+                method: str = 'point_to_point',
                 **icp_args) -> tuple:
+    """
+    Finely aligns a source mesh to a target mesh with ICP.
+    Args:
+        mesh_source (Mesh): Mesh to align
+        mesh_target (Mesh): Reference mesh
+        mask_source (np.ndarray): Optional indices or mask of the source vertices
+        mask_target (np.ndarray): Optional indices or mask of the target vertices
+        method       (str): 'point_to_point' (see icp), 'point_to_plane' with the
+                            normals of the source mesh or 'symmetric' with both
+                            normals (see icp_point_to_plane)
+        icp_args    (dict): Arguments of icp or icp_point_to_plane
+    Returns:
+        Mesh      : Aligned source mesh
+        np.ndarray: 4x4 transform from source to target
+    """
+    if method not in ICP_METHODS:
+        raise ValueError(f'ICP method {method}. Use one of {ICP_METHODS}')
+
+    def select(values, mask):
+        return values if mask is None else values[mask]
 
-    points_source = mesh_source.vertices if mask_source is None else mesh_source.vertices[
-        mask_source]
-    points_target = mesh_target.vertices if mask_target is None else mesh_source.vertices[
-        mask_target]
-    transform, _, _ = trimesh.registration.icp(points_source, points_target,
-                                               **icp_args)
+    points_source = select(mesh_source.vertices, mask_source)
+    points_target = select(mesh_target.vertices, mask_target)
+    if method == 'point_to_point':
+        transform = icp(points_source, points_target, **icp_args)[0]
+    else:
+        normals_target = select(vertex_normals(mesh_target),
+                                mask_target) if method == 'symmetric' else None
+        transform = icp_point_to_plane(points_source,
+                                       points_target,
+                                       select(vertex_normals(mesh_source),
+                                              mask_source),
+                                       normals_target,
+                                       symmetric=method == 'symmetric',
+                                       **icp_args)[0]
 
     return transform_mesh(mesh_source, transform), transform
 
 
+def vertex_normals(mesh: Mesh) -> np.ndarray:
+    """
+    Unit normals of the vertices of a mesh. The normals of the mesh are used
+    if they are valid, otherwise they are computed from the faces.
+    """
+    normals = mesh.vertex_normals
+    if normals.shape == mesh.vertices.shape and np.all(
+            np.abs(np.linalg.norm(normals, axis=1) - 1.) < 1e-2):
+        return normals
+
+    mesh = copy.copy(mesh)
+    mesh.compute_normals()
+    return mesh.vertex_normals
+
+
+def icp(points_source: np.ndarray,
+        points_target: np.ndarray,
+        initial: np.ndarray = None,
+        threshold: float = 1e-5,
+        max_iterations: int = 20,
+        index: str = 'kdtree',
+        max_distance: float = None,
+        return_report: bool = False,
+        **procrustes_args) -> tuple:
+    """
+    Iterative closest point, like trimesh.registration.icp, with a choice of
+    spatial index for the nearest neighbour queries. If a maximum distance is
+    provided, source points without a target point closer than it are left
+    out of each alignment step.
+    Args:
+        points_source (np.ndarray): (N, 3) points to align
+        points_target (np.ndarray): (M, 3) reference points
+        initial       (np.ndarray): Initial 4x4 transform of the source points
+        threshold          (float): Stop when the cost decreases less than it
+        max_iterations       (int): Maximum number of iterations
+        index                (str): Spatial index (see build_spatial_index)
+        max_distance       (float): Maximum distance of the correspondences
+        return_report       (bool): Also return the convergence report
+        procrustes_args     (dict): Arguments of trimesh.registration.procrustes
+    Returns:
+        np.ndarray: 4x4 transform from source to target
+        np.ndarray: (N, 3) transformed source points
+        float     : Cost of the last alignment
+        dict      : Convergence report, only with return_report (see icp_report)
+    """
+    import trimesh
+
+    start = time.perf_counter()
+
+    initial = np.eye(4) if initial is None else initial
+    points_target = np.asarray(points_target, dtype=np.float64)
+    points = transform_points(initial,
+                              np.asarray(points_source, dtype=np.float64))
+    tree = build_spatial_index(points_target, index, max_distance)
+    upper_bound = np.inf if max_distance is None else max_distance
+
+    total_transform = initial
+    old_cost, cost = np.inf, np.inf
+    costs, inliers, converged = [], [], False
+    for _ in range(max_iterations):
+        _, ix = tree.query(points, k=1, distance_upper_bound=upper_bound)
+        matched = ix < len(points_target)
+        if not np.any(matched):
+            logger.warning('ICP stopped: No correspondences were found.')
+            break
+
+        transform, _, cost = trimesh.registration.procrustes(
+            points[matched], points_target[ix[matched]], **procrustes_args)
+        points = transform_points(transform, points)
+        total_transform = np.dot(transform, total_transform)
+        costs.append(float(cost))
+        inliers.append(float(np.mean(matched)))
+
+        if old_cost - cost < threshold:
+            converged = True
+            break
+        old_cost = cost
+
+    if return_report:
+        return total_transform, points, cost, icp_report(
+            'point_to_point', costs, inliers, converged, start)
+    return total_transform, points, cost
+
+
+def icp_point_to_plane(points_source: np.ndarray,
+                       points_target: np.ndarray,
+                       normals_source: np.ndarray = None,
+                       normals_target: np.ndarray = None,
+                       initial: np.ndarray = None,
+                       threshold: float = 1e-5,
+                       max_iterations: int = 20,
+                       index: str = 'kdtree',
+                       max_distance: float = None,
+                       symmetric: bool = False,
+                       robust: str = None,
+                       robust_param: float = None,
+                       return_report: bool = False) -> tuple:
+    """
+    Rigid iterative closest point minimizing the distances along the normals,
+    which slide along smooth surfaces instead of pulling the points towards
+    their current closest point, so it converges in a few iterations. Each
+    iteration solves the 6-DoF system linearized around the current pose. The
+    distances are measured along the normals of the target if provided,
+    otherwise along the normals of the source. With `symmetric`, both normals
+    are used and the rotation is split between the two point sets
+    (Rusinkiewicz, 2019). Outliers are downweighted with a Huber loss, or
+    discarded by keeping only the closest fraction of the correspondences.
+    Args:
+        points_source  (np.ndarray): (N, 3) points to align
+        points_target  (np.ndarray): (M, 3) reference points
+        normals_source (np.ndarray): (N, 3) unit normals of the source points
+        normals_target (np.ndarray): (M, 3) unit normals of the target points
+        initial        (np.ndarray): Initial 4x4 rigid transform of the source points
+        threshold           (float): Stop when the cost decreases less than it
+        max_iterations        (int): Maximum number of iterations
+        index                 (str): Spatial index (see build_spatial_index)
+        max_distance        (float): Maximum distance of the correspondences
+        symmetric            (bool): Symmetric objective, it needs both normals
+        robust                (str): None, 'huber' or 'trimmed'
+        robust_param        (float): Huber threshold, by default 1.345 times the
+                                     robust standard deviation of the distances.
+                                     Fraction kept by 'trimmed', by default 0.9
+        return_report        (bool): Also return the convergence report
+    Returns:
+        np.ndarray: 4x4 transform from source to target
+        np.ndarray: (N, 3) transformed source points
+        float     : Weighted mean squared distance along the normals of the
+                    correspondences of the last iteration
+        dict      : Convergence report, only with return_report (see icp_report)
+    """
+    if normals_source is None and normals_target is None:
+        raise ValueError('Point to plane ICP needs the normals of the source '
+                         'or the target points')
+    if symmetric and (normals_source is None or normals_target is None):
+        raise ValueError('Symmetric ICP needs the normals of both point sets')
+    if robust not in [None, 'huber', 'trimmed']:
+        raise ValueError(f'Robust loss {robust}')
+
+    start = time.perf_counter()
+    initial = np.eye(4) if initial is None else np.asarray(initial)
+    points_target = np.asarray(points_target, dtype=np.float64)
+    points = transform_points(initial,
+                              np.asarray(points_source, dtype=np.float64))
+    normals = None if normals_source is None else _rotate_normals(
+        initial, np.asarray(normals_source, dtype=np.float64))
+    if normals_target is not None:
+        normals_target = np.asarray(normals_target, dtype=np.float64)
+    tree = build_spatial_index(points_target, index, max_distance)
+    upper_bound = np.inf if max_distance is None else max_distance
+
+    total_transform = initial
+    old_cost, cost = np.inf, np.inf
+    costs, inliers, converged = [], [], False
+    for _ in range(max_iterations):
+        _, ix = tree.query(points, k=1, distance_upper_bound=upper_bound)
+        matched = np.flatnonzero(ix < len(points_target))
+        if len(matched) == 0:
+            logger.warning('ICP stopped: No correspondences were found.')
+            break
+
+        transform, cost, weights = _point_to_plane_step(
+            points[matched], points_target[ix[matched]],
+            None if normals is None else normals[matched],
+            None if normals_target is None else normals_target[ix[matched]],
+            symmetric, robust, robust_param)
+        points = transform_points(transform, points)
+        if normals is not None:
+            normals = _rotate_normals(transform, normals)
+        total_transform = np.dot(transform, total_transform)
+        costs.append(float(cost))
+        inliers.append(float(np.count_nonzero(weights) / len(points)))
+
+        if old_cost - cost < threshold:
+            converged = True
+            break
+        old_cost = cost
+
+    if return_report:
+        return total_transform, points, cost, icp_report(
+            'symmetric' if symmetric else 'point_to_plane', costs, inliers,
+            converged, start)
+    return total_transform, points, cost
+
+
+def icp_report(method: str, costs: list, inliers: list, converged: bool,
+               start: float) -> dict:
+    """
+    Convergence report of an ICP run, to compare the ICP variants.
+    Args:
+        method      (str): ICP variant
+        costs      (list): Cost of each iteration
+        inliers    (list): Fraction of source points used in each iteration
+        converged  (bool): Whether the cost stopped decreasing before the
+                           maximum number of iterations
+        start     (float): time.perf_counter() at the start of the run
+    Returns:
+        dict: 'method', 'iterations', 'converged', 'costs', 'inliers' and
+              'seconds', json serializable
+    """
+    return {
+        'method': method,
+        'iterations': len(costs),
+        'converged': converged,
+        'costs': costs,
+        'inliers': inliers,
+        'seconds': time.perf_counter() - start
+    }
+
+
+def _point_to_plane_step(p: np.ndarray, q: np.ndarray, n_p: np.ndarray,
+                         n_q: np.ndarray, symmetric: bool, robust: str,
+                         robust_param: float) -> tuple:
+    """
+    Internal method: Solves a single linearized point to plane ICP step.
+    Args:
+        p   (np.ndarray): (L, 3) source points
+        q   (np.ndarray): (L, 3) corresponding target points
+        n_p (np.ndarray): (L, 3) source normals or None
+        n_q (np.ndarray): (L, 3) target normals or None
+    Returns:
+        np.ndarray: 4x4 rigid transform of the step
+        float     : Weighted mean squared distance along the normals
+        np.ndarray: (L,) weights of the correspondences
+    """
+    # Residuals are linear in x = (rotation vector, translation). Moving the
+    # target normals with the source, the jacobian of (Rp + t - q) . n is
+    # (p x n, n) for fixed normals and (q x n, n) for the source normals
+    if symmetric:
+        n = n_p + n_q
+        norm = np.linalg.norm(n, axis=1)
+        distances = np.einsum('ij,ij->i', p - q, n) / np.where(
+            norm > 0, norm, 1.)
+    else:
+        n = n_q if n_q is not None else n_p
+        distances = np.einsum('ij,ij->i', p - q, n)
+
+    # Centering the points keeps the rotation and translation columns of the
+    # system in the same range. The symmetric objective centers each point set
+    # on its own, the translation between them is added back at the end
+    c_p, c_q = np.mean(p, axis=0), np.mean(q, axis=0)
+    if not symmetric:
+        c_p = c_q
+    p, q = p - c_p, q - c_q
+    if symmetric:
+        A = np.concatenate([np.cross(p + q, n), n], axis=1)
+    elif n_q is not None:
+        A = np.concatenate([np.cross(p, n), n], axis=1)
+    else:
+        A = np.concatenate([np.cross(q, n), n], axis=1)
+    b = np.einsum('ij,ij->i', q - p, n)
+
+    weights = _robust_weights(np.abs(distances), robust, robust_param)
+    Aw = A * weights[:, np.newaxis]
+    x = np.linalg.lstsq(Aw.T @ A, Aw.T @ b, rcond=None)[0]
+    cost = np.dot(weights, distances**2) / max(np.sum(weights), 1e-12)
+
+    step = np.eye(4)
+    if symmetric:
+        # The rotation is applied half to each point set, so the solution is
+        # the tangent of the half angle, and the translation is in between
+        angle = np.arctan(np.linalg.norm(x[:3]))
+        R = _rotation_matrix(x[:3], angle)
+        step[:3, :3] = R @ R
+        step[:3, 3] = R @ (x[3:] * np.cos(angle))
+    else:
+        step[:3, :3] = _rotation_matrix(x[:3], np.linalg.norm(x[:3]))
+        step[:3, 3] = x[3:]
+
+    # Undo the centering, p' = c_q + step(p - c_p)
+    step[:3, 3] += c_q - step[:3, :3] @ c_p
+    return step, cost, weights
+
+
+def _robust_weights(distances: np.ndarray, robust: str,
+                    robust_param: float) -> np.ndarray:
+    """
+    Internal method: Weights of the correspondences from their distances.
+    """
+    if robust == 'huber':
+        # 1.4826 * MAD is the standard deviation of normally distributed errors
+        k = robust_param if robust_param is not None else \
+            1.345 * 1.4826 * np.median(distances)
+        k = max(k, 1e-12)
+        return np.where(distances <= k, 1., k / np.maximum(distances, k))
+    if robust == 'trimmed':
+        ratio = robust_param if robust_param is not None else 0.9
+        kept = max(1, int(np.ceil(ratio * len(distances))))
+        weights = np.zeros(len(distances))
+        weights[np.argpartition(distances, kept - 1)[:kept]] = 1.
+        return weights
+    return np.ones(len(distances))
+
+
+def _rotation_matrix(axis: np.ndarray, angle: float) -> np.ndarray:
+    """
+    Internal method: Rotation of an angle around an axis (Rodrigues).
+    """
+    norm = np.linalg.norm(axis)
+    if norm < 1e-15:
+        return np.eye(3)
+    k = axis / norm
+    K = np.array([[0., -k[2], k[1]], [k[2], 0., -k[0]], [-k[1], k[0], 0.]])
+    return np.eye(3) + np.sin(angle) * K + (1. - np.cos(angle)) * (K @ K)
+
+
+def _rotate_normals(transform: np.ndarray, normals: np.ndarray):
+    """
+    Internal method: Rotates normals with the linear part of a rigid transform.
+    """
+    normals = normals @ np.asarray(transform)[:3, :3].T
+    return normals / np.linalg.norm(normals, axis=1, keepdims=True)
+
+
+@profiler.timed('numeric.transform_mesh')
 def transform_mesh(mesh: Mesh, transform: np.ndarray):
     mesh_t = mesh.copy()
-    mesh_t.vertices = AffineTransform(matrix=transform).transform(
-        mesh_t.vertices)
+    AffineTransform(matrix=transform).transform(mesh_t.vertices,
+                                                out=mesh_t.vertices)
     return mesh_t
 
 
-def unidirectional_chamfer_distance(source: np.ndarray, target: np.ndarray):
+@profiler.timed('numeric.unidirectional_chamfer_distance')
+def unidirectional_chamfer_distance(source: np.ndarray,
+                                    target: np.ndarray,
+                                    max_distance: float = None,
+                                    index: str = 'kdtree'):
+    """
+    Distance from each source point to its nearest target point. If a maximum
+    distance is provided, larger distances are truncated to it.
+    Args:
+        source   (np.ndarray): (N, 3) points
+        target   (np.ndarray): (M, 3) points
+        max_distance  (float): Optional truncation distance
+        index           (str): Spatial index (see build_spatial_index)
+    Returns:
+        np.ndarray: (N,) distances
+    """
+    with profiler.stage(f'numeric.{index}_build'):
+        tree = build_spatial_index(target, index, max_distance)
+    with profiler.stage(f'numeric.{index}_query'):
+        d, _ = tree.query(source,
+                          k=1,
+                          distance_upper_bound=np.inf
+                          if max_distance is None else max_distance)
+    if max_distance is not None:
+        np.minimum(d, max_distance, out=d)
+
+    # The indices work in float64, return the distances in the input type
+    return d.astype(np.result_type(source.dtype, np.float32), copy=False)
+
+
+def build_spatial_index(points: np.ndarray,
+                        index: str = 'kdtree',
+                        max_distance: float = None):
+    """
+    Builds a spatial index for nearest neighbour queries. Both indices answer
+    index.query(x, k=1, distance_upper_bound) like scipy's cKDTree.
+    Args:
+        points   (np.ndarray): (M, 3) points
+        index           (str): 'kdtree' for a cKDTree, the fastest one, or
+                               'voxel' for a VoxelHash, which requires a
+                               maximum distance
+        max_distance  (float): Maximum distance of the queries, used as the
+                               cell size of the VoxelHash
+    Returns:
+        cKDTree or VoxelHash: The spatial index
+    """
+    if index == 'kdtree':
+        from scipy.spatial import cKDTree
+        return cKDTree(points, leafsize=10)
+    elif index == 'voxel':
+        if max_distance is None:
+            raise ValueError('The voxel index requires a maximum distance')
+        return VoxelHash(points, cell_size=max_distance)
+    raise ValueError(f'Spatial index {index}')
+
+
+class VoxelHash:
+
+    def __init__(self, points: np.ndarray, cell_size: float):
+        """
+        Uniform grid of cubic cells for nearest neighbour queries bounded by a
+        maximum distance. Points are sorted by the linear index of their cell,
+        so the points of a cell are a contiguous range found with a binary
+        search. A query only visits the cells within the bounded distance,
+        i.e. the 27 neighbouring cells when the bound is the cell size. It is
+        written in numpy and is slower than cKDTree: on 160k points of a head
+        with a 5mm bound, about 1.6s against 0.5s, build and query included.
+        cKDTree is therefore the default index of icp and
+        unidirectional_chamfer_distance.
+        Args:
+            points (np.ndarray): (M, 3) points
+            cell_size   (float): Edge length of the cells
+        """
+        points = np.asarray(points, dtype=np.float64)
+        self.n = len(points)
+        self.cell_size = float(cell_size)
+        self.origin = points.min(axis=0) if self.n else np.zeros(3)
+
+        cells = self._cells(points)
+        self.shape = cells.max(axis=0) + 1 if self.n else np.ones(
+            3, dtype=np.int64)
+        keys = self._keys(cells)
+
+        self.order = np.argsort(keys, kind='stable')
+        self.points = points[self.order]
+        self.keys, self.starts, self.counts = np.unique(keys[self.order],
+                                                        return_index=True,
+                                                        return_counts=True)
+
+    def query(self,
+              x: np.ndarray,
+              k: int = 1,
+              distance_upper_bound: float = None,
+              chunk_size: int = 2**16):
+        """
+        Finds the nearest point to each query point within a maximum distance.
+        Args:
+            x             (np.ndarray): (N, 3) query points
+            k                    (int): Number of neighbours. Only 1 is supported
+            distance_upper_bound (float): Maximum distance. Defaults to the cell size
+            chunk_size           (int): Query points processed at once
+        Returns:
+            np.ndarray: (N,) distances, inf if there is no point within the bound
+            np.ndarray: (N,) indices of the nearest points, M if there is none
+        """
+        if k != 1:
+            raise ValueError('VoxelHash only supports k=1')
+        bound = self.cell_size if distance_upper_bound is None else distance_upper_bound
+        if not np.isfinite(bound):
+            raise ValueError('VoxelHash queries require a finite upper bound')
+
+        x = np.asarray(x, dtype=np.float64)
+        d = np.full(len(x), np.inf)
+        ix = np.full(len(x), self.n, dtype=np.intp)
+
+        # Neighbouring cells, the closest ones first
+        rings = max(1, int(np.ceil(bound / self.cell_size)))
+        r = np.arange(-rings, rings + 1)
+        offsets = np.stack(np.meshgrid(r, r, r, indexing='ij'),
+                           axis=-1).reshape(-1, 3)
+        offsets = offsets[np.argsort(np.sum(offsets**2, axis=1), kind='stable')]
+
+        for start in range(0, len(x), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            d[chunk], ix[chunk] = self._query(x[chunk], offsets, bound)
+
+        found = ix < self.n
+        ix[found] = self.order[ix[found]]
+        return d, ix
+
+    def _query(self, x: np.ndarray, offsets: np.ndarray, bound: float):
+        """
+        Internal method: Nearest points of a chunk of query points among the
+        neighbouring cells given by the offsets. Cells farther than the best
+        distance found so far are skipped. Indices are in sorted order.
+        """
+        best_d2 = np.full(len(x), np.inf)
+        best_ix = np.full(len(x), self.n, dtype=np.intp)
+        if self.n == 0:
+            return best_d2, best_ix
+
+        rel = x - self.origin
+        cells = self._cells(x)
+        for offset in offsets:
+            # Distance from each query point to the neighbouring cell
+            c = cells + offset
+            low = c * self.cell_size
+            gap = np.maximum(np.maximum(low - rel, rel - low - self.cell_size),
+                             0.)
+            gap2 = np.einsum('ij,ij->i', gap, gap)
+            valid = np.flatnonzero((gap2 <= np.minimum(best_d2, bound**2)) &
+                                   np.all((c >= 0) & (c < self.shape), axis=1))
+            if len(valid) == 0:
+                continue
+
+            keys = self._keys(c[valid])
+            pos = np.minimum(np.searchsorted(self.keys, keys),
+                             len(self.keys) - 1)
+            found = self.keys[pos] == keys
+            q, cell = valid[found], pos[found]
+            if len(q) == 0:
+                continue
+
+            # Expand every (query, cell) pair into the points of the cell
+            counts = self.counts[cell]
+            group_starts = np.cumsum(counts) - counts
+            candidates = np.arange(counts.sum()) - np.repeat(
+                group_starts, counts) + np.repeat(self.starts[cell], counts)
+            diff = self.points[candidates] - np.repeat(x[q], counts, axis=0)
+            d2 = np.einsum('ij,ij->i', diff, diff)
+
+            # Nearest candidate of each query, the first one in case of ties
+            d2_min = np.minimum.reduceat(d2, group_starts)
+            is_min = d2 == np.repeat(d2_min, counts)
+            group = np.repeat(np.arange(len(q)), counts)[is_min]
+            first = np.r_[True, group[1:] != group[:-1]]
+            ix_min = candidates[is_min][first]
+
+            better = (d2_min < best_d2[q]) & (d2_min <= bound**2)
+            best_d2[q[better]] = d2_min[better]
+            best_ix[q[better]] = ix_min[better]
+
+        return np.sqrt(best_d2), best_ix
 
-    kdtree = cKDTree(target, leafsize=10)
-    d, _ = kdtree.query(source, k=1)
+    def _cells(self, points: np.ndarray):
+        return np.floor(
+            (points - self.origin) / self.cell_size).astype(np.int64)
 
-    return d
+    def _keys(self, cells: np.ndarray):
+        return (cells[:, 0] * self.shape[1] + cells[:, 1]) * self.shape[2] + \
+            cells[:, 2]
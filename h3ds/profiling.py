@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import cProfile
+import pstats
+import threading
+import functools
+from contextlib import contextmanager, nullcontext
+
+from h3ds.log import logger
+
+
+class Profiler:
+
+    def __init__(self, enabled: bool = False):
+        """
+        Aggregates the time spent and the bytes read by each stage of h3ds. The
+        stages are timed with Profiler.stage or Profiler.timed, and cost nothing
+        while the profiler is disabled.
+        Args:
+            enabled (bool): Start collecting stats right away
+        """
+        self.enabled = enabled
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._cprofile = None
+        self._null = nullcontext()
+
+    def enable(self, cprofile: bool = False):
+        """
+        Starts collecting stats.
+        Args:
+            cprofile (bool): Also profile every function call with cProfile
+        """
+        self.enabled = True
+        if cprofile:
+            self._cprofile = self._cprofile or cProfile.Profile()
+            self._cprofile.enable()
+
+    def disable(self):
+        """
+        Stops collecting stats. The collected ones are kept.
+        """
+        self.enabled = False
+        if self._cprofile is not None:
+            self._cprofile.disable()
+
+    def reset(self):
+        """
+        Removes all the collected stats.
+        """
+        with self._lock:
+            self._stats = {}
+        self._cprofile = None
+
+    def stage(self, name: str, nbytes: int = 0):
+        """
+        Context manager timing the enclosed block as a stage.
+        Args:
+            name   (str): Name of the stage
+            nbytes (int): Bytes read by the block
+        Returns:
+            contextmanager: The timed context
+        """
+        if not self.enabled:
+            return self._null
+        return self._stage(name, nbytes)
+
+    def timed(self, name: str = None):
+        """
+        Decorator timing every call of a function as a stage.
+        Args:
+            name (str): Name of the stage. Defaults to the qualified name of
+                        the function
+        Returns:
+            function: The decorator
+        """
+
+        def decorator(fn):
+            stage_name = name or f'{fn.__module__}.{fn.__qualname__}'
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with self._stage(stage_name, 0):
+                    return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def count(self, name: str, calls: int = 0, nbytes: int = 0):
+        """
+        Adds calls and bytes read to a stage without timing it.
+        Args:
+            name   (str): Name of the stage
+            calls  (int): Number of calls
+            nbytes (int): Bytes read
+        """
+        if self.enabled:
+            self._add(name, calls, 0., nbytes)
+
+    def file_size(self, path: str):
+        """
+        Size of a file in bytes, only queried while collecting stats.
+        Args:
+            path (str): Path of the file
+        Returns:
+            int: The size, 0 if the profiler is disabled
+        """
+        return os.path.getsize(path) if self.enabled else 0
+
+    def stats(self):
+        """
+        Collected stats of each stage.
+        Returns:
+            dict: {stage: {'calls', 'total_time', 'mean_time', 'bytes'}}
+        """
+        with self._lock:
+            stats = {n: dict(s) for n, s in self._stats.items()}
+        for s in stats.values():
+            s['mean_time'] = s['total_time'] / s['calls'] if s['calls'] else 0.
+        return stats
+
+    def dump(self, filename: str = None):
+        """
+        Dumps the collected stats as json.
+        Args:
+            filename (str): Optional file to write the json to
+        Returns:
+            str: The json stats
+        """
+        stats = json.dumps(self.stats(), indent=2, sort_keys=True)
+        if filename:
+            with open(filename, 'w') as f:
+                f.write(stats)
+        return stats
+
+    def dump_cprofile(self, filename: str):
+        """
+        Dumps the cProfile stats, readable with pstats or snakeviz.
+        Args:
+            filename (str): Output file
+        """
+        if self._cprofile is None:
+            logger.warning('cProfile was not enabled. Nothing to dump')
+            return
+        pstats.Stats(self._cprofile).dump_stats(filename)
+
+    def report(self):
+        """
+        Logs the collected stats, sorted by total time.
+        """
+        stats = sorted(self.stats().items(),
+                       key=lambda s: s[1]['total_time'],
+                       reverse=True)
+        for name, s in stats:
+            logger.info(f'{name:>48}: {s["calls"]:6d} calls '
+                        f'{s["total_time"]:9.3f} s '
+                        f'{s["bytes"] / 2**20:9.2f} MB')
+
+    @contextmanager
+    def _stage(self, name: str, nbytes: int):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add(name, 1, time.perf_counter() - start, nbytes)
+
+    def _add(self, name: str, calls: int, total_time: float, nbytes: int):
+        with self._lock:
+            s = self._stats.setdefault(name, {
+                'calls': 0,
+                'total_time': 0.,
+                'bytes': 0
+            })
+            s['calls'] += calls
+            s['total_time'] += total_time
+            s['bytes'] += nbytes
+
+
+profiler = Profiler(enabled=os.getenv('H3DS_PROFILE', '0') == '1')
@@ -0,0 +1,159 @@
+import os
+import hashlib
+import threading
+
+from h3ds.profiling import profiler
+from h3ds.utils import create_parent_directory, get_file_extension
+
+
+class ImagePyramid:
+
+    def __init__(self, root: str, path: str, max_bytes: int = 2**30):
+        """
+        On-disk cache of downsampled images. JPEG images whose target size is
+        an exact 1/2, 1/4 or 1/8 of the native resolution are decoded directly
+        at that size with PIL's draft mode, in the DCT domain. Any other size
+        is decoded once, resized and stored in the cache, so that later reads
+        only decode the small image. The least recently used files are evicted
+        when the cache grows over `max_bytes`.
+        Args:
+            root      (str): Root directory of the cached images
+            path      (str): Directory where the cache is stored
+            max_bytes (int): Maximum size of the cache. 0 disables the cache
+        """
+        self.root = root
+        self.path = path
+        self.max_bytes = max_bytes
+        self._nbytes = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def target_size(image_size: tuple, scale: float = None, size: tuple = None):
+        """
+        Computes the (width, height) of a downsampled image.
+        Args:
+            image_size (tuple): Native (width, height)
+            scale      (float): Scale factor, i.e. 0.25
+            size       (tuple): Explicit (width, height). It has priority
+        Returns:
+            tuple: (width, height)
+        """
+        if size is not None:
+            return tuple(size)
+        return (max(1, int(round(image_size[0] * scale))),
+                max(1, int(round(image_size[1] * scale))))
+
+    def load(self,
+             image_path: str,
+             scale: float = None,
+             size: tuple = None,
+             resample: int = None):
+        """
+        Loads a downsampled image.
+        Args:
+            image_path (str): Path of the native resolution image
+            scale    (float): Scale factor, i.e. 0.25
+            size     (tuple): Explicit (width, height). It has priority
+            resample   (int): PIL resampling filter used for other sizes.
+                              Defaults to Image.LANCZOS
+        Returns:
+            PIL.Image : The downsampled image
+        """
+        from PIL import Image
+        resample = Image.LANCZOS if resample is None else resample
+        with Image.open(image_path) as img:
+            target = self.target_size(img.size, scale, size)
+            if target == img.size:
+                return img.copy()
+
+            # JPEG DCT-domain downscale, only if it gives exactly the target size
+            if img.format == 'JPEG':
+                img.draft(img.mode, target)
+                if img.size == target:
+                    with profiler.stage('pyramid.draft'):
+                        return img.copy()
+
+            cached_path = self.cached_path(image_path, target)
+            if os.path.exists(cached_path):
+                os.utime(cached_path)
+                with profiler.stage('pyramid.hit',
+                                    profiler.file_size(cached_path)):
+                    with Image.open(cached_path) as cached:
+                        return cached.copy()
+
+            with profiler.stage('pyramid.miss', profiler.file_size(image_path)):
+                resized = img.resize(target, resample)
+
+        if self.max_bytes > 0:
+            self._store(resized, cached_path)
+        return resized
+
+    def cached_path(self, image_path: str, size: tuple):
+        """
+        Path of the cached image for a given size.
+        """
+        rel_path = os.path.relpath(os.path.abspath(image_path), self.root)
+        if rel_path.startswith(os.pardir):
+            rel_path = hashlib.md5(rel_path.encode('utf-8')).hexdigest() + \
+                get_file_extension(image_path)
+        return os.path.join(self.path, '{}x{}'.format(*size), rel_path)
+
+    def nbytes(self):
+        """
+        Current size of the cache in bytes.
+        """
+        with self._lock:
+            return self._scan()
+
+    def _store(self, img, cached_path: str):
+        """
+        Internal method: Writes an image to the cache and evicts the least
+        recently used ones if the cache is over its maximum size.
+        """
+        with self._lock:
+            self._scan()
+
+        create_parent_directory(cached_path)
+        tmp_path = f'{cached_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        if get_file_extension(cached_path).lower() in ['.jpg', '.jpeg']:
+            img.save(tmp_path, format='JPEG', quality=95)
+        else:
+            img.save(tmp_path, format='PNG')
+        os.replace(tmp_path, cached_path)
+
+        with self._lock:
+            self._nbytes += os.path.getsize(cached_path)
+            if self._nbytes > self.max_bytes:
+                self._evict()
+
+    def _scan(self):
+        """
+        Internal method: Computes the size of the cache once, then it is
+        updated incrementally.
+        """
+        if self._nbytes is None:
+            self._nbytes = sum(size for _, size, _ in self._files())
+        return self._nbytes
+
+    def _files(self):
+        files = []
+        for dirpath, _, filenames in os.walk(self.path):
+            for f in filenames:
+                stat = os.stat(os.path.join(dirpath, f))
+                files.append((os.path.join(dirpath,
+                                           f), stat.st_size, stat.st_mtime))
+        return files
+
+    def _evict(self):
+        """
+        Internal method: Removes the least recently used files until the
+        cache is below its maximum size.
+        """
+        for f, size, _ in sorted(self._files(), key=lambda f: f[2]):
+            if self._nbytes <= self.max_bytes:
+                break
+            try:
+                os.remove(f)
+                self._nbytes -= size
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,214 @@
+import numpy as np
+from PIL import Image
+
+from h3ds.profiling import profiler
+
+
+def pixel_grid(width: int, height: int, offset: float = 0.5):
+    """
+    Homogeneous pixel coordinates of an image, in row-major order.
+    Args:
+        width    (int): Image width
+        height   (int): Image height
+        offset (float): Offset added to the integer coordinates. 0.5 gives the
+                        pixel centers
+    Returns:
+        np.ndarray: (height * width, 3) array with (u, v, 1) rows
+    """
+    v, u = np.mgrid[:height, :width].astype(np.float32)
+    return np.stack([
+        u.ravel() + offset,
+        v.ravel() + offset,
+        np.ones(u.size, dtype=np.float32)
+    ],
+                    axis=-1)
+
+
+def camera_rays(Ks: np.ndarray, poses: np.ndarray, pixels: np.ndarray):
+    """
+    Computes the rays through a set of pixels for a stack of cameras.
+    Args:
+        Ks     (np.ndarray): (V, 3, 3) calibration matrices
+        poses  (np.ndarray): (V, 4, 4) camera to world poses
+        pixels (np.ndarray): (P, 3) homogeneous pixel coordinates
+    Returns:
+        np.ndarray: (V, 3) ray origins, the camera centers
+        np.ndarray: (V, P, 3) unit ray directions in world coordinates
+    """
+    Ks = np.asarray(Ks, dtype=np.float32)
+    poses = np.asarray(poses, dtype=np.float32)
+
+    # Directions in camera coordinates, then rotated to world coordinates
+    M = poses[:, :3, :3] @ np.linalg.inv(Ks)
+    directions = pixels.astype(np.float32) @ np.swapaxes(M, -1, -2)
+    directions /= np.linalg.norm(directions, axis=-1, keepdims=True)
+
+    return poses[:, :3, 3].copy(), directions
+
+
+class RaySampler:
+
+    def __init__(self,
+                 cameras: list,
+                 images: list,
+                 masks: list = None,
+                 foreground_weight: float = 1.0):
+        """
+        Precomputes all the rays of a scene into contiguous buffers, so that
+        random batches of rays can be drawn without python loops. Each ray
+        stores its camera, its direction, the RGB color of its pixel and
+        whether it belongs to the foreground mask. Pixel (u, v) covers the
+        square [u, u + 1) x [v, v + 1) of the image plane, and its ray goes
+        through its center (u + 0.5, v + 0.5) (see pixel_grid).
+        Args:
+            cameras       (list): List of (K, pose) tuples from H3DS.load_cameras
+            images        (list): List of RGB or grayscale images as PIL.Image or
+                                  np.ndarray. Grayscale ones are replicated into
+                                  the three channels
+            masks         (list): Optional list of masks as PIL.Image or np.ndarray
+            foreground_weight (float): Relative probability of drawing a ray
+                              from the foreground with respect to the background
+        """
+        self.n_views = len(cameras)
+        self.centers = np.zeros((self.n_views, 3), dtype=np.float32)
+
+        directions, rgb, mask, view, pixel = [], [], [], [], []
+        for idx, ((K, pose), img) in enumerate(zip(cameras, images)):
+            img = np.asarray(
+                img.convert('RGB') if isinstance(img, Image.Image) else img)
+            if img.ndim == 2:
+                img = img[..., np.newaxis]
+            if img.ndim != 3 or img.shape[-1] not in [1, 3, 4]:
+                raise ValueError(
+                    f'View {idx} has shape {img.shape} instead of HxW or HxWx3')
+            if img.shape[-1] == 1:
+                img = np.repeat(img, 3, axis=-1)
+            height, width = img.shape[:2]
+
+            pixels = pixel_grid(width, height)
+            centers, d = camera_rays(K[np.newaxis], pose[np.newaxis], pixels)
+            self.centers[idx] = centers[0]
+            directions.append(d[0])
+            rgb.append(img.reshape(-1, img.shape[-1])[:, :3])
+            if masks is not None:
+                m = np.asarray(masks[idx])
+                mask.append(m.reshape(height * width, -1).any(axis=-1))
+            else:
+                mask.append(np.ones(height * width, dtype=bool))
+            view.append(np.full(height * width, idx, dtype=np.int16))
+            pixel.append(pixels[:, :2].astype(np.int32))
+
+        self.directions = np.concatenate(directions)
+        self.rgb = np.concatenate(rgb).astype(np.uint8, copy=False)
+        self.mask = np.concatenate(mask)
+        self.view = np.concatenate(view)
+        self.pixel = np.concatenate(pixel)
+        self.set_foreground_weight(foreground_weight)
+
+    @classmethod
+    def from_scene(cls,
+                   h3ds,
+                   scene_id: str,
+                   views_config_id: str = None,
+                   normalized: bool = True,
+                   scale: float = None,
+                   foreground_weight: float = 1.0):
+        """
+        Builds the sampler of a scene from H3DS. If the images are downsampled,
+        the calibration is scaled by diag(sx, sy, 1). With the pixel convention
+        of RaySampler, where the image plane starts at the corner of the first
+        pixel, this keeps the rays through the same points of the scene, so
+        the principal point is not shifted by half a pixel.
+        Args:
+            h3ds               (H3DS): H3DS dataset instance
+            scene_id            (str): Scene identifier
+            views_config_id     (str): Views configuration defining subset of views
+            normalized         (bool): Cameras normalized to fit the scene inside a unit sphere
+            scale             (float): Optional scale factor of the images
+            foreground_weight (float): See RaySampler.__init__
+        Returns:
+            RaySampler: The ray sampler
+        """
+        images = h3ds.load_images(scene_id, views_config_id, scale=scale)
+        masks = h3ds.load_masks(scene_id, views_config_id, scale=scale)
+        cameras = h3ds.load_cameras(scene_id, views_config_id, normalized)
+
+        if scale is not None:
+            paths = h3ds._filter_views(h3ds.helper.scene_images(scene_id),
+                                       scene_id, views_config_id)
+            scaled = []
+            for (K, pose), img, path in zip(cameras, images, paths):
+                with Image.open(path) as native:
+                    sx = img.width / native.width
+                    sy = img.height / native.height
+                scaled.append((np.diag([sx, sy, 1.]) @ K, pose))
+            cameras = scaled
+
+        return cls(cameras, images, masks, foreground_weight)
+
+    def __len__(self):
+        return len(self.directions)
+
+    def set_foreground_weight(self, foreground_weight: float):
+        """
+        Sets the relative probability of drawing foreground rays. A weight of
+        1 samples all the rays uniformly.
+        """
+        self.foreground_weight = float(foreground_weight)
+        if self.foreground_weight == 1.0:
+            self._cdf = None
+            return
+
+        weights = np.where(self.mask, self.foreground_weight,
+                           1.0).astype(np.float64)
+        self._cdf = np.cumsum(weights)
+        self._cdf /= self._cdf[-1]
+
+    def probabilities(self, indices: np.ndarray):
+        """
+        Probability of drawing each of the given rays in a single draw.
+        """
+        if self._cdf is None:
+            return np.full(len(indices), 1. / len(self), dtype=np.float32)
+        weights = np.where(self.mask[indices], self.foreground_weight, 1.0)
+        total = self.foreground_weight * np.count_nonzero(self.mask) + \
+            np.count_nonzero(~self.mask)
+        return (weights / total).astype(np.float32)
+
+    @profiler.timed('rays.sample')
+    def sample(self, n_rays: int, rng: np.random.Generator = None):
+        """
+        Draws a random batch of rays, with replacement.
+        Args:
+            n_rays                (int): Number of rays
+            rng (np.random.Generator): Optional random generator
+        Returns:
+            dict: Batch with the 'origins' (N, 3), 'directions' (N, 3), 'rgb' (N, 3)
+                  in [0, 1], 'mask' (N,), 'view' (N,), 'pixel' (N, 2) and the
+                  'indices' (N,) of the rays
+        """
+        rng = rng or np.random.default_rng()
+        if self._cdf is None:
+            indices = rng.integers(0, len(self), n_rays)
+        else:
+            indices = np.searchsorted(self._cdf,
+                                      rng.random(n_rays),
+                                      side='right')
+            np.minimum(indices, len(self) - 1, out=indices)
+
+        return self.gather(indices)
+
+    def gather(self, indices: np.ndarray):
+        """
+        Gathers the rays with the given indices (see RaySampler.sample).
+        """
+        view = self.view[indices]
+        return {
+            'origins': self.centers[view],
+            'directions': self.directions[indices],
+            'rgb': self.rgb[indices].astype(np.float32) / 255.,
+            'mask': self.mask[indices],
+            'view': view,
+            'pixel': self.pixel[indices],
+            'indices': indices
+        }
@@ -0,0 +1,97 @@
+import numpy as np
+
+from h3ds.profiling import profiler
+
+
+class RegionIndex:
+
+    def __init__(self, vertices: np.ndarray, landmarks: dict = None):
+        """
+        Spatial index over the vertices of a mesh to select regions on the
+        fly, i.e. all the vertices inside a sphere centered at a landmark,
+        instead of reading precomputed region files. The KD-tree is built
+        once, and each query only visits the vertices close to the region.
+        The returned indices are sorted and can be used directly with
+        Mesh.cut or H3DS.evaluate_scene.
+        Args:
+            vertices (np.ndarray): (N, 3) mesh vertices
+            landmarks      (dict): Optional {landmark_id: vertex_id} dictionary
+        """
+        from scipy.spatial import cKDTree
+
+        self.vertices = np.asarray(vertices)
+        self.landmarks = landmarks or {}
+        with profiler.stage('regions.build'):
+            self._tree = cKDTree(self.vertices, leafsize=10)
+
+    def __len__(self):
+        return len(self.vertices)
+
+    @profiler.timed('regions.sphere')
+    def sphere(self, center: np.ndarray, radius: float):
+        """
+        Vertices inside a sphere.
+        Args:
+            center (np.ndarray): Center of the sphere
+            radius      (float): Radius of the sphere
+        Returns:
+            np.ndarray: Sorted indices of the vertices
+        """
+        indices = self._tree.query_ball_point(np.asarray(center, dtype=float),
+                                              radius,
+                                              return_sorted=True)
+        return np.asarray(indices, dtype=np.int64)
+
+    @profiler.timed('regions.box')
+    def box(self, lower: np.ndarray, upper: np.ndarray):
+        """
+        Vertices inside an axis aligned box.
+        Args:
+            lower (np.ndarray): Lower corner of the box
+            upper (np.ndarray): Upper corner of the box
+        Returns:
+            np.ndarray: Sorted indices of the vertices
+        """
+        lower = np.asarray(lower, dtype=float)
+        upper = np.asarray(upper, dtype=float)
+
+        # The box is the ball of the max norm of the largest half extent,
+        # clipped to the actual extents
+        half = (upper - lower) / 2.
+        indices = np.asarray(self._tree.query_ball_point(lower + half,
+                                                         np.max(half),
+                                                         p=np.inf,
+                                                         return_sorted=True),
+                             dtype=np.int64)
+        inside = np.all((self.vertices[indices] >= lower) &
+                        (self.vertices[indices] <= upper),
+                        axis=1)
+        return indices[inside]
+
+    def landmark_sphere(self, landmark_id: str, radius: float):
+        """
+        Vertices inside a sphere centered at a landmark.
+        Args:
+            landmark_id (str): Landmark identifier, i.e. 'nose_tip'
+            radius    (float): Radius of the sphere
+        Returns:
+            np.ndarray: Sorted indices of the vertices
+        """
+        if landmark_id not in self.landmarks:
+            raise KeyError(f'Landmark {landmark_id} is not available')
+        return self.sphere(self.vertices[self.landmarks[landmark_id]], radius)
+
+    def face_sphere(self, radius: float = 95.):
+        """
+        Vertices inside a sphere centered at the tip of the nose, the same
+        definition as the 'face_sphere' region of H3DS.
+        """
+        return self.landmark_sphere('nose_tip', radius)
+
+    def mask(self, indices: np.ndarray):
+        """
+        Converts the indices of a region into a boolean mask over the vertices.
+        """
+        mask = np.zeros(len(self), dtype=bool)
+        mask[indices] = True
+        return mask
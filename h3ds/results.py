@@ -0,0 +1,274 @@
+import os
+import json
+import hashlib
+
+import numpy as np
+
+from h3ds.log import logger
+from h3ds.mesh import Mesh
+from h3ds.metrics import compute_metrics
+from h3ds.utils import md5, create_directory
+
+
+class ResultsStore:
+
+    extension = '.h3dsr'
+
+    def __init__(self, path: str, method: str):
+        """
+        Append-only store for the outputs of H3DS.evaluate_scene. Each method
+        has its own file, where every record holds the per-vertex chamfer
+        arrays and the summary metrics of one evaluation. Records are written
+        as a json header line followed by the raw bytes of the arrays, so an
+        interrupted evaluation can be resumed by skipping the stored keys.
+        Args:
+            path   (str): Directory where the results are stored
+            method (str): Name of the evaluated method
+        """
+        self.path = os.path.expanduser(path)
+        self.method = method
+        self.filename = os.path.join(self.path, f'{method}{self.extension}')
+        self._index = {}
+
+        create_directory(self.path)
+        self._build_index()
+
+    @staticmethod
+    def key(scene_id: str,
+            views_config_id: str,
+            region_id: str,
+            prediction_hash: str,
+            gt_version: str,
+            icp_method: str = 'point_to_point',
+            visible: bool = False,
+            landmarks_hash: str = None):
+        """
+        Builds the key that identifies an evaluation.
+        Args:
+            scene_id        (str): Scene identifier
+            views_config_id (str): Views configuration identifier
+            region_id       (str): Region identifier, None for the full head
+            prediction_hash (str): Hash of the predicted mesh file
+            gt_version      (str): Version of the ground truth dataset
+            icp_method      (str): ICP method of the fine alignment. The default
+                                   one is left out, so older keys stay valid
+            visible        (bool): Evaluation restricted to the visible surface
+            landmarks_hash  (str): Digest of the predicted landmarks used for the
+                                   coarse alignment (see landmarks_digest)
+        Returns:
+            str: The evaluation key
+        """
+        fields = [
+            str(scene_id),
+            str(views_config_id),
+            str(region_id or 'full_head'),
+            str(prediction_hash),
+            str(gt_version)
+        ]
+        if icp_method != 'point_to_point':
+            fields.append(str(icp_method))
+        if visible:
+            fields.append('visible')
+        if landmarks_hash is not None:
+            fields.append(f'landmarks-{landmarks_hash}')
+        return '/'.join(fields)
+
+    def keys(self):
+        return list(self._index.keys())
+
+    def __contains__(self, key: str):
+        return key in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def append(self,
+               key: str,
+               chamfer_gt_pred: np.ndarray,
+               chamfer_pred_gt: np.ndarray,
+               metrics: dict = None):
+        """
+        Appends the results of an evaluation to the store. If the key already
+        exists, the new record supersedes the previous one. If the chamfer
+        arrays are None, only the metrics are stored, so they are required.
+        Args:
+            key                    (str): Evaluation key (see ResultsStore.key)
+            chamfer_gt_pred (np.ndarray): Chamfer distance gt->pred
+            chamfer_pred_gt (np.ndarray): Chamfer distance pred->gt
+            metrics               (dict): Summary metrics. Defaults to
+                                          metrics.compute_metrics
+        """
+        if metrics is None and (chamfer_gt_pred is None or
+                                chamfer_pred_gt is None):
+            raise ValueError(
+                'Either the chamfer arrays or the metrics must be provided')
+        if metrics is None:
+            metrics = compute_metrics(chamfer_gt_pred, chamfer_pred_gt)
+
+        arrays = {}
+        if chamfer_gt_pred is not None and chamfer_pred_gt is not None:
+            arrays = {
+                'chamfer_gt_pred': np.ascontiguousarray(chamfer_gt_pred),
+                'chamfer_pred_gt': np.ascontiguousarray(chamfer_pred_gt)
+            }
+        header = {
+            'key':
+                key,
+            'metrics':
+                metrics,
+            'arrays': [{
+                'name': n,
+                'dtype': a.dtype.str,
+                'shape': list(a.shape)
+            } for n, a in arrays.items()]
+        }
+
+        with open(self.filename, 'ab') as f:
+            offset = f.tell()
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            for a in arrays.values():
+                f.write(a.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._index[key] = (offset, header)
+
+    def load(self, key: str):
+        """
+        Loads the results of an evaluation.
+        Args:
+            key (str): Evaluation key (see ResultsStore.key)
+        Returns:
+            np.array: Chamfer distance gt->pred for each groundtruth vertex,
+                      None if only the metrics were stored
+            np.array: Chamfer distance pred->gt for each predicted vertex,
+                      None if only the metrics were stored
+            dict    : Summary metrics
+        """
+        offset, header = self._index[key]
+        with open(self.filename, 'rb') as f:
+            f.seek(offset)
+            f.readline()
+            arrays = {
+                a['name']: self._read_array(f, a) for a in header['arrays']
+            }
+
+        return arrays.get('chamfer_gt_pred'), arrays.get(
+            'chamfer_pred_gt'), header['metrics']
+
+    def metrics(self, key: str):
+        """
+        Loads only the summary metrics of an evaluation.
+        Args:
+            key (str): Evaluation key (see ResultsStore.key)
+        Returns:
+            dict: Summary metrics
+        """
+        return self._index[key][1]['metrics']
+
+    def _build_index(self):
+        """
+        Internal method: Scans the store file and indexes the offset of each
+        record. A truncated trailing record, left by an interrupted write, is
+        discarded and the file is truncated to the last complete record.
+        """
+        if not os.path.exists(self.filename):
+            return
+
+        size = os.path.getsize(self.filename)
+        with open(self.filename, 'rb') as f:
+            offset = 0
+            while offset < size:
+                line = f.readline()
+                try:
+                    header = json.loads(line.decode('utf-8'))
+                    nbytes = sum(
+                        np.dtype(a['dtype']).itemsize * int(np.prod(a['shape']))
+                        for a in header['arrays'])
+                except (ValueError, KeyError):
+                    break
+                end = f.tell() + nbytes
+                if end > size:
+                    break
+                self._index[header['key']] = (offset, header)
+                f.seek(end)
+                offset = end
+
+        if offset < size:
+            logger.warning(
+                f'Discarding incomplete record at the end of {self.filename}')
+            with open(self.filename, 'r+b') as f:
+                f.truncate(offset)
+
+    @staticmethod
+    def _read_array(f, description: dict):
+        dtype = np.dtype(description['dtype'])
+        count = int(np.prod(description['shape']))
+        data = f.read(dtype.itemsize * count)
+        return np.frombuffer(data, dtype=dtype).reshape(description['shape'])
+
+
+def landmarks_digest(landmarks: dict):
+    """
+    Digest of a {landmark_id: vertex_id} dictionary, independent of its order.
+    Returns:
+        str: The digest, or None if there are no landmarks
+    """
+    if landmarks is None:
+        return None
+    items = sorted((str(k), int(v)) for k, v in landmarks.items())
+    return hashlib.md5(json.dumps(items).encode('utf-8')).hexdigest()
+
+
+def evaluate_scene_cached(h3ds,
+                          store: ResultsStore,
+                          scene_id: str,
+                          views_config_id: str,
+                          prediction_file: str,
+                          landmarks_pred: dict = None,
+                          region_id: str = None,
+                          keep_arrays: bool = True,
+                          icp_method: str = 'point_to_point',
+                          visible: bool = False):
+    """
+    Evaluates a predicted mesh file with H3DS.evaluate_scene, unless the
+    results for the same scene, views configuration, region, prediction file,
+    landmarks and dataset version are already in the store.
+    Args:
+        h3ds                (H3DS): H3DS dataset instance
+        store       (ResultsStore): Store with the previous results
+        scene_id             (str): Scene identifier
+        views_config_id      (str): Views configuration identifier
+        prediction_file      (str): Path to the predicted mesh
+        landmarks_pred      (dict): Landmarks on the predicted mesh
+        region_id            (str): Region identifier
+        keep_arrays         (bool): Store the chamfer arrays, not only the metrics
+        icp_method           (str): ICP method (see H3DS.evaluate_scene)
+        visible             (bool): Evaluate only the surface seen by the views
+                                    of the configuration (see H3DS.load_visibility)
+    Returns:
+        np.array: Chamfer distance gt->pred for each groundtruth vertex
+        np.array: Chamfer distance pred->gt for each predicted vertex
+        dict    : Summary metrics
+    """
+    key = store.key(scene_id, views_config_id, region_id, md5(prediction_file),
+                    h3ds.helper.version_config(), icp_method, visible,
+                    landmarks_digest(landmarks_pred))
+    if key in store:
+        logger.info(f'Results for {key} found in {store.filename}')
+        return store.load(key)
+
+    mesh_pred = Mesh().load(prediction_file)
+    chamfer_gt_pred, chamfer_pred_gt, _, _ = h3ds.evaluate_scene(
+        scene_id,
+        mesh_pred,
+        landmarks_pred,
+        region_id,
+        icp_method=icp_method,
+        views_config_id=views_config_id if visible else None)
+    metrics = compute_metrics(chamfer_gt_pred, chamfer_pred_gt)
+    if not keep_arrays:
+        chamfer_gt_pred, chamfer_pred_gt = None, None
+    store.append(key, chamfer_gt_pred, chamfer_pred_gt, metrics)
+
+    return store.load(key)
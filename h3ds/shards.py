@@ -0,0 +1,340 @@
+import io
+import os
+import json
+import queue
+import random
+import tarfile
+import threading
+
+import numpy as np
+
+from h3ds.profiling import profiler
+from h3ds.utils import create_directory, get_file_extension
+
+# Maximum size of a shard in bytes
+SHARD_SIZE = 2**28
+
+
+class ShardWriter:
+
+    def __init__(self,
+                 path: str,
+                 prefix: str = 'h3ds',
+                 shard_size: int = SHARD_SIZE):
+        """
+        Writes samples into a sequence of uncompressed tar files of bounded size.
+        The files of a sample are stored next to each other, named
+        {key}.{extension}, so a reader can stream the shards sequentially. A shard
+        is only visible once it is complete.
+        Args:
+            path       (str): Directory of the shards
+            prefix     (str): Prefix of the shard names
+            shard_size (int): Maximum size of the samples of a shard in bytes. A
+                              sample larger than it is written alone in its shard
+        """
+        self.path = path
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.shards = []
+        self._tar = None
+        self._size = 0
+        self._count = 0
+        create_directory(path)
+
+    def write(self, key: str, files: dict):
+        """
+        Writes a sample.
+        Args:
+            key    (str): Unique key of the sample, without dots
+            files (dict): {extension: bytes} files of the sample
+        """
+        # Each tar member takes a 512 bytes header and is padded to 512 bytes
+        size = sum(512 + -(-len(data) // 512) * 512 for data in files.values())
+        if self._tar is not None and self._size + size > self.shard_size:
+            self._close_shard()
+        if self._tar is None:
+            self._open_shard()
+
+        for extension, data in files.items():
+            info = tarfile.TarInfo(f'{key}.{extension}')
+            info.size = len(data)
+            self._tar.addfile(info, io.BytesIO(data))
+        self._size += size
+        self._count += 1
+
+    def close(self):
+        """
+        Closes the last shard and writes the index of the shards.
+        Returns:
+            list: Shards as dictionaries with their 'name' and 'samples'
+        """
+        self._close_shard()
+        with open(os.path.join(self.path, f'{self.prefix}.json'), 'w') as f:
+            json.dump({'shards': self.shards}, f, indent=1)
+        return self.shards
+
+    def discard(self):
+        """
+        Removes the shards written so far, including the open one, and the index
+        of the shards left by a previous export with the same prefix.
+        """
+        self._discard_shard()
+        for shard in self.shards:
+            os.remove(os.path.join(self.path, shard['name']))
+        self.shards = []
+        index = os.path.join(self.path, f'{self.prefix}.json')
+        if os.path.isfile(index):
+            os.remove(index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # An interrupted export leaves no shard nor index, not even the ones of
+        # a previous export into the same directory, so it cannot be mistaken
+        # for a complete one
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def _shard_path(self):
+        return os.path.join(self.path,
+                            f'{self.prefix}-{len(self.shards):06d}.tar')
+
+    def _open_shard(self):
+        self._tar = tarfile.open(f'{self._shard_path()}.tmp',
+                                 'w',
+                                 format=tarfile.USTAR_FORMAT)
+        self._size, self._count = 0, 0
+
+    def _close_shard(self):
+        if self._tar is None:
+            return
+        self._tar.close()
+        os.replace(f'{self._shard_path()}.tmp', self._shard_path())
+        self.shards.append({
+            'name': os.path.basename(self._shard_path()),
+            'samples': self._count
+        })
+        self._tar = None
+
+    def _discard_shard(self):
+        if self._tar is None:
+            return
+        self._tar.close()
+        os.remove(f'{self._shard_path()}.tmp')
+        self._tar = None
+
+
+@profiler.timed('shards.export')
+def export_shards(h3ds,
+                  path: str,
+                  scenes: list = None,
+                  normalized: bool = False,
+                  prefix: str = 'h3ds',
+                  shard_size: int = SHARD_SIZE):
+    """
+    Exports the (scene, view) samples of H3DS into tar shards. Each sample holds
+    the encoded image and mask, as stored in the dataset, and a json file with
+    the scene metadata and the camera of the view:
+        {scene_id}_{view:04d}.jpg   RGB image
+        {scene_id}_{view:04d}.png   Mask
+        {scene_id}_{view:04d}.json  'scene_id', 'view', 'tags', 'normalized',
+                                    3x3 'K' and 4x4 'pose'
+    Args:
+        h3ds        (H3DS): H3DS dataset instance
+        path         (str): Directory of the shards
+        scenes      (list): Scenes to export. Defaults to all of them
+        normalized  (bool): Cameras of the scene normalized to a unit sphere
+        prefix       (str): Prefix of the shard names
+        shard_size   (int): Maximum size of a shard in bytes
+    Returns:
+        list: Paths of the shards
+    """
+    scenes = h3ds.scenes() if scenes is None else scenes
+    with ShardWriter(path, prefix, shard_size) as writer:
+        for scene_id in scenes:
+            images = h3ds.helper.fetch(h3ds.helper.scene_images(scene_id))
+            masks = h3ds.helper.fetch(h3ds.helper.scene_masks(scene_id))
+            cameras = h3ds.load_cameras(scene_id, normalized=normalized)
+            tags = sorted(h3ds.helper.scene_tags(scene_id))
+            for view, (image_path, mask_path,
+                       (K, pose)) in enumerate(zip(images, masks, cameras)):
+                metadata = {
+                    'scene_id': scene_id,
+                    'view': view,
+                    'tags': tags,
+                    'normalized': normalized,
+                    'K': np.asarray(K, dtype=np.float64).tolist(),
+                    'pose': np.asarray(pose, dtype=np.float64).tolist()
+                }
+                writer.write(
+                    f'{scene_id}_{view:04d}', {
+                        get_file_extension(image_path)[1:]: _read(image_path),
+                        get_file_extension(mask_path)[1:]: _read(mask_path),
+                        'json': json.dumps(metadata).encode('utf-8')
+                    })
+
+    return [os.path.join(path, s['name']) for s in writer.shards]
+
+
+def _read(path: str):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def list_shards(path: str, prefix: str = 'h3ds'):
+    """
+    Paths of the shards written by export_shards, from their index.
+    """
+    with open(os.path.join(path, f'{prefix}.json')) as f:
+        return [os.path.join(path, s['name']) for s in json.load(f)['shards']]
+
+
+def decode_sample(sample: dict):
+    """
+    Decodes the files of a sample exported by export_shards.
+    Args:
+        sample (dict): {'__key__': key, extension: bytes}
+    Returns:
+        dict: The metadata, with 'K' and 'pose' as np.ndarray, the 'image' as
+              a HxWx3 uint8 array and the 'mask' as a HxW uint8 array
+    """
+    from PIL import Image
+
+    decoded = json.loads(sample['json'])
+    decoded['__key__'] = sample['__key__']
+    decoded['K'] = np.array(decoded['K'])
+    decoded['pose'] = np.array(decoded['pose'])
+    for extension, data in sample.items():
+        if extension in ['jpg', 'jpeg']:
+            with Image.open(io.BytesIO(data)) as img:
+                decoded['image'] = np.asarray(img.convert('RGB'))
+        elif extension == 'png':
+            with Image.open(io.BytesIO(data)) as img:
+                decoded['mask'] = np.asarray(img.convert('L'))
+    return decoded
+
+
+class ShardReader:
+
+    def __init__(self,
+                 shards: list,
+                 shuffle_buffer: int = 0,
+                 prefetch: int = 64,
+                 decode: bool = True,
+                 seed: int = None,
+                 worker: int = 0,
+                 num_workers: int = 1):
+        """
+        Streams the samples of a list of tar shards. The shards are read
+        sequentially in a background thread, which keeps up to `prefetch` samples
+        ready. With a shuffle buffer, the order of the shards is shuffled and each
+        sample is drawn at random from a buffer of the next `shuffle_buffer`
+        samples, so the files are still read sequentially.
+        Args:
+            shards        (list): Paths of the shards (see list_shards)
+            shuffle_buffer (int): Size of the shuffle buffer. 0 keeps the order
+            prefetch       (int): Maximum samples read ahead
+            decode        (bool): Decode the samples (see decode_sample),
+                                  otherwise {'__key__': key, extension: bytes}
+            seed           (int): Seed of the shuffling
+            worker         (int): Index of this reader, i.e. a data loader worker
+            num_workers    (int): Number of readers. Each one reads its own shards
+        """
+        self.shards = list(shards)[worker::num_workers]
+        self.shuffle_buffer = shuffle_buffer
+        self.prefetch = prefetch
+        self.decode = decode
+        self.rng = random.Random(seed)
+
+    def __iter__(self):
+        shards = list(self.shards)
+        if self.shuffle_buffer > 0:
+            self.rng.shuffle(shards)
+
+        samples = self._prefetch(shards)
+        if self.shuffle_buffer > 0:
+            samples = self._shuffle(samples)
+        for sample in samples:
+            yield decode_sample(sample) if self.decode else sample
+
+    def _shuffle(self, samples):
+        buffer = []
+        for sample in samples:
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(sample)
+                continue
+            idx = self.rng.randrange(len(buffer))
+            yield buffer[idx]
+            buffer[idx] = sample
+        self.rng.shuffle(buffer)
+        yield from buffer
+
+    def _prefetch(self, shards: list):
+        """
+        Internal method: Reads the samples of the shards in a background thread.
+        The thread stops when the generator is closed.
+        """
+        samples = queue.Queue(maxsize=max(1, self.prefetch))
+        stop = threading.Event()
+        end = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    samples.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def read():
+            try:
+                for shard in shards:
+                    for sample in iterate_shard(shard):
+                        if not put(sample):
+                            return
+                put(end)
+            except Exception as e:
+                put(e)
+
+        thread = threading.Thread(target=read, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = samples.get()
+                if item is end:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            thread.join()
+
+
+def iterate_shard(shard: str):
+    """
+    Iterates the samples of a shard, reading it sequentially.
+    Args:
+        shard (str): Path of the shard
+    Returns:
+        generator: {'__key__': key, extension: bytes} samples
+    """
+    profiler.count('shards.read', 1, profiler.file_size(shard))
+    sample = None
+    with tarfile.open(shard, 'r|') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            key, extension = member.name.split('.', 1)
+            if sample is not None and sample['__key__'] != key:
+                yield sample
+                sample = None
+            if sample is None:
+                sample = {'__key__': key}
+            sample[extension] = tar.extractfile(member).read()
+    if sample is not None:
+        yield sample
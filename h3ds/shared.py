@@ -0,0 +1,249 @@
+import sys
+import json
+import struct
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+from h3ds.log import logger
+from h3ds.mesh import Mesh
+from h3ds.profiling import profiler
+
+HEADER = struct.Struct('<Q')
+ALIGNMENT = 64
+
+
+def _align(size: int):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def _shared_memory(name: str, create: bool = False, size: int = 0):
+    """
+    Opens a shared memory block that is not tracked by the resource tracker of
+    this process, which would otherwise unlink it when the process exits.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name,
+                                          create=create,
+                                          size=size,
+                                          track=False)
+    shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class SharedSceneCache:
+
+    def __init__(self, prefix: str = 'h3ds'):
+        """
+        Cache of decoded scenes in shared memory, to be used by several processes.
+        One process publishes the arrays of a scene (mesh, cameras, images and masks)
+        in a single shared memory block, and the other processes attach to it and
+        get read-only numpy arrays backed by that block, without any copy.
+        Args:
+            prefix (str): Prefix of the shared memory block names
+        """
+        self.prefix = prefix
+        self._segments = {}
+        self._scenes = {}
+
+    def name(self, scene_id: str):
+        return f'{self.prefix}_{scene_id}'
+
+    def __contains__(self, scene_id: str):
+        try:
+            self.attach(scene_id)
+            return True
+        except FileNotFoundError:
+            return False
+
+    @profiler.timed('shared.publish')
+    def publish(self, h3ds, scene_id: str, normalized: bool = False):
+        """
+        Loads a scene from H3DS and copies it into a new shared memory block. The
+        block lives until SharedSceneCache.unlink is called, even after the
+        publishing process exits.
+        Args:
+            h3ds       (H3DS): H3DS dataset instance
+            scene_id    (str): Scene identifier
+            normalized (bool): Scene normalized to fit inside a unit sphere
+        Returns:
+            dict: The shared arrays of the scene
+        """
+        # Views with different sizes cannot be stacked and raise ValueError
+        mesh, images, masks, cameras = h3ds.load_scene(scene_id,
+                                                       normalized=normalized,
+                                                       as_array=True)
+
+        arrays = {
+            'vertices': mesh.vertices,
+            'faces': mesh.faces,
+            'vertex_normals': mesh.vertex_normals,
+            'K': np.stack([K for K, _ in cameras]),
+            'pose': np.stack([P for _, P in cameras]),
+            'images': images,
+            'masks': masks
+        }
+        metadata = {
+            'normalized': normalized,
+            'views_configs': {
+                v: h3ds._get_views_config(scene_id, v)
+                for v in h3ds.default_views_configs(scene_id)
+            }
+        }
+        return self._create(scene_id, arrays, metadata)
+
+    def attach(self, scene_id: str):
+        """
+        Attaches to the shared memory block of a scene.
+        Args:
+            scene_id (str): Scene identifier
+        Returns:
+            dict: The shared arrays of the scene, as read-only np.ndarray
+        """
+        if scene_id in self._scenes:
+            return self._scenes[scene_id]
+
+        shm = _shared_memory(self.name(scene_id))
+        header_size, = HEADER.unpack_from(shm.buf, 0)
+        if header_size == 0:
+            shm.close()
+            raise FileNotFoundError(f'Scene {scene_id} is being published')
+
+        header = json.loads(
+            bytes(shm.buf[HEADER.size:HEADER.size +
+                          header_size]).decode('utf-8'))
+        self._segments[scene_id] = shm
+        self._scenes[scene_id] = self._views(shm, header,
+                                             _align(HEADER.size + header_size))
+        return self._scenes[scene_id]
+
+    def load_scene(self, scene_id: str, views_config_id: str = None):
+        """
+        Loads a published scene, like H3DS.load_scene, without copying its data.
+        Args:
+            scene_id        (str): Scene identifier
+            views_config_id (str): Views configuration defining subset of views
+        Returns:
+            Mesh      : The 3D geometry of the scene as a mesh
+            np.ndarray: VxHxWx3 images
+            np.ndarray: VxHxW masks
+            list      : Array of the cameras
+        """
+        scene = self.attach(scene_id)
+        mesh = self.load_mesh(scene_id)
+
+        views = slice(None)
+        if views_config_id is not None:
+            views = scene['metadata']['views_configs'][views_config_id]
+
+        # All the views are returned without copies. A views configuration
+        # copies only the selected views
+        images = scene['images'][views]
+        masks = scene['masks'][views]
+        cameras = list(zip(scene['K'][views], scene['pose'][views]))
+
+        return mesh, images, masks, cameras
+
+    def load_mesh(self, scene_id: str):
+        """
+        Loads the mesh of a published scene, without copying its data.
+        Args:
+            scene_id (str): Scene identifier
+        Returns:
+            Mesh: The mesh, with read-only vertices, normals and faces
+        """
+        scene = self.attach(scene_id)
+        mesh = Mesh(dtype=scene['vertices'].dtype.type,
+                    index_dtype=scene['faces'].dtype.type)
+        mesh.vertices = scene['vertices']
+        mesh.faces = scene['faces']
+        mesh.vertex_normals = scene['vertex_normals']
+        return mesh
+
+    def close(self, scene_id: str = None):
+        """
+        Detaches from the shared memory blocks. All the arrays obtained from
+        the cache must have been released before.
+        """
+        scenes = [scene_id] if scene_id else list(self._segments.keys())
+        for s in scenes:
+            self._scenes.pop(s, None)
+            shm = self._segments.pop(s, None)
+            if shm is not None:
+                try:
+                    shm.close()
+                except BufferError:
+                    logger.warning(
+                        f'Scene {s} arrays are still in use and cannot be closed'
+                    )
+
+    def unlink(self, scene_id: str):
+        """
+        Removes the shared memory block of a scene. Processes that are already
+        attached keep their data until they close it.
+        """
+        self.close(scene_id)
+        try:
+            shm = _shared_memory(self.name(scene_id))
+        except FileNotFoundError:
+            return
+        if sys.version_info < (3, 13):
+            # SharedMemory.unlink unregisters the block from the tracker
+            resource_tracker.register(shm._name, 'shared_memory')
+        shm.close()
+        shm.unlink()
+
+    def _create(self, scene_id: str, arrays: dict, metadata: dict):
+        """
+        Internal method: Writes the arrays into a new shared memory block. The
+        header size is written last, so that readers never see a partial block.
+        """
+        arrays = {k: np.ascontiguousarray(a) for k, a in arrays.items()}
+        layout, offset = {}, 0
+        for k, a in arrays.items():
+            layout[k] = {
+                'dtype': a.dtype.str,
+                'shape': list(a.shape),
+                'offset': offset
+            }
+            offset += _align(a.nbytes)
+
+        # Offsets are relative to the first aligned byte after the header
+        header = json.dumps({
+            'arrays': layout,
+            'metadata': metadata
+        }).encode('utf-8')
+        data_offset = _align(HEADER.size + len(header))
+
+        shm = _shared_memory(self.name(scene_id),
+                             create=True,
+                             size=max(1, data_offset + offset))
+        HEADER.pack_into(shm.buf, 0, 0)
+        shm.buf[HEADER.size:HEADER.size + len(header)] = header
+        for k, a in arrays.items():
+            dst = np.ndarray(a.shape,
+                             dtype=a.dtype,
+                             buffer=shm.buf,
+                             offset=data_offset + layout[k]['offset'])
+            dst[...] = a
+            del dst
+        HEADER.pack_into(shm.buf, 0, len(header))
+        shm.close()
+
+        return self.attach(scene_id)
+
+    @staticmethod
+    def _views(shm, header: dict, data_offset: int):
+        """
+        Internal method: Builds read-only arrays backed by the shared memory block.
+        """
+        scene = {'metadata': header['metadata']}
+        for k, l in header['arrays'].items():
+            a = np.ndarray(l['shape'],
+                           dtype=np.dtype(l['dtype']),
+                           buffer=shm.buf,
+                           offset=data_offset + l['offset'])
+            a.flags.writeable = False
+            scene[k] = a
+        return scene
@@ -0,0 +1,179 @@
+import os
+import json
+import zlib
+import shutil
+import threading
+
+from h3ds.archive import CRC, FILE_SIZE
+from h3ds.utils import create_parent_directory
+
+
+def content_key(crc: int, size: int):
+    """
+    Key of a file in the content store, from its CRC-32 and its size. Both are
+    stored in the zip central directory, so the keys of a new release are known
+    without decrypting it.
+    """
+    return f'{crc:08x}-{size}'
+
+
+def file_key(path: str):
+    """
+    Computes the content key of a file on disk.
+    """
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), b''):
+            crc = zlib.crc32(chunk, crc)
+    return content_key(crc, os.path.getsize(path))
+
+
+def archive_manifest(archive):
+    """
+    Manifest of a zip archive.
+    Args:
+        archive (ZipArchive): The archive
+    Returns:
+        dict: {member name: content key}
+    """
+    return {
+        name: content_key(member[CRC], member[FILE_SIZE])
+        for name, member in archive.members.items()
+    }
+
+
+def directory_manifest(root: str, names: list):
+    """
+    Manifest of the files of a directory, limited to a list of names. Missing
+    files are skipped.
+    Args:
+        root   (str): Directory
+        names (list): Names of the files relative to root, with '/' separators
+    Returns:
+        dict: {name: content key}
+    """
+    manifest = {}
+    for name in names:
+        path = os.path.join(root, *name.split('/'))
+        if os.path.isfile(path):
+            manifest[name] = file_key(path)
+    return manifest
+
+
+def damaged_files(root: str, manifest: dict, names: list):
+    """
+    Files of a manifest that are missing from a directory, or whose size is not
+    the one of their content key, i.e. deleted or truncated since they were
+    installed. The files are not hashed again.
+    Args:
+        root      (str): Directory
+        manifest (dict): {name: content key} of the installed files
+        names    (list): Names of the files to check
+    Returns:
+        list: Names of the damaged files
+    """
+    damaged = []
+    for name in names:
+        path = os.path.join(root, *name.split('/'))
+        size = int(manifest[name].rsplit('-', 1)[1])
+        if not os.path.isfile(path) or os.path.getsize(path) != size:
+            damaged.append(name)
+    return damaged
+
+
+def diff_manifests(installed: dict, target: dict):
+    """
+    Compares the manifest of an installed dataset against a target one.
+    Args:
+        installed (dict): {name: content key} of the installed files
+        target    (dict): {name: content key} of the target files
+    Returns:
+        dict: Sorted lists of names 'added', 'changed', 'removed' and 'unchanged'
+    """
+    return {
+        'added':
+            sorted(n for n in target if n not in installed),
+        'changed':
+            sorted(n for n in target
+                   if n in installed and installed[n] != target[n]),
+        'removed':
+            sorted(n for n in installed if n not in target),
+        'unchanged':
+            sorted(n for n in target
+                   if n in installed and installed[n] == target[n])
+    }
+
+
+def load_manifest(path: str):
+    """
+    Loads a manifest file.
+    Returns:
+        dict: {name: content key}, or None if it does not exist
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)['files']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_manifest(path: str, version: str, files: dict):
+    create_parent_directory(path)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': version, 'files': files}, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+class ContentStore:
+
+    def __init__(self, path: str):
+        """
+        Content addressed store of the dataset files. Each file is stored once,
+        named after its content key, and the installed datasets are hardlinks
+        to it, so several versions of the dataset share their unchanged files.
+        Files are never modified in place: they are replaced, so a change in
+        one version does not leak to the others.
+        Args:
+            path (str): Directory of the store
+        """
+        self.path = path
+
+    def __contains__(self, key: str):
+        return os.path.exists(self.object_path(key))
+
+    def object_path(self, key: str):
+        return os.path.join(self.path, 'objects', key[:2], key)
+
+    def add(self, path: str, key: str):
+        """
+        Adds a file to the store, as a hardlink.
+        Args:
+            path (str): File to add
+            key  (str): Content key of the file
+        """
+        if key not in self:
+            self._link(path, self.object_path(key))
+
+    def link(self, key: str, destination: str):
+        """
+        Creates a file from the store, as a hardlink.
+        Args:
+            key         (str): Content key of the file
+            destination (str): Path of the new file
+        """
+        self._link(self.object_path(key), destination)
+
+    @staticmethod
+    def _link(source: str, destination: str):
+        """
+        Internal method: Atomically replaces destination by a hardlink to
+        source, or by a copy if the filesystem does not support hardlinks.
+        """
+        create_parent_directory(destination)
+        tmp_path = f'{destination}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.link(source, tmp_path)
+        except OSError:
+            shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, destination)
@@ -1,12 +1,14 @@
 import os
+import shutil
 import hashlib
 import numpy as np
-import matplotlib
-import gdown
+
+from h3ds import colormap
 
 
 # Dataset pull
 def download_file_from_google_drive(id: str, destination: str):
+    import gdown
 
     gdown.download(id=id, output=destination, quiet=False)
 
@@ -59,12 +61,5 @@ def remove(path):
 
 # Visualization
 def error_to_color(errors, clipping_error=None):
-    if clipping_error is not None:
-        errors_norm = np.clip(errors / float(clipping_error), 0., 1.)
-    else:
-        errors_norm = (errors - errors.min()) / (errors.max() - errors.min())
-
-    hsv = np.ones((errors.shape[-1], 3))
-    hsv[:, 0] = (1. - errors_norm) / 3.
-
-    return matplotlib.colors.hsv_to_rgb(hsv)
+    # Colors in [0, 1], see h3ds.colormap.error_to_color for uint8 colors
+    return colormap.error_to_color(errors, clipping_error) / np.float32(255.)
@@ -0,0 +1,193 @@
+import numpy as np
+
+from h3ds.profiling import profiler
+
+# Maximum side of the depth maps in pixels
+MAX_SIZE = 512
+
+# Relative depth tolerance of the depth test
+TOLERANCE = 0.01
+
+
+def world_to_camera(points: np.ndarray, pose: np.ndarray):
+    """
+    Transforms points to the coordinates of a camera, with z pointing forward.
+    Args:
+        points (np.ndarray): (N, 3) points in world coordinates
+        pose   (np.ndarray): 4x4 camera to world pose
+    Returns:
+        np.ndarray: (N, 3) points in camera coordinates
+    """
+    pose = np.asarray(pose, dtype=np.float64)
+    return (np.asarray(points, dtype=np.float64) - pose[:3, 3]) @ pose[:3, :3]
+
+
+@profiler.timed('visibility.rasterize')
+def rasterize_depth(points: np.ndarray,
+                    faces: np.ndarray,
+                    K: np.ndarray,
+                    width: int,
+                    height: int,
+                    chunk_size: int = 2**22):
+    """
+    Renders the depth map of a triangle mesh. The triangles are grouped by the
+    size of their bounding box in pixels, and all the pixels of the boxes of a
+    group are tested at once with barycentric coordinates. The depth is
+    interpolated perspective-correctly and the closest one is kept per pixel.
+    Args:
+        points (np.ndarray): (N, 3) vertices in camera coordinates
+        faces  (np.ndarray): (F, 3) triangles
+        K      (np.ndarray): 3x3 calibration matrix
+        width         (int): Width of the depth map
+        height        (int): Height of the depth map
+        chunk_size    (int): Maximum (triangle, pixel) pairs tested at once
+    Returns:
+        np.ndarray: (height, width) depth map, np.inf where there is no surface
+    """
+    depth = np.full(height * width, np.inf)
+    z = points[:, 2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        uv = (points @ np.asarray(K, dtype=np.float64).T)[:, :2] / z[:,
+                                                                     np.newaxis]
+
+    # Triangles behind the camera are dropped
+    faces = faces[np.all(z[faces] > 0, axis=1)]
+    tri_uv, tri_z = uv[faces], z[faces]
+
+    # Pixels whose centers are inside the bounding box of each triangle
+    x0 = np.maximum(np.ceil(tri_uv[..., 0].min(axis=1) - 0.5), 0)
+    x1 = np.minimum(np.floor(tri_uv[..., 0].max(axis=1) - 0.5), width - 1)
+    y0 = np.maximum(np.ceil(tri_uv[..., 1].min(axis=1) - 0.5), 0)
+    y1 = np.minimum(np.floor(tri_uv[..., 1].max(axis=1) - 0.5), height - 1)
+    extent = np.maximum(x1 - x0, y1 - y0) + 1
+    covered = (x1 >= x0) & (y1 >= y0)
+
+    side = 1
+    while np.any(covered):
+        group = np.flatnonzero(covered & (extent <= side))
+        covered[group] = False
+        oy, ox = np.mgrid[:side, :side].reshape(2, -1)
+        step = max(1, chunk_size // (side * side))
+        for start in range(0, len(group), step):
+            g = group[start:start + step]
+            px = x0[g, np.newaxis] + ox
+            py = y0[g, np.newaxis] + oy
+            inside, z_pixels = _barycentric_depth(tri_uv[g], tri_z[g], px + 0.5,
+                                                  py + 0.5)
+            inside &= (px <= x1[g, np.newaxis]) & (py <= y1[g, np.newaxis])
+            np.minimum.at(depth,
+                          (py[inside] * width + px[inside]).astype(np.int64),
+                          z_pixels[inside])
+        side *= 2
+
+    return depth.reshape(height, width)
+
+
+def _barycentric_depth(tri_uv: np.ndarray, tri_z: np.ndarray, u: np.ndarray,
+                       v: np.ndarray):
+    """
+    Internal method: Tests which pixels are inside their triangle and
+    interpolates their depth.
+    Args:
+        tri_uv (np.ndarray): (T, 3, 2) projected triangles
+        tri_z  (np.ndarray): (T, 3) depth of the vertices
+        u      (np.ndarray): (T, P) pixel coordinates
+        v      (np.ndarray): (T, P) pixel coordinates
+    Returns:
+        np.ndarray: (T, P) whether each pixel is inside its triangle
+        np.ndarray: (T, P) depth of each pixel
+    """
+    a, b, c = (tri_uv[:, i, np.newaxis] for i in range(3))
+    e0, e1 = b - a, c - a
+    du, dv = u - a[..., 0], v - a[..., 1]
+    area = e0[..., 0] * e1[..., 1] - e1[..., 0] * e0[..., 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        wb = (du * e1[..., 1] - e1[..., 0] * dv) / area
+        wc = (e0[..., 0] * dv - du * e0[..., 1]) / area
+    wa = 1. - wb - wc
+    eps = -1e-9
+    inside = (area != 0) & (wa >= eps) & (wb >= eps) & (wc >= eps)
+
+    # 1/z is linear in screen space
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = 1. / (wa / tri_z[:, 0, np.newaxis] + wb / tri_z[:, 1, np.newaxis] +
+                  wc / tri_z[:, 2, np.newaxis])
+    return inside, z
+
+
+def _farthest_depth(depth: np.ndarray, uv: np.ndarray):
+    """
+    Internal method: Farthest depth of the four pixel centers around each
+    point. On a locally planar surface, the depth of a point lies between the
+    ones of the pixels around it, so the test does not depend on the slope of
+    the surface nor on the resolution of the depth map. Around the silhouette
+    the background lets the far side pass, which the normals reject.
+    Args:
+        depth (np.ndarray): (H, W) depth map
+        uv    (np.ndarray): (N, 2) pixel coordinates
+    Returns:
+        np.ndarray: (N,) depth
+    """
+    height, width = depth.shape
+    x0 = np.floor(uv[:, 0] - 0.5).astype(np.int64)
+    y0 = np.floor(uv[:, 1] - 0.5).astype(np.int64)
+    farthest = np.full(len(uv), -np.inf)
+    for dx, dy in [(0, 0), (1, 0), (0, 1), (1, 1)]:
+        x = np.clip(x0 + dx, 0, width - 1)
+        y = np.clip(y0 + dy, 0, height - 1)
+        farthest = np.maximum(farthest, depth[y, x])
+    return farthest
+
+
+@profiler.timed('visibility.visible_vertices')
+def visible_vertices(vertices: np.ndarray,
+                     faces: np.ndarray,
+                     cameras: list,
+                     sizes: np.ndarray,
+                     normals: np.ndarray = None,
+                     max_size: int = MAX_SIZE,
+                     tolerance: float = TOLERANCE):
+    """
+    Computes which vertices of a mesh are seen by each camera. A vertex is
+    visible if it projects inside the image, in front of the camera, and it is
+    not behind the depth map of the mesh rendered from that camera, compared
+    against the farthest of the four pixels around its projection. With
+    normals, the vertices facing away from the camera are also discarded.
+    Args:
+        vertices (np.ndarray): (N, 3) vertices
+        faces    (np.ndarray): (F, 3) triangles
+        cameras        (list): List of V (K, pose) tuples from H3DS.load_cameras
+        sizes    (np.ndarray): (V, 2) image (width, height) of each camera
+        normals  (np.ndarray): Optional (N, 3) vertex normals
+        max_size        (int): Maximum side of the depth maps. The images are
+                               rendered at a lower resolution if larger
+        tolerance     (float): Relative depth tolerance of the depth test
+    Returns:
+        np.ndarray: (V, N) boolean masks
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    faces = np.asarray(faces)
+    masks = np.zeros((len(cameras), len(vertices)), dtype=bool)
+    for idx, ((K, pose), (w, h)) in enumerate(zip(cameras, sizes)):
+        scale = min(1., max_size / max(w, h))
+        K = np.diag([scale, scale, 1.]) @ np.asarray(K, dtype=np.float64)
+        width, height = int(np.ceil(w * scale)), int(np.ceil(h * scale))
+
+        points = world_to_camera(vertices, pose)
+        depth = rasterize_depth(points, faces, K, width, height)
+
+        z = points[:, 2]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            uv = (points @ K.T)[:, :2] / z[:, np.newaxis]
+        visible = (z > 0) & np.all(np.isfinite(uv), axis=1)
+        visible[visible] &= (uv[visible, 0] >= 0) & (uv[visible, 0] < width) & \
+            (uv[visible, 1] >= 0) & (uv[visible, 1] < height)
+
+        ix = np.flatnonzero(visible)
+        visible[ix] = z[ix] <= _farthest_depth(depth, uv[ix]) * (1. + tolerance)
+        if normals is not None:
+            visible &= np.einsum('ij,ij->i', normals,
+                                 np.asarray(pose)[:3, 3] - vertices) > 0
+        masks[idx] = visible
+
+    return masks
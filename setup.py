@@ -47,9 +47,11 @@ setup(
         'tqdm',
         'opencv-python',
         'scipy',
-        'matplotlib',
         'gdown'
     ],
+    entry_points={
+        'console_scripts': ['h3ds=h3ds.cli:main']
+    },
     package_data={
         '': ['config_v1.toml', 'config_v2.toml']
     }
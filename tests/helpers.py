@@ -0,0 +1,10 @@
+import tempfile
+
+
+def temporary_directory(test_case):
+    """
+    Creates a temporary directory that is removed when the test finishes.
+    """
+    tmp = tempfile.TemporaryDirectory()
+    test_case.addCleanup(tmp.cleanup)
+    return tmp.name
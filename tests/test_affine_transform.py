@@ -0,0 +1,79 @@
+import unittest
+
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+from h3ds.affine_transform import AffineTransform, transform_points, compose_transforms, invert_transforms
+
+
+def random_matrices(n):
+    matrices = np.tile(np.eye(4), (n, 1, 1))
+    matrices[:, :3, :3] = Rotation.random(n, random_state=0).as_matrix()
+    matrices[:, :3, 3] = np.random.rand(n, 3)
+    return matrices
+
+
+def homogeneous_transform(matrix, points):
+    points_h = np.concatenate((points, np.ones((len(points), 1))), axis=1)
+    return (matrix @ points_h.T)[:3].T
+
+
+class TestAffineTransform(unittest.TestCase):
+
+    def setUp(self):
+        self.matrices = random_matrices(4)
+        self.points = np.random.rand(100, 3)
+
+    def test_transform(self):
+        t = AffineTransform(matrix=self.matrices[0])
+        self.assertTrue(
+            np.allclose(t.transform(self.points),
+                        homogeneous_transform(self.matrices[0], self.points)))
+
+    def test_transform_out(self):
+        t = AffineTransform(matrix=self.matrices[0])
+        expected = homogeneous_transform(self.matrices[0], self.points)
+        out = t.transform(self.points, out=self.points)
+        self.assertTrue(out is self.points)
+        self.assertTrue(np.allclose(self.points, expected))
+
+    def test_transform_keeps_dtype(self):
+        t = AffineTransform(matrix=self.matrices[0])
+        self.assertEqual(
+            t.transform(self.points.astype(np.float32)).dtype, np.float32)
+
+    def test_transform_stack(self):
+        transformed = transform_points(self.matrices, self.points)
+        self.assertEqual(transformed.shape, (4, 100, 3))
+        for m, p in zip(self.matrices, transformed):
+            self.assertTrue(
+                np.allclose(p, homogeneous_transform(m, self.points)))
+
+    def test_transform_batch(self):
+        points = np.random.rand(4, 100, 3)
+        transformed = transform_points(self.matrices, points)
+        for m, p, q in zip(self.matrices, points, transformed):
+            self.assertTrue(np.allclose(q, homogeneous_transform(m, p)))
+
+    def test_compose_and_invert(self):
+        composed = compose_transforms(self.matrices, self.matrices[::-1])
+        for c, a, b in zip(composed, self.matrices, self.matrices[::-1]):
+            self.assertTrue(np.allclose(c, a @ b))
+        identity = compose_transforms(self.matrices,
+                                      invert_transforms(self.matrices))
+        self.assertTrue(np.allclose(identity, np.eye(4)))
+
+    def test_inverse_cached(self):
+        t = AffineTransform(matrix=self.matrices[0])
+        t_inv = t.inverse()
+        self.assertTrue(np.allclose(t_inv.matrix @ t.matrix, np.eye(4)))
+        self.assertTrue(np.array_equal(t.inverse().matrix, t_inv.matrix))
+        self.assertTrue(np.allclose(t_inv.inverse().matrix, t.matrix))
+
+        # Modifying the matrix invalidates the cache
+        t.matrix[:3, 3] += 1
+        self.assertTrue(np.allclose(t.inverse().matrix @ t.matrix, np.eye(4)))
+
+
+if __name__ == '__main__':
+    unittest.main()
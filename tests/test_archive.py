@@ -0,0 +1,108 @@
+import os
+import shutil
+import zipfile
+import tempfile
+import unittest
+import subprocess
+
+from h3ds.archive import ZipArchive
+
+
+class TestZipArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.src = os.path.join(self.path, 'src')
+        self.files = {
+            'version.txt':
+                b'0.1\n',
+            'scene/cameras.npz':
+                os.urandom(1000),
+            'scene/regions/face.txt':
+                b' '.join(str(i).encode() for i in range(500)),
+            'scene/regions/nose.txt':
+                b'1 2 3'
+        }
+        for name, data in self.files.items():
+            path = os.path.join(self.src, *name.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+
+        self.zip_path = os.path.join(self.path, 'h3ds.zip')
+        with zipfile.ZipFile(self.zip_path, 'w') as zip_ref:
+            for name in self.files.keys():
+                zip_ref.write(os.path.join(self.src, *name.split('/')),
+                              name,
+                              compress_type=zipfile.ZIP_DEFLATED
+                              if name.endswith('.txt') else zipfile.ZIP_STORED)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_fetch(self):
+        root = os.path.join(self.path, 'root')
+        archive = ZipArchive(self.zip_path, root, max_workers=1)
+        self.assertEqual(len(archive), len(self.files))
+
+        paths = [
+            os.path.join(root, 'scene', 'cameras.npz'),
+            os.path.join(root, 'scene', 'regions', 'face.txt')
+        ]
+        self.assertEqual(archive.fetch(paths), paths)
+        for path, name in zip(paths,
+                              ['scene/cameras.npz', 'scene/regions/face.txt']):
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), self.files[name])
+
+        # Only the requested members are extracted
+        self.assertFalse(os.path.exists(os.path.join(root, 'version.txt')))
+        self.assertEqual(archive.read(os.path.join(root, 'version.txt')),
+                         self.files['version.txt'])
+        self.assertRaises(FileNotFoundError, archive.read,
+                          os.path.join(root, 'missing.txt'))
+
+    def test_index(self):
+        root = os.path.join(self.path, 'root')
+        archive = ZipArchive(self.zip_path, root)
+        self.assertTrue(os.path.exists(archive.index_file()))
+        self.assertTrue(os.path.join(root, 'version.txt') in archive)
+        self.assertFalse(os.path.join(root, 'missing.txt') in archive)
+        self.assertEqual(
+            archive.glob(os.path.join(root, 'scene', 'regions'), '.txt'), [
+                os.path.join(root, 'scene', 'regions', 'face.txt'),
+                os.path.join(root, 'scene', 'regions', 'nose.txt')
+            ])
+
+        # The stored index is reused
+        self.assertEqual(
+            ZipArchive(self.zip_path, root).members, archive.members)
+
+    @unittest.skipUnless(shutil.which('zip'), 'zip is not available')
+    def test_encrypted(self):
+        encrypted_path = os.path.join(self.path, 'encrypted.zip')
+        subprocess.check_call(
+            ['zip', '-q', '-r', '-P', 'token', encrypted_path] +
+            list(self.files.keys()),
+            cwd=self.src)
+
+        root = os.path.join(self.path, 'root')
+        archive = ZipArchive(encrypted_path, root, password='token')
+        paths = [
+            os.path.join(root, *name.split('/')) for name in self.files.keys()
+        ]
+        archive.fetch(paths)
+        archive.close()
+        for path, data in zip(paths, self.files.values()):
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), data)
+
+        # Wrong or missing password
+        archive = ZipArchive(encrypted_path, root, password='wrong')
+        self.assertRaises(RuntimeError, archive.read, paths[0])
+        archive = ZipArchive(encrypted_path, root)
+        self.assertRaises(RuntimeError, archive.read, paths[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import os
+import unittest
+
+from h3ds.benchmark import Benchmark, SyntheticH3DS, SCENE_ID, compare, main
+from tests.helpers import temporary_directory
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.dataset = SyntheticH3DS(temporary_directory(self),
+                                     subdivisions=2,
+                                     views=3,
+                                     image_size=32)
+
+    def test_synthetic_dataset(self):
+        h3ds = self.dataset.h3ds()
+        self.assertTrue(h3ds.is_available())
+        mesh, images, masks, cameras = h3ds.load_scene(SCENE_ID, '3')
+        self.assertEqual(len(images), 3)
+        self.assertEqual(len(cameras), 3)
+
+    def test_run_and_compare(self):
+        with Benchmark(self.dataset.h3ds(), SCENE_ID, repeats=1) as benchmark:
+            results = benchmark.run()
+            self.assertEqual(set(results['results'].keys()),
+                             set([s[0] for s in benchmark.stages()]))
+        self.assertFalse(os.path.exists(benchmark.tmp_path))
+        self.assertEqual(results['metadata']['views'], 3)
+        for r in results['results'].values():
+            self.assertGreater(r['throughput'], 0)
+
+        comparison = compare(results, results)
+        for c in comparison.values():
+            self.assertAlmostEqual(c['speedup'], 1.)
+            self.assertFalse(c['regression'])
+
+    def test_main_synthetic(self):
+        results, regressions = main(subdivisions=2,
+                                    views=3,
+                                    image_size=32,
+                                    repeats=1,
+                                    stages=['load_cameras'])
+        self.assertEqual(results['metadata']['scene_id'], SCENE_ID)
+        self.assertEqual(results['metadata']['image_size'], [32, 32])
+        self.assertEqual(list(results['results'].keys()), ['load_cameras'])
+        self.assertEqual(regressions, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+import io
+import os
+import json
+import unittest
+from contextlib import redirect_stdout
+
+from h3ds.cli import main
+from h3ds.benchmark import SyntheticH3DS
+from tests.helpers import temporary_directory
+
+
+def run(argv):
+    stdout = io.StringIO()
+    with redirect_stdout(stdout):
+        code = main(argv)
+    return code, [json.loads(l) for l in stdout.getvalue().splitlines()]
+
+
+class TestCli(unittest.TestCase):
+
+    def setUp(self):
+        self.dataset = SyntheticH3DS(temporary_directory(self),
+                                     subdivisions=2,
+                                     views=4,
+                                     image_size=32)
+        self.args = [
+            '--h3ds-path', self.dataset.path, '--config-path',
+            self.dataset.config_path
+        ]
+
+        self.predictions = temporary_directory(self)
+        self.dataset.mesh.save(os.path.join(self.predictions,
+                                            'synthetic_3.ply'))
+
+    def test_evaluate(self):
+        output_dir = temporary_directory(self)
+        argv = ['evaluate'] + self.args + [
+            '--predictions', self.predictions, '--output-dir', output_dir
+        ]
+        code, events = run(argv)
+        self.assertEqual(code, 0)
+        self.assertEqual([e['event'] for e in events], [
+            'job_missing', 'evaluation_start', 'job_done', 'job_done',
+            'evaluation_done'
+        ])
+        self.assertAlmostEqual(events[-1]['chamfer_gt_pred']['full_head'],
+                               0.,
+                               places=3)
+
+        # Stored jobs are not evaluated again
+        code, events = run(argv)
+        self.assertEqual(code, 0)
+        self.assertEqual([e['event'] for e in events].count('job_cached'), 2)
+        self.assertEqual(events[-1]['jobs'], 0)
+
+    def test_evaluate_workers(self):
+        argv = ['evaluate'] + self.args + [
+            '--predictions', self.predictions, '--views-configs', '3',
+            '--regions', 'face', '--workers', '2'
+        ]
+        code, events = run(argv)
+        self.assertEqual(code, 0)
+        self.assertEqual([e['event'] for e in events],
+                         ['evaluation_start', 'job_done', 'evaluation_done'])
+        self.assertEqual(events[1]['region'], 'face')
+
+    def test_evaluate_visible(self):
+        output_dir = temporary_directory(self)
+        argv = ['evaluate'] + self.args + [
+            '--predictions', self.predictions, '--views-configs', '3',
+            '--regions', 'full_head', '--output-dir', output_dir
+        ]
+        code, events = run(argv + ['--visible'])
+        self.assertEqual(code, 0)
+        self.assertEqual([e['event'] for e in events],
+                         ['evaluation_start', 'job_done', 'evaluation_done'])
+        self.assertTrue(
+            os.path.exists(
+                os.path.join(self.dataset.path, 'synthetic', 'visibility.npz')))
+
+        # The evaluation of the whole head is stored apart
+        code, events = run(argv)
+        self.assertEqual(events[0]['jobs'], 1)
+
+    def test_pack_and_verify(self):
+        code, events = run(['pack'] + self.args)
+        self.assertEqual(code, 0)
+        self.assertTrue(os.path.exists(events[0]['index']))
+        self.assertTrue(os.path.exists(events[0]['bboxes']))
+
+        code, events = run(['verify', '--deep'] + self.args)
+        self.assertEqual(code, 0)
+        self.assertTrue(all(e['ok'] for e in events))
+
+        os.remove(self.dataset.h3ds().helper.scene_masks('synthetic')[0])
+        code, events = run(['verify'] + self.args)
+        self.assertEqual(code, 1)
+        self.assertEqual(len(events[-1]['missing']), 1)
+
+    def test_verify_archive(self):
+        import zipfile
+        helper = self.dataset.h3ds().helper
+        zip_path = os.path.join(temporary_directory(self), 'h3ds.zip')
+        with zipfile.ZipFile(zip_path, 'w') as zip_ref:
+            for f in helper.files():
+                if f != helper.scene_masks('synthetic')[0]:
+                    zip_ref.write(f, os.path.relpath(f, self.dataset.path))
+
+        # The files are in the archive, none of them is extracted
+        h3ds_path = temporary_directory(self)
+        argv = [
+            'verify', '--h3ds-path', h3ds_path, '--config-path',
+            self.dataset.config_path, '--archive', zip_path
+        ]
+        code, events = run(argv)
+        self.assertEqual(code, 1)
+        self.assertTrue(events[0]['ok'])
+        mask = os.path.relpath(
+            helper.scene_masks('synthetic')[0], self.dataset.path)
+        self.assertEqual(events[-1]['missing'], [os.path.join(h3ds_path, mask)])
+
+    def test_bench(self):
+        output = os.path.join(temporary_directory(self), 'bench.json')
+        code, events = run(['bench'] + self.args + [
+            '--repeats', '1', '--stages', 'load_cameras', 'mesh_cut',
+            '--output', output
+        ])
+        self.assertEqual(code, 0)
+        self.assertEqual([e['name'] for e in events],
+                         ['mesh_cut', 'load_cameras'])
+        self.assertTrue(os.path.exists(output))
+
+        # Without a dataset, a synthetic scene is benchmarked
+        code, events = run([
+            'bench', '--subdivisions', '2', '--views', '3', '--image-size',
+            '32', '--repeats', '1', '--stages', 'load_cameras'
+        ])
+        self.assertEqual(code, 0)
+        self.assertEqual([e['name'] for e in events], ['load_cameras'])
+
+        code, events = run(['bench'] + self.args + ['--scenes', 'missing'])
+        self.assertEqual(code, 1)
+        self.assertEqual(events[0]['event'], 'bench_failed')
+
+    def test_install(self):
+        import zipfile
+        helper = self.dataset.h3ds().helper
+        zip_path = os.path.join(temporary_directory(self), 'h3ds.zip')
+        with zipfile.ZipFile(zip_path, 'w') as zip_ref:
+            for f in helper.files():
+                zip_ref.write(f, os.path.relpath(f, self.dataset.path))
+
+        argv = [
+            'install', '--h3ds-path',
+            temporary_directory(self), '--config-path',
+            self.dataset.config_path, '--zip', zip_path
+        ]
+        code, events = run(argv)
+        self.assertEqual(code, 0)
+        self.assertEqual(events[0]['added'], len(helper.files()))
+
+        # Nothing to extract the second time
+        code, events = run(argv)
+        self.assertEqual(code, 0)
+        self.assertEqual(events[0]['unchanged'], len(helper.files()))
+
+    def test_shards(self):
+        output_dir = temporary_directory(self)
+        code, events = run(['shards'] + self.args +
+                           ['--output-dir', output_dir, '--shard-size', '1'])
+        self.assertEqual(code, 0)
+        self.assertEqual(len(events[0]['shards']), 1)
+        self.assertTrue(os.path.exists(events[0]['shards'][0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
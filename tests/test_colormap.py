@@ -0,0 +1,48 @@
+import unittest
+
+import numpy as np
+
+from h3ds import colormap
+from h3ds.utils import error_to_color
+
+
+def reference_error_to_color(errors, clipping_error):
+    # Hue from 1/3 (green) to 0 (red) with full saturation and value
+    h = (1. - np.clip(errors / clipping_error, 0., 1.)) / 3.
+    rgb = np.zeros((len(errors), 3))
+    rgb[:, 0] = np.clip(2. - 6. * h, 0., 1.)
+    rgb[:, 1] = np.clip(6. * h, 0., 1.)
+    return rgb
+
+
+class TestColormap(unittest.TestCase):
+
+    def test_lut(self):
+        lut = colormap.get_lut(256)
+        self.assertEqual(lut.shape, (256, 3))
+        self.assertEqual(lut.dtype, np.uint8)
+        self.assertEqual(lut[0].tolist(), [0, 255, 0])
+        self.assertEqual(lut[-1].tolist(), [255, 0, 0])
+        self.assertTrue(colormap.get_lut(256) is lut)
+
+    def test_quantize(self):
+        errors = np.array([-1., 0., 2.5, 5., 10.])
+        self.assertEqual(
+            colormap.quantize(errors, 5., size=11).tolist(), [0, 0, 5, 10, 10])
+        self.assertEqual(
+            colormap.quantize(errors, size=12).tolist(), [0, 1, 4, 6, 11])
+        self.assertEqual(
+            colormap.quantize(np.ones(3), size=12).tolist(), [0, 0, 0])
+
+    def test_error_to_color(self):
+        errors = np.random.rand(1000) * 7.
+        colors = colormap.error_to_color(errors, clipping_error=5.)
+        self.assertEqual(colors.dtype, np.uint8)
+        self.assertTrue(
+            np.allclose(error_to_color(errors, clipping_error=5.),
+                        reference_error_to_color(errors, 5.),
+                        atol=1. / 255. + 1. / 1023.))
+
+
+if __name__ == '__main__':
+    unittest.main()
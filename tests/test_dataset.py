@@ -1,5 +1,6 @@
 import os
 import toml
+import asyncio
 import tempfile
 import unittest
 
@@ -8,6 +9,8 @@ import numpy as np
 from PIL import Image
 
 from h3ds.dataset import ConfigsHelper, H3DSHelper, H3DS
+from tests.helpers import temporary_directory
+
 
 class TestConfigsHelper(unittest.TestCase):
 
@@ -29,7 +32,7 @@ class TestH3DSBase(unittest.TestCase):
 
     def setUp(self):
 
-        self.path = tempfile.mkdtemp()
+        self.path = temporary_directory(self)
         _, self.config_path = tempfile.mkstemp()
 
         self.config = toml.dumps({
@@ -167,6 +170,326 @@ class TestDataset(TestH3DSBase):
         except ExceptionType:
             self.fail("load_scene raised exception")
 
+    def test_load_images_scaled(self):
+        h3ds = H3DS(path=self.path, config_path=self.config_path)
+        images = h3ds.load_images('a1b2c3', '3', scale=0.5)
+        masks = h3ds.load_masks('a1b2c3', '3', size=(3, 3))
+        self.assertEqual([img.size for img in images], [(4, 4)] * 3)
+        self.assertEqual([mask.size for mask in masks], [(3, 3)] * 3)
+
+    def test_load_images_array(self):
+        h3ds = H3DS(path=self.path, config_path=self.config_path)
+        images = h3ds.load_images('a1b2c3', '3')
+        masks = h3ds.load_masks('a1b2c3', '3')
+        for decoder in ['pil', 'cv2']:
+            h3ds = H3DS(path=self.path,
+                        config_path=self.config_path,
+                        image_decoder=decoder)
+            _, images_array, masks_array, _ = h3ds.load_scene('a1b2c3',
+                                                              '3',
+                                                              as_array=True)
+            self.assertEqual(images_array.shape, (3, 8, 8, 3))
+            self.assertEqual(masks_array.shape, (3, 8, 8))
+            self.assertEqual(images_array.dtype, np.uint8)
+            self.assertTrue(
+                np.array_equal(
+                    images_array,
+                    np.stack([np.array(img.convert('RGB')) for img in images])))
+            self.assertTrue(
+                np.array_equal(masks_array,
+                               np.stack([np.array(m) for m in masks])))
+
+        images_array = h3ds.load_images('a1b2c3', scale=0.5, as_array=True)
+        self.assertEqual(images_array.shape, (3, 4, 4, 3))
+
+    def test_load_masks_array(self):
+        rng = np.random.default_rng(0)
+        masks = rng.integers(0, 256, (3, 8, 8), dtype=np.uint8)
+        for m, mask_path in zip(masks, self.helper.scene_masks('a1b2c3')):
+            Image.fromarray(m).save(mask_path)
+        Image.fromarray(masks[1]).convert('RGB').save(
+            self.helper.scene_masks('a1b2c3')[1])
+
+        # The RGB mask is converted to grayscale
+        h3ds = H3DS(path=self.path, config_path=self.config_path)
+        masks_array = h3ds.load_masks('a1b2c3', as_array=True)
+        self.assertTrue(np.array_equal(masks_array, masks))
+
+    def test_crop(self):
+        h3ds = H3DS(path=self.path, config_path=self.config_path)
+        for idx, m in enumerate(h3ds.helper.scene_masks('a1b2c3')):
+            mask = np.zeros((8, 8), dtype=np.uint8)
+            mask[2:5, idx:idx + 3] = 255
+            Image.fromarray(mask).save(m)
+
+        bboxes = h3ds.load_bboxes('a1b2c3')
+        self.assertEqual(bboxes.tolist(),
+                         [[idx, 2, idx + 3, 5] for idx in range(3)])
+        self.assertTrue(os.path.exists(h3ds.helper.scene_bboxes('a1b2c3')))
+
+        _, images, masks, cameras = h3ds.load_scene('a1b2c3', crop=True)
+        cameras_full = h3ds.load_cameras('a1b2c3')
+        for img, mask, (K, _), (K_full, _), bbox in zip(images, masks, cameras,
+                                                        cameras_full, bboxes):
+            self.assertEqual(img.size, (3, 3))
+            self.assertTrue(np.all(np.array(mask) == 255))
+            self.assertTrue(np.allclose(K[:2, 2], K_full[:2, 2] - bbox[:2]))
+            self.assertTrue(np.allclose(K[:2, :2], K_full[:2, :2]))
+
+        masks = h3ds.load_masks('a1b2c3', '3', scale=0.5, crop=True)
+        self.assertEqual([m.size for m in masks], [(2, 2), (2, 2), (2, 2)])
+
+        masks = h3ds.load_masks('a1b2c3', crop=True, as_array=True)
+        self.assertEqual([m.shape for m in masks], [(3, 3)] * 3)
+        self.assertTrue(all(np.all(m == 255) for m in masks))
+
+    def write_regions(self):
+        h3ds = H3DS(path=self.path, config_path=self.config_path)
+        regions = {'face': [0, 1, 2, 3], 'nose': [5]}
+        os.makedirs(os.path.join(self.path, 'a1b2c3', 'regions'))
+        for region_id, region in regions.items():
+            with open(h3ds.helper.scene_region('a1b2c3', region_id), 'w') as f:
+                f.write('\n'.join([str(r) for r in region]) + '\n')
+        with open(h3ds.helper.scene_landmarks('a1b2c3'), 'w') as f:
+            f.write('nose_tip 5\nright_eye 2\n')
+        return h3ds, regions
+
+    def test_load_region(self):
+        h3ds, regions = self.write_regions()
+        for region_id, region in regions.items():
+            self.assertEqual(
+                h3ds.load_region('a1b2c3', region_id).tolist(), region)
+        mask = h3ds.load_region('a1b2c3', 'face', mask=True)
+        self.assertEqual(np.flatnonzero(mask).tolist(), regions['face'])
+        self.assertEqual(h3ds.load_landmarks('a1b2c3'), {
+            'nose_tip': 5,
+            'right_eye': 2
+        })
+
+    def test_compile_index(self):
+        h3ds, regions = self.write_regions()
+        n_vertices = len(h3ds.load_mesh('a1b2c3').vertices)
+        index_file = h3ds.compile_index('a1b2c3')
+        self.assertTrue(os.path.exists(index_file))
+
+        # Text files are no longer needed
+        for region_id in regions.keys():
+            os.remove(h3ds.helper.scene_region('a1b2c3', region_id))
+        os.remove(h3ds.helper.scene_landmarks('a1b2c3'))
+
+        h3ds = H3DS(path=self.path, config_path=self.config_path)
+        for region_id, region in regions.items():
+            indices = h3ds.load_region('a1b2c3', region_id)
+            self.assertEqual(indices.dtype, np.int32)
+            self.assertEqual(indices.tolist(), region)
+            mask = h3ds.load_region('a1b2c3', region_id, mask=True)
+            self.assertEqual(len(mask), n_vertices)
+            self.assertEqual(np.flatnonzero(mask).tolist(), region)
+        self.assertEqual(h3ds.load_landmarks('a1b2c3'), {
+            'nose_tip': 5,
+            'right_eye': 2
+        })
+
+        # Cutting by indices or by mask is equivalent
+        mesh = h3ds.load_mesh('a1b2c3')
+        cut_indices = mesh.cut(h3ds.load_region('a1b2c3', 'face'))
+        cut_mask = mesh.cut(h3ds.load_region('a1b2c3', 'face', mask=True))
+        self.assertTrue(np.array_equal(cut_indices.faces, cut_mask.faces))
+        self.assertTrue(np.array_equal(cut_indices.vertices, cut_mask.vertices))
+
+    def test_compile_index_force(self):
+        h3ds, regions = self.write_regions()
+        h3ds.compile_index('a1b2c3')
+        self.assertEqual(
+            h3ds.load_region('a1b2c3', 'face').tolist(), regions['face'])
+
+        with open(h3ds.helper.scene_region('a1b2c3', 'face'), 'w') as f:
+            f.write('4\n6\n')
+        with open(h3ds.helper.scene_landmarks('a1b2c3'), 'w') as f:
+            f.write('nose_tip 6\n')
+
+        # The stale index is kept unless forced
+        h3ds.compile_index('a1b2c3')
+        self.assertEqual(
+            h3ds.load_region('a1b2c3', 'face').tolist(), regions['face'])
+
+        h3ds.compile_index('a1b2c3', force=True)
+        self.assertEqual(h3ds.load_region('a1b2c3', 'face').tolist(), [4, 6])
+        self.assertEqual(h3ds.load_landmarks('a1b2c3'), {'nose_tip': 6})
+
+        h3ds = H3DS(path=self.path, config_path=self.config_path)
+        self.assertEqual(h3ds.load_region('a1b2c3', 'face').tolist(), [4, 6])
+        self.assertEqual(
+            np.flatnonzero(h3ds.load_region('a1b2c3', 'face',
+                                            mask=True)).tolist(), [4, 6])
+
+    def test_archive(self):
+        import zipfile
+        zip_path = os.path.join(temporary_directory(self), 'h3ds.zip')
+        with zipfile.ZipFile(zip_path, 'w') as zip_ref:
+            for f in self.helper.files():
+                zip_ref.write(f, os.path.relpath(f, self.path))
+
+        path = temporary_directory(self)
+        h3ds = H3DS(path=path, config_path=self.config_path, archive=zip_path)
+        self.assertTrue(h3ds.is_available())
+        self.assertFalse(os.path.exists(h3ds.helper.scene_mesh('a1b2c3')))
+
+        # Files are extracted when they are loaded
+        images = h3ds.load_images('a1b2c3', '3', as_array=True)
+        expected = H3DS(path=self.path,
+                        config_path=self.config_path).load_images('a1b2c3',
+                                                                  '3',
+                                                                  as_array=True)
+        self.assertTrue(np.array_equal(images, expected))
+        self.assertFalse(os.path.exists(h3ds.helper.scene_mesh('a1b2c3')))
+        mesh, _, _, cameras = h3ds.load_scene('a1b2c3')
+        self.assertEqual(len(cameras), 3)
+        h3ds.archive.close()
+
+    def test_install(self):
+        import zipfile
+
+        def write_zip(zip_path):
+            with zipfile.ZipFile(zip_path, 'w') as zip_ref:
+                for f in self.helper.files():
+                    zip_ref.write(f, os.path.relpath(f, self.path))
+
+        tmp_dir = temporary_directory(self)
+        store_path = os.path.join(tmp_dir, 'store')
+        write_zip(os.path.join(tmp_dir, 'v1.zip'))
+        h3ds_v1 = H3DS(path=os.path.join(tmp_dir, 'v1'),
+                       config_path=self.config_path)
+        diff = h3ds_v1.install(os.path.join(tmp_dir, 'v1.zip'),
+                               store_path=store_path)
+        self.assertEqual(len(diff['added']), len(self.helper.files()))
+        self.assertTrue(h3ds_v1.is_available())
+
+        # A new release changes a single image
+        image_file = self.helper.scene_images('a1b2c3')[1]
+        Image.fromarray(np.full((8, 8), 7, dtype=np.uint8)).save(image_file)
+        write_zip(os.path.join(tmp_dir, 'v2.zip'))
+        h3ds_v2 = H3DS(path=os.path.join(tmp_dir, 'v2'),
+                       config_path=self.config_path)
+        diff = h3ds_v2.install(os.path.join(tmp_dir, 'v2.zip'),
+                               store_path=store_path)
+        self.assertEqual(len(diff['added']), len(self.helper.files()))
+        for f in self.helper.files():
+            f_v1 = os.path.join(h3ds_v1.path, os.path.relpath(f, self.path))
+            f_v2 = os.path.join(h3ds_v2.path, os.path.relpath(f, self.path))
+            self.assertEqual(os.path.samefile(f_v1, f_v2), f != image_file)
+
+        # Updating v1 in place only extracts the changed image
+        h3ds_v1.load_bboxes('a1b2c3')
+        diff = h3ds_v1.install(os.path.join(tmp_dir, 'v2.zip'))
+        self.assertEqual(diff['changed'], ['a1b2c3/image/img_0001.jpg'])
+        self.assertEqual(diff['added'], [])
+        self.assertFalse(os.path.exists(h3ds_v1.helper.scene_bboxes('a1b2c3')))
+        self.assertTrue(
+            np.array_equal(h3ds_v1.load_images('a1b2c3', as_array=True),
+                           h3ds_v2.load_images('a1b2c3', as_array=True)))
+
+    def test_install_missing_files(self):
+        import zipfile
+        tmp_dir = temporary_directory(self)
+        image_file, mask_file = self.helper.scene_images(
+            'a1b2c3')[1], self.helper.scene_masks('a1b2c3')[2]
+
+        def write_zip(zip_path, exclude=None):
+            with zipfile.ZipFile(zip_path, 'w') as zip_ref:
+                for f in self.helper.files():
+                    if f != exclude:
+                        zip_ref.write(f, os.path.relpath(f, self.path))
+
+        write_zip(os.path.join(tmp_dir, 'v1.zip'))
+        h3ds = H3DS(path=os.path.join(tmp_dir, 'v1'),
+                    config_path=self.config_path)
+        h3ds.install(os.path.join(tmp_dir, 'v1.zip'))
+
+        # The next release changes an image and removes a mask, which were
+        # already deleted from the installation
+        Image.fromarray(np.full((8, 8), 7, dtype=np.uint8)).save(image_file)
+        write_zip(os.path.join(tmp_dir, 'v2.zip'), exclude=mask_file)
+        for f in [image_file, mask_file]:
+            os.remove(os.path.join(h3ds.path, os.path.relpath(f, self.path)))
+
+        diff = h3ds.install(os.path.join(tmp_dir, 'v2.zip'))
+        self.assertEqual(diff['changed'], ['a1b2c3/image/img_0001.jpg'])
+        self.assertEqual(diff['removed'], ['a1b2c3/mask/mask_0002.png'])
+        self.assertTrue(
+            os.path.exists(
+                os.path.join(h3ds.path, os.path.relpath(image_file,
+                                                        self.path))))
+
+    def test_install_repair(self):
+        import zipfile
+        tmp_dir = temporary_directory(self)
+        zip_path = os.path.join(tmp_dir, 'h3ds.zip')
+        with zipfile.ZipFile(zip_path, 'w') as zip_ref:
+            for f in self.helper.files():
+                zip_ref.write(f, os.path.relpath(f, self.path))
+        h3ds = H3DS(path=os.path.join(tmp_dir, 'h3ds'),
+                    config_path=self.config_path)
+        h3ds.install(zip_path)
+
+        # Files deleted or truncated by hand are restored by a new install
+        image_file, mask_file = h3ds.helper.scene_images(
+            'a1b2c3')[0], h3ds.helper.scene_masks('a1b2c3')[1]
+        os.remove(image_file)
+        with open(mask_file, 'r+b') as f:
+            f.truncate(10)
+        diff = h3ds.install(zip_path)
+        self.assertEqual(
+            diff['changed'],
+            ['a1b2c3/image/img_0000.jpg', 'a1b2c3/mask/mask_0001.png'])
+        for f in [image_file, mask_file]:
+            with open(f, 'rb') as f_repaired, open(
+                    os.path.join(self.path, os.path.relpath(f, h3ds.path)),
+                    'rb') as f_original:
+                self.assertEqual(f_repaired.read(), f_original.read())
+
+        diff = h3ds.install(zip_path)
+        self.assertEqual(diff['changed'], [])
+
+    def test_aload_scene(self):
+        h3ds = H3DS(path=self.path, config_path=self.config_path)
+        mesh, images, masks, cameras = asyncio.run(
+            h3ds.aload_scene('a1b2c3', '3'))
+        mesh_sync, images_sync, _, cameras_sync = h3ds.load_scene('a1b2c3', '3')
+        self.assertTrue(np.allclose(mesh.vertices, mesh_sync.vertices))
+        self.assertEqual(len(images), 3)
+        self.assertEqual(len(masks), 3)
+        for img, img_sync in zip(images, images_sync):
+            self.assertTrue(np.array_equal(np.array(img), np.array(img_sync)))
+        for (K, P), (K_sync, P_sync) in zip(cameras, cameras_sync):
+            self.assertTrue(np.allclose(K, K_sync))
+            self.assertTrue(np.allclose(P, P_sync))
+
+    def test_aload_shared(self):
+        h3ds = H3DS(path=self.path, config_path=self.config_path)
+
+        async def load_twice():
+            return await asyncio.gather(h3ds.aload_mesh('a1b2c3'),
+                                        h3ds.aload_mesh('a1b2c3'))
+
+        mesh_a, mesh_b = asyncio.run(load_twice())
+        self.assertTrue(mesh_a is mesh_b)
+        self.assertEqual(h3ds._inflight, {})
+
+    def test_aload_cancel(self):
+        h3ds = H3DS(path=self.path, config_path=self.config_path, max_workers=1)
+
+        async def load_and_cancel():
+            task = asyncio.ensure_future(h3ds.aload_scene('a1b2c3'))
+            await asyncio.sleep(0)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return await h3ds.aload_cameras('a1b2c3')
+
+        cameras = asyncio.run(load_and_cancel())
+        self.assertEqual(len(cameras), 3)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,39 @@
+import os
+import sys
+import json
+import subprocess
+import unittest
+
+HEAVY_MODULES = [
+    'cv2', 'trimesh', 'scipy', 'PIL', 'tqdm', 'gdown', 'matplotlib', 'asyncio'
+]
+
+# Import time budget in seconds, on top of the time needed to import numpy
+IMPORT_BUDGET = float(os.getenv('H3DS_IMPORT_BUDGET', 0.5))
+
+
+def import_in_subprocess(module):
+    code = ('import sys, time, json; import numpy; t = time.perf_counter(); '
+            f'import {module}; t = time.perf_counter() - t; '
+            'print(json.dumps([t, sorted(sys.modules)]))')
+    output = subprocess.check_output([sys.executable, '-c', code])
+    return json.loads(output.decode('utf-8').splitlines()[-1])
+
+
+class TestImports(unittest.TestCase):
+
+    def test_lazy_imports(self):
+        for module in [
+                'h3ds.dataset', 'h3ds.numeric', 'h3ds.mesh', 'h3ds.utils'
+        ]:
+            _, modules = import_in_subprocess(module)
+            loaded = [m for m in HEAVY_MODULES if m in modules]
+            self.assertEqual(loaded, [], f'{module} imports {loaded}')
+
+    def test_import_time(self):
+        import_time, _ = import_in_subprocess('h3ds.dataset')
+        self.assertLess(import_time, IMPORT_BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()
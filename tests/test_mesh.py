@@ -0,0 +1,133 @@
+import os
+import unittest
+
+import trimesh
+import numpy as np
+
+from h3ds.mesh import Mesh
+from h3ds.affine_transform import AffineTransform
+from h3ds.numeric import unidirectional_chamfer_distance
+from tests.helpers import temporary_directory
+
+
+class TestMeshBase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = temporary_directory(self)
+        self.mesh_file = os.path.join(self.path, 'mesh.obj')
+        trimesh.creation.icosphere(subdivisions=2).export(self.mesh_file)
+
+
+class TestMeshCompact(TestMeshBase):
+
+    def test_default_dtypes(self):
+        mesh = Mesh().load(self.mesh_file)
+        self.assertEqual(mesh.vertices.dtype, np.float64)
+        self.assertEqual(mesh.faces.dtype, np.int64)
+
+    def test_compact_load(self):
+        mesh = Mesh(compact=True).load(self.mesh_file)
+        self.assertEqual(mesh.vertices.dtype, np.float32)
+        self.assertEqual(mesh.vertex_normals.dtype, np.float32)
+        self.assertEqual(mesh.faces.dtype, np.int32)
+        self.assertFalse(hasattr(mesh, '__dict__'))
+
+    def test_compact_conversion(self):
+        mesh = Mesh().load(self.mesh_file)
+        compact = mesh.compact()
+        self.assertEqual(compact.vertices.dtype, np.float32)
+        self.assertEqual(compact.faces.dtype, np.int32)
+        self.assertTrue(np.allclose(compact.vertices, mesh.vertices))
+        self.assertTrue(np.array_equal(compact.faces, mesh.faces))
+
+        restored = compact.astype(float, int)
+        self.assertEqual(restored.vertices.dtype, np.float64)
+        self.assertEqual(restored.faces.dtype, np.int64)
+
+    def test_compact_cut(self):
+        mesh = Mesh(compact=True).load(self.mesh_file)
+        indices = np.arange(0, len(mesh.vertices), 2)
+        other = mesh.cut(indices)
+        self.assertEqual(other.faces.dtype, np.int32)
+        self.assertEqual(len(other.vertices), len(indices))
+        self.assertTrue(np.all(other.faces < len(indices)))
+
+    def test_compact_transform_and_chamfer(self):
+        mesh = Mesh(compact=True).load(self.mesh_file)
+        transform = AffineTransform(matrix=np.diag([2., 2., 2., 1.]))
+        vertices = transform.transform(mesh.vertices)
+        self.assertEqual(vertices.dtype, np.float32)
+        self.assertTrue(np.allclose(vertices, 2 * mesh.vertices))
+
+        d = unidirectional_chamfer_distance(mesh.vertices, mesh.vertices)
+        self.assertEqual(d.dtype, np.float32)
+        self.assertTrue(np.allclose(d, 0))
+
+
+class TestMeshPly(TestMeshBase):
+
+    def setUp(self):
+        super().setUp()
+        self.mesh = Mesh().load(self.mesh_file)
+        self.mesh.compute_normals()
+        self.mesh.vertices_color = np.random.randint(
+            0, 256, self.mesh.vertices.shape) / 255.
+        self.ply_file = os.path.join(self.path, 'mesh.ply')
+
+    def test_save_and_load(self):
+        self.mesh.save(self.ply_file)
+        mesh = Mesh().load(self.ply_file)
+        self.assertTrue(np.array_equal(mesh.vertices, self.mesh.vertices))
+        self.assertTrue(
+            np.array_equal(mesh.vertex_normals, self.mesh.vertex_normals))
+        self.assertTrue(
+            np.allclose(mesh.vertices_color, self.mesh.vertices_color))
+        self.assertTrue(np.array_equal(mesh.faces, self.mesh.faces))
+
+        # The file is a standard PLY
+        trim = trimesh.load(self.ply_file, process=False)
+        self.assertTrue(np.allclose(trim.vertices, self.mesh.vertices))
+        self.assertTrue(np.array_equal(trim.faces, self.mesh.faces))
+
+    def test_compact(self):
+        self.mesh.save(self.ply_file)
+        size = os.path.getsize(self.ply_file)
+        self.mesh.compact().save(self.ply_file)
+        self.assertLess(os.path.getsize(self.ply_file), size)
+
+        mesh = Mesh(compact=True).load(self.ply_file)
+        self.assertEqual(mesh.vertices.dtype, np.float32)
+        self.assertEqual(mesh.faces.dtype, np.int32)
+        self.assertTrue(np.allclose(mesh.vertices, self.mesh.vertices))
+
+    def test_trimesh_files(self):
+        trim = trimesh.load(self.mesh_file, process=False)
+        for encoding in ['binary', 'ascii']:
+            trim.export(self.ply_file, encoding=encoding)
+            mesh = Mesh().load(self.ply_file)
+            self.assertTrue(np.allclose(mesh.vertices, trim.vertices))
+            self.assertTrue(np.array_equal(mesh.faces, trim.faces))
+
+    def test_big_endian(self):
+        vertices = self.mesh.vertices.astype('>f4')
+        faces = np.empty(len(self.mesh.faces),
+                         dtype=[('n', 'u1'), ('v', '>i4', (3,))])
+        faces['n'] = 3
+        faces['v'] = self.mesh.faces
+        with open(self.ply_file, 'wb') as f:
+            f.write(('ply\nformat binary_big_endian 1.0\n'
+                     f'element vertex {len(vertices)}\n'
+                     'property float x\nproperty float y\nproperty float z\n'
+                     f'element face {len(faces)}\n'
+                     'property list uchar int vertex_indices\n'
+                     'end_header\n').encode('ascii'))
+            vertices.tofile(f)
+            faces.tofile(f)
+
+        mesh = Mesh().load(self.ply_file)
+        self.assertTrue(np.allclose(mesh.vertices, self.mesh.vertices))
+        self.assertTrue(np.array_equal(mesh.faces, self.mesh.faces))
+
+
+if __name__ == '__main__':
+    unittest.main()
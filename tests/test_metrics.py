@@ -0,0 +1,56 @@
+import unittest
+
+import numpy as np
+
+from h3ds.metrics import distance_statistics, compute_metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.chamfer_gt_pred = np.random.rand(1000).astype(np.float32) * 4
+        self.chamfer_pred_gt = np.random.rand(500) * 8
+
+    def test_distance_statistics(self):
+        d = self.chamfer_pred_gt
+        stats = distance_statistics(d,
+                                    thresholds=(1., 2.),
+                                    percentiles=(10, 90))
+        self.assertAlmostEqual(stats['mean'], np.mean(d))
+        self.assertAlmostEqual(stats['median'], np.median(d))
+        self.assertAlmostEqual(stats['rms'], np.sqrt(np.mean(d**2)))
+        self.assertAlmostEqual(stats['max'], np.max(d))
+        for p in [10, 90]:
+            self.assertAlmostEqual(stats['percentiles'][str(p)],
+                                   np.percentile(d, p))
+        for t in [1., 2.]:
+            self.assertAlmostEqual(stats['ratio'][str(t)], np.mean(d < t))
+
+        with self.assertRaises(ValueError):
+            distance_statistics(np.array([]))
+
+    def test_compute_metrics(self):
+        metrics = compute_metrics(self.chamfer_gt_pred,
+                                  self.chamfer_pred_gt,
+                                  thresholds=(1., 2.))
+        self.assertAlmostEqual(metrics['chamfer_gt_pred'],
+                               np.mean(self.chamfer_gt_pred),
+                               places=5)
+        self.assertAlmostEqual(metrics['chamfer_pred_gt'],
+                               np.mean(self.chamfer_pred_gt))
+        for t in [1., 2.]:
+            recall = np.mean(self.chamfer_gt_pred < t)
+            precision = np.mean(self.chamfer_pred_gt < t)
+            self.assertAlmostEqual(
+                metrics['fscore'][str(t)],
+                2 * precision * recall / (precision + recall))
+
+        # No distance below the threshold
+        metrics = compute_metrics(self.chamfer_gt_pred + 10,
+                                  self.chamfer_pred_gt + 10,
+                                  thresholds=(1.,))
+        self.assertEqual(metrics['fscore']['1.0'], 0.)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,220 @@
+import unittest
+
+import numpy as np
+import trimesh
+from scipy.spatial import cKDTree
+from scipy.spatial.transform import Rotation
+
+from h3ds.mesh import Mesh
+from h3ds.affine_transform import transform_points
+from h3ds.numeric import procrustes, perform_alignment, perform_batch_alignment, perform_icp, transform_mesh, vertex_normals, VoxelHash, icp, icp_point_to_plane, unidirectional_chamfer_distance
+
+
+def random_similarities(n):
+    transforms = np.tile(np.eye(4), (n, 1, 1))
+    transforms[:, :3, :3] = Rotation.random(n, random_state=0).as_matrix()
+    transforms[:, :3, :3] *= np.random.uniform(0.5, 2., (n, 1, 1))
+    transforms[:, :3, 3] = np.random.rand(n, 3) * 100
+    return transforms
+
+
+class TestProcrustes(unittest.TestCase):
+
+    def setUp(self):
+        self.target = np.random.rand(6, 3) * 100
+        self.transforms = random_similarities(5)
+        inverse = np.linalg.inv(self.transforms)
+        self.source = self.target @ np.swapaxes(
+            inverse[:, :3, :3], -1, -2) + inverse[:, np.newaxis, :3, 3]
+
+    def test_exact(self):
+        transforms = procrustes(self.source, self.target)
+        self.assertEqual(transforms.shape, (5, 4, 4))
+        self.assertTrue(np.allclose(transforms, self.transforms))
+        self.assertTrue(
+            np.allclose(procrustes(self.source[0], self.target),
+                        self.transforms[0]))
+
+    def test_trimesh(self):
+        # trimesh estimates the scale differently, compare the rigid transforms
+        source = self.source + np.random.normal(scale=1.,
+                                                size=self.source.shape)
+        transforms = procrustes(source, self.target, scale=False)
+        for s, t in zip(source, transforms):
+            expected, _, _ = trimesh.registration.procrustes(s,
+                                                             self.target,
+                                                             reflection=False,
+                                                             scale=False)
+            self.assertTrue(np.allclose(t, expected))
+
+    def test_weights(self):
+        # Outliers with zero weight do not change the result
+        source = self.source.copy()
+        source[:, 0] += 50.
+        weights = np.ones(6)
+        weights[0] = 0.
+        self.assertTrue(
+            np.allclose(procrustes(source, self.target, weights=weights),
+                        self.transforms))
+
+    def test_no_reflection(self):
+        transforms = procrustes(self.target * [-1, 1, 1], self.target)
+        self.assertGreater(np.linalg.det(transforms[:3, :3]), 0)
+
+
+class TestAlignment(unittest.TestCase):
+
+    def setUp(self):
+        self.mesh = Mesh()
+        self.mesh.vertices = np.random.rand(50, 3)
+        self.mesh.faces = np.array([[0, 1, 2]])
+        self.landmarks = {str(i): i for i in range(6)}
+
+    def test_batch_alignment(self):
+        transforms = random_similarities(3)
+        meshes = [transform_mesh(self.mesh, t) for t in transforms]
+        landmarks = [self.landmarks] * 3
+        aligned, estimated = perform_batch_alignment(meshes, self.mesh,
+                                                     landmarks, self.landmarks)
+        self.assertTrue(np.allclose(estimated, np.linalg.inv(transforms)))
+        for mesh, t, m in zip(meshes, estimated, aligned):
+            self.assertTrue(np.allclose(m.vertices, self.mesh.vertices))
+            expected, t_single = perform_alignment(mesh, self.mesh,
+                                                   self.landmarks,
+                                                   self.landmarks)
+            self.assertTrue(np.allclose(t, t_single))
+
+
+class TestVoxelHash(unittest.TestCase):
+
+    def setUp(self):
+        self.target = np.random.rand(2000, 3) * 20
+        self.source = np.random.rand(1000, 3) * 24 - 2
+
+    def test_query(self):
+        kdtree = cKDTree(self.target)
+        for cell_size, bound in [(1., 1.), (1., 2.5), (2., 0.5)]:
+            d, ix = VoxelHash(self.target,
+                              cell_size).query(self.source,
+                                               distance_upper_bound=bound,
+                                               chunk_size=300)
+            d_kdtree, ix_kdtree = kdtree.query(self.source,
+                                               distance_upper_bound=bound)
+            self.assertTrue(np.allclose(d, d_kdtree))
+            self.assertTrue(np.array_equal(ix, ix_kdtree))
+
+        d, ix = VoxelHash(np.zeros((0, 3)), 1.).query(self.source)
+        self.assertTrue(np.all(np.isinf(d)))
+        self.assertTrue(np.all(ix == 0))
+
+        with self.assertRaises(ValueError):
+            VoxelHash(self.target, 1.).query(self.source, k=2)
+
+    def test_chamfer(self):
+        d = unidirectional_chamfer_distance(self.source, self.target)
+        d_voxel = unidirectional_chamfer_distance(self.source,
+                                                  self.target,
+                                                  max_distance=0.5,
+                                                  index='voxel')
+        self.assertTrue(np.allclose(d_voxel, np.minimum(d, 0.5)))
+        with self.assertRaises(ValueError):
+            unidirectional_chamfer_distance(self.source,
+                                            self.target,
+                                            index='voxel')
+
+    def test_icp(self):
+        transform = np.eye(4)
+        transform[:3, :3] = Rotation.from_euler('z', 5,
+                                                degrees=True).as_matrix()
+        transform[:3, 3] = [0.2, -0.1, 0.3]
+        source = transform_points(np.linalg.inv(transform), self.target)
+
+        expected, _, _ = trimesh.registration.icp(source, self.target)
+        result, _, _ = icp(source, self.target)
+        self.assertTrue(np.allclose(result, expected))
+
+        result, _, _ = icp(source, self.target, max_distance=2.)
+        result_voxel, _, _ = icp(source,
+                                 self.target,
+                                 max_distance=2.,
+                                 index='voxel')
+        self.assertTrue(np.allclose(result, result_voxel))
+
+
+class TestPointToPlane(unittest.TestCase):
+
+    def setUp(self):
+        # Smooth bumpy ellipsoid, like a head in mm
+        sphere = trimesh.creation.icosphere(4)
+        vertices = sphere.vertices * [80., 100., 110.]
+        vertices *= 1. + 0.03 * np.sin(vertices[:, :1] / 6.) * np.cos(
+            vertices[:, 1:2] / 7.)
+        self.mesh = Mesh()
+        self.mesh.vertices, self.mesh.faces = vertices, sphere.faces
+        self.normals = vertex_normals(self.mesh)
+
+        self.transform = np.eye(4)
+        self.transform[:3, :3] = Rotation.from_rotvec([0.02, 0.04,
+                                                       0.06]).as_matrix()
+        self.transform[:3, 3] = [3., -2., 4.]
+        self.source = transform_points(self.transform, vertices)
+        self.normals_source = self.normals @ self.transform[:3, :3].T
+
+    def test_variants(self):
+        _, _, _, report_p2p = icp(self.source,
+                                  self.mesh.vertices,
+                                  return_report=True)
+        for normals_source, normals_target, symmetric in [
+            (None, self.normals, False), (self.normals_source, None, False),
+            (self.normals_source, self.normals, True)
+        ]:
+            result, points, cost, report = icp_point_to_plane(
+                self.source,
+                self.mesh.vertices,
+                normals_source,
+                normals_target,
+                symmetric=symmetric,
+                return_report=True)
+            self.assertTrue(
+                np.allclose(result, np.linalg.inv(self.transform), atol=1e-6))
+            self.assertTrue(np.allclose(points, self.mesh.vertices, atol=1e-6))
+            self.assertTrue(report['converged'])
+            self.assertLess(report['iterations'], report_p2p['iterations'])
+            self.assertEqual(report['method'],
+                             'symmetric' if symmetric else 'point_to_plane')
+
+    def test_robust(self):
+        # One in twenty source points are moved far from the surface
+        source = self.source.copy()
+        outliers = np.arange(0, len(source), 20)
+        source[outliers] += self.normals_source[outliers] * 20.
+        for robust in ['huber', 'trimmed']:
+            result, _, _ = icp_point_to_plane(source,
+                                              self.mesh.vertices,
+                                              normals_target=self.normals,
+                                              robust=robust)
+            self.assertTrue(
+                np.allclose(result, np.linalg.inv(self.transform), atol=1e-3))
+
+        with self.assertRaises(ValueError):
+            icp_point_to_plane(source, self.mesh.vertices, robust='l1')
+        with self.assertRaises(ValueError):
+            icp_point_to_plane(source,
+                               self.mesh.vertices,
+                               normals_target=self.normals,
+                               symmetric=True)
+
+    def test_perform_icp(self):
+        mesh_source = transform_mesh(self.mesh, self.transform)
+        for method in ['point_to_plane', 'symmetric']:
+            aligned, transform = perform_icp(mesh_source,
+                                             self.mesh,
+                                             method=method)
+            self.assertTrue(
+                np.allclose(aligned.vertices, self.mesh.vertices, atol=1e-6))
+        with self.assertRaises(ValueError):
+            perform_icp(mesh_source, self.mesh, method='plane')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import json
+import unittest
+
+import trimesh
+
+from h3ds.mesh import Mesh
+from h3ds.profiling import Profiler, profiler
+from tests.helpers import temporary_directory
+
+
+class TestProfiler(unittest.TestCase):
+
+    def test_disabled(self):
+        p = Profiler()
+
+        @p.timed('stage')
+        def fn():
+            return 1
+
+        with p.stage('block', nbytes=10):
+            pass
+        p.count('counter', 1, 10)
+        self.assertEqual(fn(), 1)
+        self.assertEqual(p.stats(), {})
+        self.assertEqual(p.file_size(__file__), 0)
+
+    def test_stats(self):
+        p = Profiler(enabled=True)
+
+        @p.timed('stage')
+        def fn():
+            return 1
+
+        for _ in range(3):
+            fn()
+        with p.stage('block', nbytes=10):
+            pass
+        p.count('block', nbytes=5)
+
+        stats = json.loads(p.dump())
+        self.assertEqual(stats['stage']['calls'], 3)
+        self.assertGreaterEqual(stats['stage']['total_time'], 0.)
+        self.assertEqual(stats['block']['calls'], 1)
+        self.assertEqual(stats['block']['bytes'], 15)
+
+        p.reset()
+        self.assertEqual(p.stats(), {})
+
+    def test_cprofile(self):
+        p = Profiler()
+        p.enable(cprofile=True)
+        sum(range(1000))
+        p.disable()
+        filename = os.path.join(temporary_directory(self), 'stats.prof')
+        p.dump_cprofile(filename)
+        self.assertTrue(os.path.exists(filename))
+
+    def test_h3ds_stages(self):
+        mesh_file = os.path.join(temporary_directory(self), 'mesh.obj')
+        trimesh.creation.icosphere().export(mesh_file)
+
+        profiler.reset()
+        profiler.enable()
+        try:
+            Mesh().load(mesh_file)
+        finally:
+            profiler.disable()
+
+        stats = profiler.stats()
+        profiler.reset()
+        self.assertEqual(stats['mesh.load']['calls'], 1)
+        self.assertEqual(stats['mesh.load_obj']['calls'], 1)
+        self.assertEqual(stats['mesh.read']['bytes'],
+                         os.path.getsize(mesh_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from h3ds.pyramid import ImagePyramid
+from tests.helpers import temporary_directory
+
+
+class TestImagePyramid(unittest.TestCase):
+
+    def setUp(self):
+        self.root = temporary_directory(self)
+        self.cache = os.path.join(self.root, 'cache')
+        self.image = os.path.join(self.root, 'scene', 'image', 'img_0000.jpg')
+        self.mask = os.path.join(self.root, 'scene', 'mask', 'mask_0000.png')
+        os.makedirs(os.path.dirname(self.image))
+        os.makedirs(os.path.dirname(self.mask))
+        Image.fromarray(np.random.randint(0, 255, (64, 96, 3),
+                                          dtype=np.uint8)).save(self.image)
+        mask = np.zeros((64, 96), dtype=np.uint8)
+        mask[16:48, 24:72] = 255
+        Image.fromarray(mask).save(self.mask)
+
+    def test_target_size(self):
+        self.assertEqual(ImagePyramid.target_size((96, 64), scale=0.5),
+                         (48, 32))
+        self.assertEqual(
+            ImagePyramid.target_size((96, 64), scale=0.5, size=(10, 20)),
+            (10, 20))
+
+    def test_draft(self):
+        pyramid = ImagePyramid(self.root, self.cache)
+        for scale in [1, 0.5, 0.25, 0.125]:
+            img = pyramid.load(self.image, scale=scale)
+            self.assertEqual(img.size, (int(96 * scale), int(64 * scale)))
+        self.assertFalse(os.path.exists(self.cache))
+
+    def test_cache(self):
+        pyramid = ImagePyramid(self.root, self.cache)
+        mask = pyramid.load(self.mask, size=(30, 20), resample=Image.NEAREST)
+        self.assertEqual(mask.size, (30, 20))
+        self.assertEqual(set(np.unique(np.array(mask))), {0, 255})
+
+        cached_path = pyramid.cached_path(self.mask, (30, 20))
+        self.assertTrue(os.path.exists(cached_path))
+        self.assertEqual(pyramid.nbytes(), os.path.getsize(cached_path))
+        cached = pyramid.load(self.mask, size=(30, 20))
+        self.assertTrue(np.array_equal(np.array(cached), np.array(mask)))
+
+    def test_eviction(self):
+        pyramid = ImagePyramid(self.root, self.cache, max_bytes=1)
+        pyramid.load(self.image, scale=0.3)
+        self.assertEqual(pyramid.nbytes(), 0)
+
+        pyramid = ImagePyramid(self.root, self.cache, max_bytes=0)
+        self.assertEqual(pyramid.load(self.image, scale=0.3).size, (29, 19))
+        self.assertFalse(
+            os.path.exists(pyramid.cached_path(self.image, (29, 19))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+
+import numpy as np
+
+from h3ds.rays import pixel_grid, camera_rays, RaySampler
+from h3ds.benchmark import SyntheticH3DS
+from tests.helpers import temporary_directory
+
+
+def project(K, pose, points):
+    points_cam = (np.linalg.inv(pose) @ np.concatenate(
+        (points, np.ones((len(points), 1))), axis=1).T)[:3]
+    p2d = K @ points_cam
+    return (p2d[:2] / p2d[2]).T
+
+
+class TestRays(unittest.TestCase):
+
+    def setUp(self):
+        self.K = np.array([[50., 0., 16.], [0., 60., 12.], [0., 0., 1.]])
+        self.pose = np.eye(4)
+        self.pose[:3, :3] = np.array([[0., 0., 1.], [0., 1., 0.], [-1., 0.,
+                                                                   0.]])
+        self.pose[:3, 3] = [1., 2., 3.]
+
+    def test_pixel_grid(self):
+        pixels = pixel_grid(4, 3)
+        self.assertEqual(pixels.shape, (12, 3))
+        self.assertEqual(pixels[5].tolist(), [1.5, 1.5, 1.])
+
+    def test_camera_rays(self):
+        pixels = pixel_grid(32, 24)
+        origins, directions = camera_rays(self.K[np.newaxis],
+                                          self.pose[np.newaxis], pixels)
+        self.assertTrue(np.allclose(origins[0], [1., 2., 3.]))
+        self.assertTrue(np.allclose(np.linalg.norm(directions, axis=-1), 1.))
+        points = origins[0] + 5. * directions[0]
+        self.assertTrue(
+            np.allclose(project(self.K, self.pose, points),
+                        pixels[:, :2],
+                        atol=1e-3))
+
+    def test_sampler(self):
+        image = np.random.randint(0, 255, (24, 32, 3), dtype=np.uint8)
+        mask = np.zeros((24, 32), dtype=bool)
+        mask[:6] = True
+        sampler = RaySampler([(self.K, self.pose)] * 2, [image] * 2, [mask] * 2)
+        self.assertEqual(len(sampler), 2 * 24 * 32)
+
+        batch = sampler.sample(1000, np.random.default_rng(0))
+        self.assertEqual(batch['directions'].shape, (1000, 3))
+        u, v = batch['pixel'][:, 0], batch['pixel'][:, 1]
+        self.assertTrue(np.allclose(batch['rgb'] * 255., image[v, u]))
+        self.assertTrue(np.array_equal(batch['mask'], mask[v, u]))
+        self.assertAlmostEqual(batch['mask'].mean(), 0.25, delta=0.06)
+
+        # Importance sampling of the foreground
+        sampler.set_foreground_weight(3.)
+        batch = sampler.sample(1000, np.random.default_rng(0))
+        self.assertAlmostEqual(batch['mask'].mean(), 0.5, delta=0.06)
+        p = sampler.probabilities(np.arange(len(sampler)))
+        self.assertAlmostEqual(float(p.sum()), 1., places=4)
+
+    def test_grayscale(self):
+        image = np.random.randint(0, 255, (24, 32), dtype=np.uint8)
+        sampler = RaySampler([(self.K, self.pose)], [image])
+        self.assertTrue(
+            np.array_equal(sampler.rgb, np.repeat(image.reshape(-1, 1), 3, 1)))
+        self.assertRaises(ValueError, RaySampler, [(self.K, self.pose)],
+                          [np.zeros((24, 32, 2), dtype=np.uint8)])
+
+    def test_scaled_calibration(self):
+        # A downsampled pixel sees the same point as the four full resolution
+        # pixels it covers, i.e. the corner shared by their centers
+        K = np.diag([0.5, 0.5, 1.]) @ self.K
+        _, d = camera_rays(K[np.newaxis], self.pose[np.newaxis],
+                           pixel_grid(16, 12))
+        _, d_full = camera_rays(self.K[np.newaxis], self.pose[np.newaxis],
+                                pixel_grid(32, 24, offset=0.))
+        self.assertTrue(
+            np.allclose(d[0],
+                        d_full[0].reshape(24, 32, 3)[1::2, 1::2].reshape(-1, 3),
+                        atol=1e-6))
+
+    def test_from_scene(self):
+        dataset = SyntheticH3DS(temporary_directory(self),
+                                subdivisions=1,
+                                views=3,
+                                image_size=32)
+        h3ds = dataset.h3ds()
+        sampler = RaySampler.from_scene(h3ds, 'synthetic', scale=0.5)
+        self.assertEqual(len(sampler), 3 * 16 * 16)
+
+        # Rays through the image center point to the origin of the scene
+        centers = sampler.gather(
+            np.flatnonzero(np.all(sampler.pixel == 8, axis=-1)))
+        to_origin = -centers['origins'] / np.linalg.norm(
+            centers['origins'], axis=-1, keepdims=True)
+        self.assertTrue(
+            np.all(np.sum(to_origin * centers['directions'], axis=-1) > 0.99))
+
+
+if __name__ == '__main__':
+    unittest.main()
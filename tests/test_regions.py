@@ -0,0 +1,70 @@
+import unittest
+
+import numpy as np
+
+from h3ds.mesh import Mesh
+from h3ds.regions import RegionIndex
+from h3ds.benchmark import SyntheticH3DS
+from tests.helpers import temporary_directory
+
+
+class TestRegionIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.vertices = np.random.rand(5000, 3) * 100
+        self.index = RegionIndex(self.vertices, {'nose_tip': 10})
+
+    def test_sphere(self):
+        center = self.vertices[10]
+        expected = np.flatnonzero(
+            np.linalg.norm(self.vertices - center, axis=-1) <= 30)
+        self.assertTrue(np.array_equal(self.index.sphere(center, 30), expected))
+        self.assertTrue(
+            np.array_equal(self.index.landmark_sphere('nose_tip', 30),
+                           expected))
+        self.assertTrue(
+            np.array_equal(self.index.mask(expected),
+                           np.isin(np.arange(5000), expected)))
+        with self.assertRaises(KeyError):
+            self.index.landmark_sphere('left_eye', 30)
+
+    def test_box(self):
+        lower, upper = np.array([10, 20, 30]), np.array([60, 40, 90])
+        expected = np.flatnonzero(
+            np.all((self.vertices >= lower) & (self.vertices <= upper), axis=1))
+        self.assertTrue(np.array_equal(self.index.box(lower, upper), expected))
+
+    def test_cut(self):
+        mesh = Mesh()
+        mesh.vertices = self.vertices
+        mesh.faces = np.array([[0, 1, 2], [10, 11, 12]])
+        region = self.index.sphere(self.vertices[10], 30)
+        self.assertEqual(len(mesh.cut(region).vertices), len(region))
+
+
+class TestH3DSRegions(unittest.TestCase):
+
+    def setUp(self):
+        self.h3ds = SyntheticH3DS(temporary_directory(self),
+                                  subdivisions=3,
+                                  views=2,
+                                  image_size=16).h3ds()
+
+    def test_face_sphere(self):
+        region = self.h3ds.region_index('synthetic').face_sphere()
+        self.assertTrue(
+            np.array_equal(region,
+                           self.h3ds.load_region('synthetic', 'face_sphere')))
+        self.assertIs(self.h3ds.region_index('synthetic'),
+                      self.h3ds.region_index('synthetic'))
+
+        mesh_pred = self.h3ds.load_mesh('synthetic')
+        chamfer_gt_pred, _, mesh_gt, _ = self.h3ds.evaluate_scene('synthetic',
+                                                                  mesh_pred,
+                                                                  region=region)
+        self.assertEqual(len(chamfer_gt_pred), len(region))
+        self.assertEqual(len(mesh_gt.vertices), len(region))
+
+
+if __name__ == '__main__':
+    unittest.main()
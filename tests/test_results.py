@@ -0,0 +1,113 @@
+import os
+import unittest
+
+import numpy as np
+
+from h3ds.results import ResultsStore, landmarks_digest
+from tests.helpers import temporary_directory
+
+
+class TestResultsStore(unittest.TestCase):
+
+    def setUp(self):
+        self.path = temporary_directory(self)
+        self.key = ResultsStore.key('a1b2c3', '3', None, 'abcd', '0.1')
+        rng = np.random.default_rng(0)
+        self.chamfer_gt_pred = rng.random(100).astype(np.float32)
+        self.chamfer_pred_gt = rng.random(50)
+
+    def test_key(self):
+        self.assertEqual(self.key, 'a1b2c3/3/full_head/abcd/0.1')
+        self.assertNotEqual(
+            self.key, ResultsStore.key('a1b2c3', '3', 'face', 'abcd', '0.1'))
+        self.assertEqual(
+            ResultsStore.key('a1b2c3', '3', None, 'abcd', '0.1', visible=True),
+            'a1b2c3/3/full_head/abcd/0.1/visible')
+
+    def test_landmarks_key(self):
+        landmarks = {'nose_tip': 3, 'left_eye': 1}
+        key = ResultsStore.key('a1b2c3',
+                               '3',
+                               None,
+                               'abcd',
+                               '0.1',
+                               landmarks_hash=landmarks_digest(landmarks))
+        self.assertNotEqual(key, self.key)
+        self.assertEqual(
+            key,
+            ResultsStore.key('a1b2c3',
+                             '3',
+                             None,
+                             'abcd',
+                             '0.1',
+                             landmarks_hash=landmarks_digest({
+                                 'left_eye': 1,
+                                 'nose_tip': 3
+                             })))
+        self.assertNotEqual(landmarks_digest(landmarks),
+                            landmarks_digest({
+                                'nose_tip': 4,
+                                'left_eye': 1
+                            }))
+        self.assertIsNone(landmarks_digest(None))
+
+    def test_append_without_results(self):
+        store = ResultsStore(self.path, 'method')
+        self.assertRaises(ValueError, store.append, self.key, None, None)
+        self.assertFalse(self.key in store)
+
+    def test_append_and_load(self):
+        store = ResultsStore(self.path, 'method')
+        self.assertFalse(self.key in store)
+        store.append(self.key, self.chamfer_gt_pred, self.chamfer_pred_gt)
+        self.assertTrue(self.key in store)
+
+        chamfer_gt_pred, chamfer_pred_gt, metrics = store.load(self.key)
+        self.assertTrue(np.array_equal(chamfer_gt_pred, self.chamfer_gt_pred))
+        self.assertTrue(np.array_equal(chamfer_pred_gt, self.chamfer_pred_gt))
+        self.assertEqual(chamfer_gt_pred.dtype, np.float32)
+        self.assertAlmostEqual(
+            metrics['chamfer_gt_pred'],
+            float(np.mean(self.chamfer_gt_pred, dtype=np.float64)))
+
+    def test_reopen(self):
+        store = ResultsStore(self.path, 'method')
+        store.append(self.key, self.chamfer_gt_pred, self.chamfer_pred_gt,
+                     {'mean': 1.0})
+        other_key = ResultsStore.key('a1b2c3', '4', None, 'abcd', '0.1')
+        store.append(other_key, self.chamfer_gt_pred, self.chamfer_pred_gt)
+
+        store = ResultsStore(self.path, 'method')
+        self.assertEqual(sorted(store.keys()), sorted([self.key, other_key]))
+        self.assertEqual(store.metrics(self.key), {'mean': 1.0})
+        _, chamfer_pred_gt, _ = store.load(other_key)
+        self.assertTrue(np.array_equal(chamfer_pred_gt, self.chamfer_pred_gt))
+
+    def test_metrics_only(self):
+        store = ResultsStore(self.path, 'method')
+        store.append(self.key, None, None, {'mean': 1.0})
+
+        store = ResultsStore(self.path, 'method')
+        chamfer_gt_pred, chamfer_pred_gt, metrics = store.load(self.key)
+        self.assertIsNone(chamfer_gt_pred)
+        self.assertIsNone(chamfer_pred_gt)
+        self.assertEqual(metrics, {'mean': 1.0})
+
+    def test_truncated_record(self):
+        store = ResultsStore(self.path, 'method')
+        store.append(self.key, self.chamfer_gt_pred, self.chamfer_pred_gt)
+        size = os.path.getsize(store.filename)
+        other_key = ResultsStore.key('a1b2c3', '4', None, 'abcd', '0.1')
+        store.append(other_key, self.chamfer_gt_pred, self.chamfer_pred_gt)
+
+        # Simulate a crash in the middle of the second write
+        with open(store.filename, 'r+b') as f:
+            f.truncate(size + 100)
+
+        store = ResultsStore(self.path, 'method')
+        self.assertEqual(store.keys(), [self.key])
+        self.assertEqual(os.path.getsize(store.filename), size)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import unittest
+
+import numpy as np
+
+from h3ds.shards import ShardReader, ShardWriter, export_shards, iterate_shard, list_shards
+from h3ds.benchmark import SyntheticH3DS, SCENE_ID
+from tests.helpers import temporary_directory
+
+
+class TestShards(unittest.TestCase):
+
+    def setUp(self):
+        self.dataset = SyntheticH3DS(temporary_directory(self),
+                                     subdivisions=1,
+                                     views=6,
+                                     image_size=32)
+        self.h3ds = self.dataset.h3ds()
+        self.path = temporary_directory(self)
+
+        # Around two samples per shard
+        self.shards = export_shards(self.h3ds, self.path, shard_size=2 * 4096)
+
+    def test_export(self):
+        self.assertGreater(len(self.shards), 1)
+        self.assertEqual(list_shards(self.path), self.shards)
+        self.assertTrue(all(os.path.exists(s) for s in self.shards))
+
+        samples = [s for shard in self.shards for s in iterate_shard(shard)]
+        self.assertEqual([s['__key__'] for s in samples],
+                         [f'{SCENE_ID}_{view:04d}' for view in range(6)])
+        self.assertEqual(set(samples[0].keys()),
+                         {'__key__', 'jpg', 'png', 'json'})
+
+    def test_reader(self):
+        images = self.h3ds.load_images(SCENE_ID, as_array=True)
+        masks = self.h3ds.load_masks(SCENE_ID, as_array=True)
+        cameras = self.h3ds.load_cameras(SCENE_ID)
+
+        samples = list(ShardReader(self.shards, prefetch=1))
+        self.assertEqual([s['view'] for s in samples], list(range(6)))
+        for s in samples:
+            self.assertEqual(s['scene_id'], SCENE_ID)
+            self.assertTrue(np.array_equal(s['image'], images[s['view']]))
+            self.assertTrue(np.array_equal(s['mask'], masks[s['view']]))
+            self.assertTrue(np.array_equal(s['K'], cameras[s['view']][0]))
+            self.assertTrue(np.array_equal(s['pose'], cameras[s['view']][1]))
+
+    def test_shuffle(self):
+        reader = ShardReader(self.shards,
+                             shuffle_buffer=3,
+                             decode=False,
+                             seed=0)
+        keys = [s['__key__'] for s in reader]
+        self.assertEqual(sorted(keys),
+                         [f'{SCENE_ID}_{view:04d}' for view in range(6)])
+        self.assertNotEqual(keys, sorted(keys))
+
+        # Each worker reads its own shards
+        keys = [
+            s['__key__'] for worker in range(2) for s in ShardReader(
+                self.shards, decode=False, worker=worker, num_workers=2)
+        ]
+        self.assertEqual(sorted(keys),
+                         [f'{SCENE_ID}_{view:04d}' for view in range(6)])
+
+    def test_close(self):
+        # Stopping early does not leave the reading thread blocked
+        iterator = iter(ShardReader(self.shards, prefetch=1, decode=False))
+        next(iterator)
+        iterator.close()
+
+    def test_writer(self):
+        with ShardWriter(self.path, 'large', shard_size=1024) as writer:
+            writer.write('a', {'bin': os.urandom(4096)})
+            writer.write('b', {'bin': os.urandom(10)})
+        self.assertEqual([s['samples'] for s in writer.shards], [1, 1])
+        self.assertEqual([
+            list(iterate_shard(s))[0]['__key__']
+            for s in list_shards(self.path, 'large')
+        ], ['a', 'b'])
+
+    def test_writer_error(self):
+        # Index of a previous export into the same directory
+        with open(os.path.join(self.path, 'error.json'), 'w') as f:
+            f.write('{"shards": []}')
+
+        with self.assertRaises(KeyError):
+            with ShardWriter(self.path, 'error', shard_size=1024) as writer:
+                writer.write('a', {'bin': os.urandom(4096)})
+                writer.write('b', {'bin': os.urandom(10)})
+                raise KeyError('b')
+
+        # Neither the shards of the export nor the previous index are kept
+        self.assertEqual(
+            [f for f in os.listdir(self.path) if f.startswith('error')], [])
+        self.assertEqual(writer.shards, [])
+        self.assertEqual(len(list_shards(self.path)), len(self.shards))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import os
+import uuid
+import unittest
+import multiprocessing
+
+import numpy as np
+
+from h3ds.dataset import H3DS
+from h3ds.shared import SharedSceneCache
+from h3ds.benchmark import SyntheticH3DS
+from tests.helpers import temporary_directory
+
+
+def child_checksum(prefix, scene_id, queue):
+    cache = SharedSceneCache(prefix)
+    mesh, images, masks, cameras = cache.load_scene(scene_id)
+    queue.put(
+        (float(mesh.vertices.sum()), int(images.sum()), images.flags.writeable))
+    del mesh, images, masks, cameras
+    cache.close()
+
+
+def child_load_scene(path, config_path, prefix, scene_id, queue):
+    h3ds = H3DS(path=path,
+                config_path=config_path,
+                shared_cache=SharedSceneCache(prefix))
+    mesh, images, masks, cameras = h3ds.load_scene(scene_id, as_array=True)
+    queue.put(
+        (float(mesh.vertices.sum()), int(images.sum()), images.flags.writeable))
+    del mesh, images, masks, cameras
+    h3ds.shared_cache.close()
+
+
+class TestSharedSceneCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dataset = SyntheticH3DS(temporary_directory(self),
+                                     subdivisions=1,
+                                     views=3,
+                                     image_size=16)
+        self.h3ds = self.dataset.h3ds()
+        self.cache = SharedSceneCache(f'h3ds_test_{uuid.uuid4().hex[:8]}')
+
+    def tearDown(self):
+        self.cache.unlink('synthetic')
+
+    def test_publish_and_load(self):
+        self.assertFalse('synthetic' in self.cache)
+        self.cache.publish(self.h3ds, 'synthetic')
+        self.assertTrue('synthetic' in self.cache)
+
+        mesh, images, masks, cameras = self.cache.load_scene('synthetic', '3')
+        mesh_ref, images_ref, masks_ref, cameras_ref = self.h3ds.load_scene(
+            'synthetic', '3')
+        self.assertTrue(np.array_equal(mesh.vertices, mesh_ref.vertices))
+        self.assertTrue(np.array_equal(mesh.faces, mesh_ref.faces))
+        self.assertFalse(mesh.vertices.flags.writeable)
+        self.assertEqual(images.shape, (3, 16, 16, 3))
+        for img, img_ref in zip(images, images_ref):
+            self.assertTrue(np.array_equal(img, np.asarray(img_ref)))
+        for (K, P), (K_ref, P_ref) in zip(cameras, cameras_ref):
+            self.assertTrue(np.allclose(K, K_ref))
+            self.assertTrue(np.allclose(P, P_ref))
+        del mesh, images, masks, cameras
+
+    def test_attach_from_other_process(self):
+        self.cache.publish(self.h3ds, 'synthetic')
+        mesh, images, _, _ = self.cache.load_scene('synthetic')
+        expected = (float(mesh.vertices.sum()), int(images.sum()), False)
+        del mesh, images
+
+        ctx = multiprocessing.get_context('spawn')
+        queue = ctx.Queue()
+        p = ctx.Process(target=child_checksum,
+                        args=(self.cache.prefix, 'synthetic', queue))
+        p.start()
+        result = queue.get(timeout=60)
+        p.join()
+        self.assertEqual(result, expected)
+
+        # The block survives the exit of the attached process
+        self.cache.close()
+        self.assertTrue('synthetic' in self.cache)
+
+    def test_h3ds_shared_cache(self):
+        self.cache.publish(self.h3ds, 'synthetic')
+        mesh_ref, images_ref, _, _ = self.h3ds.load_scene('synthetic',
+                                                          as_array=True)
+        expected = (float(mesh_ref.vertices.sum()), int(images_ref.sum()),
+                    False)
+
+        # The published scene is not read from the disk anymore
+        for f in self.h3ds.helper.scene_images('synthetic') + [
+                self.h3ds.helper.scene_mesh('synthetic'),
+                self.h3ds.helper.scene_cameras('synthetic')
+        ]:
+            os.remove(f)
+
+        ctx = multiprocessing.get_context('spawn')
+        queue = ctx.Queue()
+        processes = [
+            ctx.Process(target=child_load_scene,
+                        args=(self.dataset.path, self.dataset.config_path,
+                              self.cache.prefix, 'synthetic', queue))
+            for _ in range(2)
+        ]
+        for p in processes:
+            p.start()
+        results = [queue.get(timeout=60) for _ in processes]
+        for p in processes:
+            p.join()
+        self.assertEqual(results, [expected] * 2)
+
+        # Instances attached to the cache share the mesh and cameras, a copy
+        # is only made on request
+        h3ds_a, h3ds_b = (H3DS(path=self.dataset.path,
+                               config_path=self.dataset.config_path,
+                               shared_cache=self.cache) for _ in range(2))
+        mesh_a, mesh_b = h3ds_a.load_mesh('synthetic'), h3ds_b.load_mesh(
+            'synthetic')
+        for k in ['vertices', 'faces', 'vertex_normals']:
+            self.assertTrue(
+                np.shares_memory(getattr(mesh_a, k), getattr(mesh_b, k)))
+        self.assertFalse(mesh_a.vertices.flags.writeable)
+        self.assertTrue(np.array_equal(mesh_a.faces, mesh_ref.faces))
+        K_a, _ = h3ds_a.load_cameras('synthetic')[0]
+        K_b, _ = h3ds_b.load_cameras('synthetic')[0]
+        self.assertTrue(np.shares_memory(K_a, K_b))
+
+        mesh = h3ds_a.load_mesh('synthetic', copy=True)
+        self.assertTrue(mesh.vertices.flags.writeable)
+        self.assertFalse(np.shares_memory(mesh.vertices, mesh_a.vertices))
+
+        mesh, images, _, cameras = h3ds_a.load_scene('synthetic',
+                                                     '3',
+                                                     as_array=True)
+        self.assertTrue(np.shares_memory(mesh.vertices, mesh_a.vertices))
+        self.assertEqual(len(images), 3)
+        self.assertEqual(len(cameras), 3)
+        del mesh, mesh_a, mesh_b, K_a, K_b, images, cameras
+
+        # Published without normalization, so the normalized mesh is read from disk
+        self.assertRaises(FileNotFoundError, h3ds_a.load_mesh, 'synthetic',
+                          True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import zlib
+import shutil
+import tempfile
+import unittest
+
+from h3ds.store import ContentStore, content_key, damaged_files, diff_manifests, directory_manifest, file_key, load_manifest, save_manifest
+
+
+class TestStore(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write(self, name: str, data: bytes):
+        path = os.path.join(self.path, *name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_file_key(self):
+        data = os.urandom(3 * 2**20 + 7)
+        path = self.write('a/b.bin', data)
+        self.assertEqual(file_key(path), content_key(zlib.crc32(data),
+                                                     len(data)))
+        self.assertEqual(
+            directory_manifest(self.path, ['a/b.bin', 'a/missing.bin']),
+            {'a/b.bin': file_key(path)})
+
+    def test_diff_manifests(self):
+        diff = diff_manifests({
+            'a': '1',
+            'b': '2',
+            'c': '3'
+        }, {
+            'a': '1',
+            'b': '4',
+            'd': '5'
+        })
+        self.assertEqual(diff, {
+            'added': ['d'],
+            'changed': ['b'],
+            'removed': ['c'],
+            'unchanged': ['a']
+        })
+
+    def test_damaged_files(self):
+        manifest = {
+            name: file_key(self.write(name, os.urandom(100)))
+            for name in ['a', 'b', 'c']
+        }
+        os.remove(os.path.join(self.path, 'b'))
+        with open(os.path.join(self.path, 'c'), 'r+b') as f:
+            f.truncate(50)
+        self.assertEqual(damaged_files(self.path, manifest, ['a', 'b', 'c']),
+                         ['b', 'c'])
+
+    def test_manifest(self):
+        manifest_file = os.path.join(self.path, 'manifest.json')
+        self.assertIsNone(load_manifest(manifest_file))
+        save_manifest(manifest_file, '0.1', {'a': '1'})
+        self.assertEqual(load_manifest(manifest_file), {'a': '1'})
+
+    def test_content_store(self):
+        store = ContentStore(os.path.join(self.path, 'store'))
+        path = self.write('v1/a.txt', b'abc')
+        key = file_key(path)
+        self.assertFalse(key in store)
+        store.add(path, key)
+        self.assertTrue(key in store)
+
+        # Versions share the file
+        linked = os.path.join(self.path, 'v2', 'a.txt')
+        store.link(key, linked)
+        self.assertTrue(os.path.samefile(path, linked))
+
+        # Replacing a file in a version does not change the others
+        other = self.write('tmp.txt', b'def')
+        store.add(other, file_key(other))
+        store.link(file_key(other), linked)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'abc')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import os
+import unittest
+
+import numpy as np
+import trimesh
+
+from h3ds.mesh import Mesh
+from h3ds.visibility import rasterize_depth, visible_vertices, world_to_camera
+from h3ds.benchmark import SyntheticH3DS, SCENE_ID
+from tests.helpers import temporary_directory
+
+
+class TestVisibility(unittest.TestCase):
+
+    def setUp(self):
+        self.K = np.array([[20., 0., 8.], [0., 20., 8.], [0., 0., 1.]])
+        self.pose = np.eye(4)
+
+    def test_rasterize_depth(self):
+        # Tilted plane z = 4 + x covering the whole image, and a square in
+        # front of it
+        vertices = np.array([[-2., -4., 2.], [4., -4., 8.], [4., 4., 8.],
+                             [-2., 4., 2.], [0., 0., 1.], [.1, 0., 1.],
+                             [.1, .1, 1.], [0., .1, 1.]])
+        faces = np.array([[0, 1, 2], [0, 2, 3], [4, 5, 6], [4, 6, 7]])
+        depth = rasterize_depth(vertices, faces, self.K, 16, 16)
+        self.assertEqual(depth.shape, (16, 16))
+        self.assertTrue(np.all(np.isfinite(depth)))
+
+        # Depth of the plane along the ray of each pixel center
+        yy, xx = np.mgrid[:16, :16] + 0.5
+        x = (xx - 8.) / 20.
+        expected = 4. / (1. - x)
+        square = (xx > 8.) & (xx < 10.) & (yy > 8.) & (yy < 10.)
+        self.assertTrue(np.allclose(depth[~square], expected[~square]))
+        self.assertTrue(np.allclose(depth[square], 1.))
+
+    def test_behind_camera(self):
+        vertices = np.array([[-1., -1., -2.], [1., -1., -2.], [0., 1., -2.]])
+        depth = rasterize_depth(vertices, np.array([[0, 1, 2]]), self.K, 16, 16)
+        self.assertTrue(np.all(np.isinf(depth)))
+
+    def test_occlusion(self):
+        # A sphere hidden behind a larger one
+        front = trimesh.creation.icosphere(subdivisions=3, radius=1.)
+        back = trimesh.creation.icosphere(subdivisions=3, radius=.5)
+        vertices = np.concatenate(
+            [front.vertices + [0, 0, 5], back.vertices + [0, 0, 8]])
+        faces = np.concatenate([front.faces, back.faces + len(front.vertices)])
+        normals = np.concatenate([front.vertex_normals, back.vertex_normals])
+
+        masks = visible_vertices(vertices,
+                                 faces, [(self.K, self.pose)],
+                                 np.array([[16, 16]]),
+                                 normals=normals)
+        self.assertEqual(masks.shape, (1, len(vertices)))
+        visible = masks[0]
+        self.assertFalse(np.any(visible[len(front.vertices):]))
+
+        # Only the near side of the front sphere
+        near = front.vertices[:, 2] < -0.2
+        far = front.vertices[:, 2] > 0
+        self.assertTrue(np.all(visible[:len(front.vertices)][near]))
+        self.assertFalse(np.any(visible[:len(front.vertices)][far]))
+
+        # Without the front sphere, the back one is visible
+        masks = visible_vertices(back.vertices + [0, 0, 8],
+                                 back.faces, [(self.K, self.pose)],
+                                 np.array([[16, 16]]),
+                                 normals=back.vertex_normals)
+        self.assertTrue(np.all(masks[0][back.vertices[:, 2] < -0.1]))
+
+    def test_normals(self):
+        dataset = SyntheticH3DS(temporary_directory(self),
+                                subdivisions=3,
+                                views=4,
+                                image_size=64)
+        mesh = dataset.mesh
+        h3ds = dataset.h3ds()
+        cameras = h3ds.load_cameras(SCENE_ID)
+        sizes = np.full((len(cameras), 2), 64)
+
+        masks = visible_vertices(mesh.vertices,
+                                 mesh.faces,
+                                 cameras,
+                                 sizes,
+                                 normals=mesh.vertex_normals)
+        for (_, pose), visible in zip(cameras, masks):
+            facing = np.einsum('ij,ij->i', mesh.vertex_normals,
+                               pose[:3, 3] - mesh.vertices)
+            self.assertTrue(np.all(facing[visible] > 0))
+            self.assertTrue(0.3 < np.mean(visible) < 0.5)
+
+            # Visible vertices project inside the image
+            points = world_to_camera(mesh.vertices[visible], pose)
+            self.assertTrue(np.all(points[:, 2] > 0))
+
+
+class TestLoadVisibility(unittest.TestCase):
+
+    def setUp(self):
+        self.dataset = SyntheticH3DS(temporary_directory(self),
+                                     subdivisions=3,
+                                     views=6,
+                                     image_size=64)
+        self.h3ds = self.dataset.h3ds()
+
+    def test_load_visibility(self):
+        visibility_file = self.h3ds.helper.scene_visibility(SCENE_ID)
+        visible = self.h3ds.load_visibility(SCENE_ID, '3')
+        self.assertEqual(visible.shape, (len(self.dataset.mesh.vertices),))
+        self.assertEqual(visible.dtype, bool)
+        self.assertTrue(os.path.exists(visibility_file))
+
+        # Only the views of the configuration are computed
+        with np.load(visibility_file) as data:
+            self.assertEqual(
+                np.flatnonzero(data['computed']).tolist(), [0, 2, 4])
+
+        # The union of the views sees more than any single one
+        all_views = self.h3ds.load_visibility(SCENE_ID)
+        self.assertTrue(np.all(all_views[visible]))
+        self.assertGreaterEqual(all_views.sum(), visible.sum())
+
+        # The stored masks are reused
+        h3ds = self.dataset.h3ds()
+        self.assertTrue(
+            np.array_equal(h3ds.load_visibility(SCENE_ID, '3'), visible))
+
+    def test_evaluate_scene(self):
+        mesh_pred = Mesh().load(self.h3ds.helper.scene_mesh(SCENE_ID))
+        visible = self.h3ds.load_visibility(SCENE_ID, '3')
+
+        chamfer_gt_pred, _, mesh_gt, _ = self.h3ds.evaluate_scene(
+            SCENE_ID, mesh_pred, views_config_id='3')
+        self.assertEqual(len(chamfer_gt_pred), visible.sum())
+        self.assertTrue(
+            np.allclose(mesh_gt.vertices,
+                        self.dataset.mesh.vertices[visible],
+                        atol=1e-4))
+
+        # Intersected with the region
+        region = self.h3ds.load_region(SCENE_ID, 'face')
+        chamfer_gt_pred, _, _, _ = self.h3ds.evaluate_scene(SCENE_ID,
+                                                            mesh_pred,
+                                                            region_id='face',
+                                                            views_config_id='3')
+        self.assertEqual(len(chamfer_gt_pred), visible[region].sum())
+
+
+if __name__ == '__main__':
+    unittest.main()